@@ -0,0 +1,6 @@
+from scan_explorer_service import app
+from scan_explorer_service.asgi import create_asgi_app
+
+# Image routes are served asynchronously, everything else by the Flask app, e.g.
+# uvicorn asgi:application --port 8181
+application = create_asgi_app(app)
@@ -1,8 +1,10 @@
 import os
 import sys
+import click
 from adsmutils import ADSFlask
 from .views import *
 from .extensions import *
+from .utils.article_pdf import index_article_pdfs
 
 def register_extensions(app: ADSFlask):
     """ Register extensions.
@@ -26,6 +28,9 @@ def register_views(app: ADSFlask):
     app.register_blueprint(bp_manifest)
     app.register_blueprint(bp_metadata)
     app.register_blueprint(bp_proxy)
+    app.register_blueprint(bp_pdf)
+    app.register_blueprint(bp_sprite)
+    app.register_blueprint(bp_image_admin)
 
     @app.after_request
     def after_request(response):
@@ -38,6 +43,21 @@ def register_views(app: ADSFlask):
         return response
 
 
+def register_commands(app: ADSFlask):
+    """ Register the maintenance tasks run with `flask <command>`.
+    Args:
+        app (ADSFlask): Application object
+    """
+
+    @app.cli.command('index-article-pdfs')
+    @click.option('--collection', default=None, help='Index the articles of this collection only')
+    def index_article_pdfs_command(collection):
+        """Record which articles have a pre-rendered PDF from a listing of the PDF bucket."""
+        with app.session_scope() as session:
+            articles, found = index_article_pdfs(session, collection)
+        click.echo(f'{articles} articles, {found} with a pre-rendered PDF')
+
+
 def create_app(**config):
     """ Create application and initialize dependencies.
 
@@ -57,6 +77,7 @@ def create_app(**config):
 
     register_views(app)
     register_extensions(app)
+    register_commands(app)
 
     if app.config['ENV'] == "development":
         app.debug = True
@@ -0,0 +1,346 @@
+import asyncio
+import math
+import os
+import json
+from urllib import parse as urlparse
+from werkzeug.http import parse_etags, unquote_etag
+from scan_explorer_service.utils.image_cache import get_image_cache
+from scan_explorer_service.utils.http_utils import make_etag, forwardable_headers
+from scan_explorer_service.utils.upstream import UpstreamUnavailable, get_breaker, get_retry_budget, backoff_delay
+from scan_explorer_service.utils.image_utils import forwarded_headers, upstream_url, upstream_headers
+from scan_explorer_service.utils.prefetch import record_prefetch_hit
+from scan_explorer_service.views.image_proxy import thumbnail_path, local_image_info, passthrough_source, \
+    open_source_image, source_image_url, schedule_prefetch
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+IIIF_PREFIX = '/image/iiif/2/'
+THUMBNAIL_PATH = '/image/thumbnail'
+CHUNK_SIZE = 64*1024
+
+
+class AsyncImageProxy:
+    """
+    ASGI implementation of the /image/iiif/2/<path> and /image/thumbnail routes.
+
+    Upstream responses are streamed with an async HTTP client, so a slow client costs an
+    open socket rather than a worker. Each chunk is only read from the image server once the
+    previous one was handed to the ASGI server, which gives backpressure all the way to the
+    image server. Configuration, the circuit breaker, the retry budget, the disk cache and
+    the prefetch of following pages are shared with the Flask app. Metrics, Server-Timing and
+    the coalescing of identical requests are only implemented by the Flask app.
+    """
+
+    def __init__(self, flask_app):
+        if httpx is None:
+            raise ImportError("The asynchronous image proxy requires httpx")
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.client = None
+
+    def _create_client(self):
+        config = self.config
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=config.get('IMAGE_PROXY_ASYNC_MAX_CONNECTIONS', 1000),
+                                max_keepalive_connections=config.get('IMAGE_PROXY_POOL_MAXSIZE', 20)),
+            timeout=httpx.Timeout(config.get('IMAGE_PROXY_READ_TIMEOUT', 60),
+                                  connect=config.get('IMAGE_PROXY_CONNECT_TIMEOUT', 5)),
+            follow_redirects=False)
+
+    def _sync(self, fn, *args):
+        """Call a helper of the Flask app that expects an app context."""
+        with self.flask_app.app_context():
+            return fn(*args)
+
+    async def _run_in_thread(self, fn, *args):
+        """Run a blocking helper, e.g. a database lookup, in the default thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(None, self._sync, fn, *args)
+
+    async def startup(self):
+        self.client = self._create_client()
+
+    async def shutdown(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if self.client is None:
+            await self.startup()
+
+        path = scope['path']
+        if scope['method'] not in ('GET', 'HEAD'):
+            await send_json(send, 405, {'Message': 'Method not allowed'})
+        elif path.startswith(IIIF_PREFIX):
+            await self.image_proxy(scope, receive, send, path[len(IIIF_PREFIX):])
+        elif path.rstrip('/') == THUMBNAIL_PATH:
+            await self.image_proxy_thumbnail(scope, receive, send)
+        else:
+            await send_json(send, 404, {'Message': 'Not found'})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def image_proxy_thumbnail(self, scope, receive, send):
+        """Resolve the thumbnail path of an item (index lookup, database on a miss) and proxy it"""
+        args = dict(urlparse.parse_qsl(scope['query_string'].decode()))
+        try:
+            id = args.get('id').replace(" ", "+")
+            path = await self._run_in_thread(thumbnail_path, id, args.get('type'))
+        except Exception as e:
+            await send_json(send, 400, {'Message': str(e)})
+            return
+        await self.image_proxy(dict(scope, query_string=b''), receive, send, path)
+
+    async def image_proxy(self, scope, receive, send, path):
+        """Proxy in between the image server and the user"""
+        received = [(key.decode('latin-1'), value.decode('latin-1')) for key, value in scope['headers']]
+        req_headers = forwardable_headers(received)
+        lookup = {key.lower(): value for key, value in received}
+        req_headers.update(self._sync(forwarded_headers))
+
+        if scope['method'] == 'GET' and path.endswith('/info.json') and self.config.get('IMAGE_INFO_FROM_DB', True):
+            info = await self._run_in_thread(local_image_info, path.strip('/')[:-len('/info.json')])
+            if info is not None:
+                await self.image_info_response(send, lookup, info)
+                return
+
+        source = self._sync(passthrough_source, path)
+        if source is not None and await self.passthrough_image_response(scope, send, lookup, *source):
+            return
+
+        path_etag = make_etag('image', path.strip('/'))
+        # the disk cache is read and written in the default thread pool, a lookup can stat
+        # files and a commit can walk the whole cache directory to evict entries
+        cache = await self._run_in_thread(get_image_cache) if scope['method'] == 'GET' else None
+        if cache is not None and 'range' not in lookup:
+            self._sync(schedule_prefetch, path)
+            cached = await asyncio.get_running_loop().run_in_executor(None, cache.get, path)
+            if cached is not None:
+                self._sync(record_prefetch_hit, path)
+                try:
+                    await self.cached_image_response(send, lookup, *cached)
+                    return
+                except OSError:
+                    pass
+
+        if not_modified(lookup, path_etag):
+            await send_headers(send, 304, [('ETag', f'"{path_etag}"')], more_body=False)
+            return
+
+        url = self._sync(upstream_url, path)
+        if scope['query_string']:
+            url += '?' + scope['query_string'].decode('latin-1')
+        try:
+            r = await self.upstream_image(scope['method'], url, req_headers)
+        except UpstreamUnavailable as e:
+            headers = [('Retry-After', str(math.ceil(e.retry_after)))] if e.retry_after else []
+            await send_json(send, e.status, {'Message': str(e)}, headers)
+            return
+        await self.streamed_image_response(send, receive, r, path, path_etag, cache)
+
+    async def image_info_response(self, send, lookup, info):
+        """Serve an info.json built from the database."""
+        etag = make_etag('info', info)
+        if not_modified(lookup, etag):
+            await send_headers(send, 304, [('ETag', f'"{etag}"')], more_body=False)
+            return
+        body = info.encode()
+        await send_headers(send, 200, [('Content-Type', 'application/json'), ('Content-Length', len(body)), ('ETag', f'"{etag}"'),
+                                       ('Cache-Control', f'public, max-age={self.config.get("IMAGE_INFO_MAX_AGE", 86400)}')])
+        await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+    async def passthrough_image_response(self, scope, send, lookup, object_name, mimetype):
+        """Serve a source image straight from S3, reading the body in the default thread pool.
+        Returns False when S3 cannot serve it and the request must go through the image server."""
+        if self.config.get('IMAGE_PASSTHROUGH') == 'redirect':
+            url = await self._run_in_thread(source_image_url, object_name)
+            await send_headers(send, 302, [('Location', url), ('Cache-Control', 'no-store')], more_body=False)
+            return True
+
+        byte_range = lookup.get('range') if lookup.get('range', '').count(',') == 0 else None
+        opened = await self._run_in_thread(open_source_image, object_name, mimetype, lookup.get('if-none-match'), byte_range)
+        if opened is None:
+            return False
+        status, headers, body = opened
+        if body is None:
+            await send_headers(send, status, headers, more_body=False)
+            return True
+
+        loop = asyncio.get_running_loop()
+        try:
+            await send_headers(send, status, headers, more_body=scope['method'] == 'GET')
+            if scope['method'] == 'GET':
+                while True:
+                    chunk = await loop.run_in_executor(None, body.read, CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            body.close()
+        return True
+
+    async def upstream_image(self, method, url, req_headers):
+        """Send a request to the image server, retrying like the synchronous proxy does.
+        The returned response is open and must be closed by the caller."""
+        config = self.config
+        retries = config.get('IMAGE_PROXY_RETRIES', 1)
+        retry_delay = config.get('IMAGE_PROXY_RETRY_DELAY', 0.5)
+        retry_max_delay = config.get('IMAGE_PROXY_RETRY_MAX_DELAY', 2)
+        retry_statuses = config.get('IMAGE_PROXY_RETRY_STATUSES', [500, 502, 503, 504])
+
+        breaker = self._sync(get_breaker)
+        budget = self._sync(get_retry_budget)
+        budget.deposit()
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise UpstreamUnavailable('Image server unavailable', 503, retry_after=breaker.retry_after())
+
+            r, error = None, None
+            try:
+                r = await self.client.send(self.client.build_request(method, url, headers=req_headers), stream=True)
+            except httpx.TimeoutException as e:
+                error = UpstreamUnavailable(f'Image server timed out: {e}', 504)
+            except httpx.TransportError as e:
+                error = UpstreamUnavailable(f'Image server unreachable: {e}', 502)
+            finally:
+                # also releases the probe of a half-open breaker on any other exception, e.g. a cancellation
+                breaker.record(r is not None and r.status_code < 500)
+            if r is not None and r.status_code not in retry_statuses:
+                return r
+
+            if attempt >= retries or not budget.withdraw():
+                if r is not None:
+                    return r
+                raise error
+
+            if r is not None:
+                await r.aclose()
+            await asyncio.sleep(backoff_delay(attempt, retry_delay, retry_max_delay))
+            attempt += 1
+
+    async def streamed_image_response(self, send, receive, r, path, path_etag, cache):
+        """Stream an upstream response, writing it to the disk cache when enabled.
+        Streaming stops, and the upstream connection is released, as soon as the client disconnects."""
+        loop = asyncio.get_running_loop()
+        headers = upstream_headers(r, path_etag)
+        writer = None
+        if cache is not None and r.status_code == 200 and not r.headers.get('Content-Encoding'):
+            writer = await loop.run_in_executor(None, cache.writer, path, headers)
+        if cache is not None:
+            headers.append(('X-Cache', 'MISS'))
+
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    disconnected.set()
+                    return
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await send_headers(send, r.status_code, headers)
+            async for chunk in r.aiter_raw(CHUNK_SIZE):
+                if disconnected.is_set():
+                    break
+                if writer is not None:
+                    await loop.run_in_executor(None, writer.write, chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            else:
+                if writer is not None:
+                    await loop.run_in_executor(None, writer.commit)
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            watcher.cancel()
+            if writer is not None:
+                await loop.run_in_executor(None, writer.abort)
+            await r.aclose()
+
+    async def cached_image_response(self, send, lookup, body_path, headers):
+        """Serve a derivative from the disk cache, answering conditional requests from the recorded ETag."""
+        stored = {name.lower(): value for name, value in headers}
+        etag = unquote_etag(stored['etag'])[0] if 'etag' in stored else None
+        headers = [(name, value) for name, value in headers] + [('X-Cache', 'HIT')]
+        if etag is not None and not_modified(lookup, etag):
+            await send_headers(send, 304, headers, more_body=False)
+            return
+
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, body_path, 'rb')
+        try:
+            headers.append(('Content-Length', os.fstat(f.fileno()).st_size))
+            await send_headers(send, 200, headers)
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            f.close()
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+def not_modified(lookup, etag):
+    """Check an If-None-Match request header, given in a dict of lower case header names, against an entity tag."""
+    return 'if-none-match' in lookup and parse_etags(lookup['if-none-match']).contains_weak(etag)
+
+
+async def send_headers(send, status, headers, more_body=True):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers],
+    })
+    if not more_body:
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode()
+    await send_headers(send, status, [('Content-Type', 'application/json'), ('Content-Length', len(body))] + list(headers))
+    await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+
+def create_asgi_app(flask_app):
+    """Serve the image routes asynchronously and every other route through the Flask app.
+
+    Requires httpx, and asgiref to mount the Flask app."""
+    if WsgiToAsgi is None:
+        raise ImportError("Mounting the Flask app in the ASGI app requires asgiref")
+    proxy = AsyncImageProxy(flask_app)
+    wsgi = WsgiToAsgi(flask_app)
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await proxy.lifespan(receive, send)
+        elif scope['type'] == 'http' and (scope['path'].startswith(IIIF_PREFIX) or
+                                          scope['path'].rstrip('/') == THUMBNAIL_PATH):
+            await proxy(scope, receive, send)
+        else:
+            await wsgi(scope, receive, send)
+
+    return app
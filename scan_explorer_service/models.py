@@ -178,6 +178,11 @@ class Page(Base, Timestamp):
         url = f'{self.image_url}/square/480,480/0/{self.image_color_quality}.jpg'
         return url
 
+    @property
+    def thumbnail_path(self):
+        """IIIF path of the thumbnail, relative to the image proxy"""
+        return f'{self.image_path}/square/480,480/0/{self.image_color_quality}.jpg'
+
     @property
     def image_color_quality(self):
         if self.color_type == PageColor.BW:
@@ -1,6 +1,7 @@
 from flask_testing import TestCase
 import testing.postgresql
 from scan_explorer_service.models import Base
+import scan_explorer_service.utils.cache as cache_mod
 
 class TestCaseDatabase(TestCase):
     """
@@ -47,5 +48,7 @@ class TestCaseDatabase(TestCase):
         Base.metadata.create_all(bind=self.app.db.engine)
 
     def tearDown(self):
+        cache_mod._thumbnail_local.clear()
+        cache_mod._sprite_local.clear()
         self.app.db.session.remove()
         self.app.db.drop_all()
@@ -0,0 +1,130 @@
+"""
+Compare the time and memory of S3Provider.read_object_s3 with a single download and with
+parallel ranged GETs, against a local S3 stand-in that limits the bandwidth of every connection.
+
+    python -m scan_explorer_service.tests.benchmark_s3_download [--sizes MB ...] [--stream-mbps N] [--latency S]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import tracemalloc
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import Flask
+from scan_explorer_service.utils.s3_utils import S3Provider
+
+BUCKET = 'benchmark'
+CHUNK_SIZE = 64*1024
+
+
+class S3StandIn(BaseHTTPRequestHandler):
+    """HEAD and GET of in-memory objects with single ranges and If-Match, sent at `stream_bps`
+    bytes per second per connection after `latency` seconds, like a single S3 stream."""
+
+    protocol_version = 'HTTP/1.1'
+    objects = {}
+    stream_bps = 50*1024*1024
+    latency = 0.02
+
+    def log_message(self, format, *args):
+        pass
+
+    def _object(self):
+        key = self.path.split('?', 1)[0].split('/', 2)[-1]
+        return key, self.objects.get(key)
+
+    def _headers(self, status, length, extra=()):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Last-Modified', formatdate(0, usegmt=True))
+        for name, value in extra:
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _error(self, status, code):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code></Error>'.encode()
+        self._headers(status, len(body), [('Content-Type', 'application/xml')])
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        key, data = self._object()
+        if data is None:
+            return self._error(404, 'NoSuchKey')
+        self._headers(200, len(data), [('ETag', f'"{key}"'), ('Accept-Ranges', 'bytes')])
+
+    def do_GET(self):
+        key, data = self._object()
+        if data is None:
+            return self._error(404, 'NoSuchKey')
+        if self.headers.get('If-Match') not in (None, f'"{key}"'):
+            return self._error(412, 'PreconditionFailed')
+        start, end, status, extra = 0, len(data), 200, [('ETag', f'"{key}"')]
+        if self.headers.get('Range'):
+            first, last = self.headers['Range'].split('=', 1)[1].split('-')
+            start, end = int(first), min(int(last) + 1, len(data)) if last else len(data)
+            if start >= len(data):
+                return self._error(416, 'InvalidRange')
+            status = 206
+            extra.append(('Content-Range', f'bytes {start}-{end - 1}/{len(data)}'))
+        time.sleep(self.latency)
+        self._headers(status, end - start, extra)
+        sent = time.monotonic()
+        for offset in range(start, end, CHUNK_SIZE):
+            chunk = data[offset:min(offset + CHUNK_SIZE, end)]
+            self.wfile.write(chunk)
+            sent += len(chunk) / self.stream_bps
+            time.sleep(max(0, sent - time.monotonic()))
+
+
+
+
+def measure(s3, key):
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = s3.read_object_s3(key)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return data, seconds, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 32, 128], help='object sizes in MB')
+    parser.add_argument('--stream-mbps', type=float, default=50, help='bandwidth of every connection in MB/s')
+    parser.add_argument('--latency', type=float, default=0.02, help='time to first byte in seconds')
+    parser.add_argument('--modes', nargs='+', default=['1', '4x8', '8x8', '8x4'],
+                        help='1 for a single download or CONCURRENCYxPART_MB for ranged GETs')
+    args = parser.parse_args(argv)
+
+    S3StandIn.stream_bps = args.stream_mbps * 1024 * 1024
+    S3StandIn.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), S3StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        os.environ.setdefault(name, 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    app = Flask(__name__)
+    print(f'{"MB":>5} {"mode":<10} {"seconds":>8} {"MB/s":>8} {"peak MB":>8}')
+    with app.app_context():
+        for size in args.sizes:
+            key = f'object-{size}'
+            S3StandIn.objects[key] = os.urandom(size * 1024 * 1024)
+            for mode in args.modes:
+                concurrency, _, part_mb = mode.partition('x')
+                config = {'AWS_BUCKET_NAME_IMAGE': BUCKET, 'S3_ENDPOINT_URL': f'http://127.0.0.1:{server.server_port}',
+                          'S3_DOWNLOAD_CONCURRENCY': int(concurrency), 'S3_DOWNLOAD_PART_SIZE': int(part_mb or 8) * 1024 * 1024}
+                data, seconds, peak = measure(S3Provider(config, 'AWS_BUCKET_NAME_IMAGE'), key)
+                assert data == S3StandIn.objects[key]
+                del data
+                print(f'{size:>5} {mode:<10} {seconds:>8.2f} {size / seconds:>8.1f} {peak / 1024 / 1024:>8.1f}')
+            del S3StandIn.objects[key]
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
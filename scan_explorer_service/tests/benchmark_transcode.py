@@ -0,0 +1,95 @@
+"""
+Compare the size and generation time of PDFs built from page images as they are and transcoded.
+
+    python -m scan_explorer_service.tests.benchmark_transcode [--pages N] [--workers N] [--quality Q] [BW|Grayscale|Color=path ...]
+
+Without page images, synthetic 600 dpi scans of text are used for every color type.
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageChops, ImageDraw
+from scan_explorer_service.utils.pdf_stream import StreamingPdfWriter
+from scan_explorer_service.utils.transcode import transcode_page
+
+COLOR_TYPES = ('BW', 'Grayscale', 'Color')
+
+
+def synthetic_page(color_type, width=2550, height=3300, seed=0):
+    """An uncompressed TIFF of a letter size page of text at 600 dpi with some scanner noise."""
+    rnd = random.Random(seed)
+    im = Image.new('L', (width, height), 235)
+    draw = ImageDraw.Draw(im)
+    for y in range(300, height - 300, 60):
+        x = 250
+        while x < width - 400:
+            word = rnd.randint(40, 200)
+            draw.rectangle((x, y, x + word, y + 30), fill=rnd.randint(10, 60))
+            x += word + 30
+    im = ImageChops.add(im, Image.effect_noise((width, height), 8), offset=-128)
+    if color_type == 'Color':
+        im = Image.merge('RGB', (im, im, im.point(lambda v: v * 0.9)))
+    elif color_type == 'BW':
+        im = im.point(lambda v: 255 if v > 128 else 0).convert('1')
+    data = io.BytesIO()
+    im.save(data, 'TIFF', dpi=(600, 600))
+    return data.getvalue()
+
+
+def build_pdf(images):
+    writer = StreamingPdfWriter()
+    return sum(len(writer.add_image(im)) for im in images) + len(writer.close())
+
+
+def run(color_type, source, pages, workers, quality):
+    images = [source] * pages
+    results = []
+
+    start = time.perf_counter()
+    size = build_pdf(images)
+    results.append(('as is', size, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    size = build_pdf(transcode_page(im, color_type, quality) for im in images)
+    results.append(('transcoded, 1 process', size, time.perf_counter() - start))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # start the processes before timing
+        list(executor.map(abs, range(workers)))
+        start = time.perf_counter()
+        size = build_pdf(executor.map(transcode_page, images, [color_type] * pages, [quality] * pages))
+        results.append((f'transcoded, {workers} processes', size, time.perf_counter() - start))
+
+    for name, size, seconds in results:
+        print(f'{color_type:<10} {name:<25} {size / pages / 1024:>10.1f} {seconds / pages * 1000:>10.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--quality', type=int, default=75)
+    parser.add_argument('images', nargs='*', metavar='COLOR_TYPE=PATH')
+    args = parser.parse_args(argv)
+
+    sources = {}
+    for arg in args.images:
+        color_type, path = arg.split('=', 1)
+        if color_type not in COLOR_TYPES:
+            parser.error(f'Unknown color type {color_type}')
+        with open(path, 'rb') as f:
+            sources[color_type] = f.read()
+    if not sources:
+        sources = {color_type: synthetic_page(color_type) for color_type in COLOR_TYPES}
+
+    print(f'{"page":<10} {"images":<25} {"KiB/page":>10} {"ms/page":>10}')
+    for color_type, source in sources.items():
+        run(color_type, source, args.pages, args.workers, args.quality)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from scan_explorer_service.tests.base import TestCaseDatabase
+from scan_explorer_service.models import Base, Collection, Page
+import scan_explorer_service.utils.upstream as upstream_mod
+import scan_explorer_service.utils.image_cache as image_cache_mod
+
+try:
+    import httpx
+    from scan_explorer_service.asgi import AsyncImageProxy
+except ImportError:
+    httpx = None
+
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+class TestAsyncImageProxy(TestCaseDatabase):
+    """Tests for the ASGI implementation of the image proxy."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PROXY_RETRY_DELAY': 0,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        upstream_mod.reset_resilience()
+        self.upstream_calls = []
+
+    def tearDown(self):
+        upstream_mod.reset_resilience()
+        super().tearDown()
+
+    def _proxy(self, handler):
+        proxy = AsyncImageProxy(self.app)
+        proxy.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return proxy
+
+    def _get(self, proxy, path, query_string=b'', headers=()):
+        """Run a GET request through the ASGI app, returning (status, headers, body)."""
+        sent = []
+
+        async def receive():
+            await asyncio.sleep(60)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string,
+                 'headers': [(k.lower().encode(), v.encode()) for k, v in headers]}
+        asyncio.run(proxy(scope, receive, send))
+        start = sent[0]
+        return (start['status'],
+                {k.decode(): v.decode() for k, v in start['headers']},
+                b''.join(message.get('body', b'') for message in sent[1:]))
+
+    def test_streams_image(self):
+        """Verifies that an upstream image is streamed chunk by chunk with the forwarded headers."""
+        def handler(request):
+            self.upstream_calls.append(request)
+            return httpx.Response(200, headers={'Content-Type': 'image/jpeg'},
+                                  stream=httpx.ByteStream(b'x' * 200000))
+
+        status, headers, body = self._get(self._proxy(handler), '/image/iiif/2/some-~image/full/full/0/default.jpg')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body), 200000)
+        self.assertEqual(headers['content-type'], 'image/jpeg')
+        self.assertIn('etag', headers)
+        self.assertEqual(len(self.upstream_calls), 1)
+        self.assertIn('x-forwarded-host', self.upstream_calls[0].headers)
+
+    def test_hop_by_hop_headers_not_forwarded(self):
+        """Verifies that connection-specific request headers are not forwarded to the image server."""
+        def handler(request):
+            self.upstream_calls.append(request)
+            return httpx.Response(200, stream=httpx.ByteStream(b'image'))
+
+        self._get(self._proxy(handler), '/image/iiif/2/some-~image/full/full/0/default.jpg',
+                  headers=[('Connection', 'close, X-Trace'), ('Keep-Alive', 'timeout=5'), ('X-Trace', '1'),
+                           ('Proxy-Authorization', 'Basic abc'), ('User-Agent', 'viewer')])
+        headers = self.upstream_calls[0].headers
+        self.assertNotEqual(headers.get('connection'), 'close, X-Trace')
+        for name in ('keep-alive', 'x-trace', 'proxy-authorization'):
+            self.assertNotIn(name, headers)
+        self.assertEqual(headers['user-agent'], 'viewer')
+
+    def test_disk_cache_off_event_loop(self):
+        """Verifies that images are cached and served from the disk cache without blocking the event loop."""
+        def handler(request):
+            self.upstream_calls.append(request)
+            return httpx.Response(200, headers={'Content-Type': 'image/jpeg'}, stream=httpx.ByteStream(b'image'))
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        self.addCleanup(image_cache_mod.reset_image_cache)
+        self.app.config['IMAGE_CACHE_DIR'] = cache_dir
+        cache_threads = []
+        cache_class = image_cache_mod.DiskImageCache
+        get, publish = cache_class.get, cache_class._publish
+
+        def recording(method):
+            def wrapper(*args):
+                cache_threads.append(threading.current_thread())
+                return method(*args)
+            return wrapper
+
+        proxy = self._proxy(handler)
+        with patch.object(cache_class, 'get', recording(get)), patch.object(cache_class, '_publish', recording(publish)):
+            status, headers, _ = self._get(proxy, '/image/iiif/2/some-~image/full/full/0/default.jpg')
+            self.assertEqual(headers['x-cache'], 'MISS')
+            status, headers, body = self._get(proxy, '/image/iiif/2/some-~image/full/full/0/default.jpg')
+        self.assertEqual(headers['x-cache'], 'HIT')
+        self.assertEqual(body, b'image')
+        self.assertEqual(len(self.upstream_calls), 1)
+        self.assertEqual(len(cache_threads), 3)
+        self.assertNotIn(threading.main_thread(), cache_threads)
+
+    def test_not_modified(self):
+        """Verifies that a matching If-None-Match is answered without contacting the image server."""
+        def handler(request):
+            self.upstream_calls.append(request)
+            return httpx.Response(200, stream=httpx.ByteStream(b'image'))
+
+        proxy = self._proxy(handler)
+        _, headers, _ = self._get(proxy, '/image/iiif/2/some-~image/full/full/0/default.jpg')
+        status, _, body = self._get(proxy, '/image/iiif/2/some-~image/full/full/0/default.jpg',
+                                    headers=[('If-None-Match', headers['etag'])])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(len(self.upstream_calls), 1)
+
+    def test_retries_and_reports_unavailable(self):
+        """Verifies that upstream failures are retried and end in a 502 when the server stays unreachable."""
+        def handler(request):
+            self.upstream_calls.append(request)
+            raise httpx.ConnectError('refused')
+
+        status, _, _ = self._get(self._proxy(handler), '/image/iiif/2/some-~image/full/full/0/default.jpg')
+        self.assertEqual(status, 502)
+        self.assertEqual(len(self.upstream_calls), 2)
+
+    @patch('scan_explorer_service.asgi.thumbnail_path', return_value='page-~path/square/480,480/0/gray.jpg')
+    def test_thumbnail(self, mock_thumbnail_path):
+        """Verifies that the thumbnail route resolves the item's path and proxies it."""
+        def handler(request):
+            self.upstream_calls.append(request)
+            return httpx.Response(200, stream=httpx.ByteStream(b'thumb'))
+
+        status, _, body = self._get(self._proxy(handler), '/image/thumbnail', b'id=1988ApJ...333..341R&type=article')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'thumb')
+        mock_thumbnail_path.assert_called_once_with('1988ApJ...333..341R', 'article')
+        self.assertTrue(str(self.upstream_calls[0].url).endswith('page-~path/square/480,480/0/gray.jpg'))
+
+    def test_info_from_database(self):
+        """Verifies that info.json is built from the page dimensions, with the public URL of the image."""
+        collection = Collection(type='type', journal='journal', volume='volume')
+        self.app.db.session.add(collection)
+        self.app.db.session.commit()
+        page = Page(name='page', collection_id=collection.id, volume_running_page_num=1, width=100, height=200)
+        self.app.db.session.add(page)
+        self.app.db.session.commit()
+
+        status, _, body = self._get(self._proxy(self.upstream_calls.append), f'/image/iiif/2/{page.image_path}/info.json')
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)['@id'].endswith(f'/image/iiif/2/{page.image_path}'))
+        self.assertEqual(self.upstream_calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,14 @@
 import unittest
 import json
-import sys
+import tempfile
+import time
 import redis as redis_lib
 from flask import url_for
 from unittest.mock import patch, MagicMock
 from werkzeug.datastructures import ImmutableMultiDict
 from scan_explorer_service.tests.base import TestCaseDatabase
 from scan_explorer_service.models import Base, Collection, Page, Article
-from scan_explorer_service.views.image_proxy import fetch_images
+from scan_explorer_service.utils.page_images import fetch_images, PDF_SPILLED_PAGES
 from scan_explorer_service.views.metadata import _make_search_cache_key
 import scan_explorer_service.utils.cache as cache_mod
 
@@ -103,6 +104,20 @@ class TestRedisReconnection(TestCaseDatabase):
         m._get_redis()
         self.assertEqual(mock_from_url.call_count, 1)
 
+    @patch('scan_explorer_service.utils.cache.redis.from_url')
+    def test_set_many_is_chunked(self, mock_from_url):
+        """Verify that many values are written in pipelines of REDIS_PIPELINE_CHUNK commands."""
+        m = cache_mod
+        mock_client = MagicMock()
+        mock_client.ping.return_value = True
+        mock_from_url.return_value = mock_client
+
+        with patch.object(m, 'REDIS_PIPELINE_CHUNK', 10):
+            m._redis_set_many('prefix:', {str(i): '1' for i in range(25)}, 60)
+        pipe = mock_client.pipeline.return_value
+        self.assertEqual(pipe.setex.call_count, 25)
+        self.assertEqual(pipe.execute.call_count, 3)
+
 
 class TestManifestCaching(TestCaseDatabase):
     """Verify manifest and search results are cached in Redis and served on subsequent requests."""
@@ -189,7 +204,7 @@ class TestManifestCaching(TestCaseDatabase):
 
 
 class TestFetchImagesMemoryLimit(TestCaseDatabase):
-    """Verify fetch_images respects memory_limit and stops yielding when exceeded."""
+    """Verify fetch_images spills images to disk beyond memory_limit instead of truncating."""
 
     def create_app(self):
         from scan_explorer_service.app import create_app
@@ -220,21 +235,63 @@ class TestFetchImagesMemoryLimit(TestCaseDatabase):
             self.app.db.session.add(p)
         self.app.db.session.commit()
 
-    @patch('scan_explorer_service.views.image_proxy.S3Provider')
-    def test_memory_limit_stops_yielding(self, mock_s3_cls):
-        """Verify fetch_images stops yielding once cumulative image size exceeds memory_limit."""
-        chunk = b'x' * 30
-        chunk_size = sys.getsizeof(chunk)
-
+    def _mock_s3(self, mock_s3_cls):
+        chunks = [bytes([i]) * 30 for i in range(5)]
         mock_s3 = MagicMock()
-        mock_s3.read_object_s3.return_value = chunk
+        mock_s3.read_object_s3.side_effect = lambda object_name: chunks[int(object_name.split('page')[-1].split('.')[0])]
         mock_s3_cls.return_value = mock_s3
+        return mock_s3, chunks
+
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
+    def test_memory_limit_yields_every_page(self, mock_s3_cls):
+        """Verify fetch_images yields every page in order when the images do not fit within memory_limit."""
+        mock_s3, chunks = self._mock_s3(mock_s3_cls)
 
-        memory_limit = chunk_size * 2 + 1
         images = list(fetch_images(
-            self.app.db.session, self.collection, 1, 5, 100, memory_limit))
-        self.assertEqual(len(images), 2)
-        self.assertTrue(mock_s3.read_object_s3.call_count <= 5)
+            self.app.db.session, self.collection, 1, 5, 100, 61))
+        self.assertEqual(images, chunks)
+        self.assertEqual(mock_s3.read_object_s3.call_count, 5)
+
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
+    def test_memory_limit_spills_to_disk(self, mock_s3_cls):
+        """Verify images larger than memory_limit are spilled to disk and read back."""
+        _, chunks = self._mock_s3(mock_s3_cls)
+        spilled = PDF_SPILLED_PAGES.get()
+
+        with patch('scan_explorer_service.utils.spill.tempfile.TemporaryFile',
+                   side_effect=tempfile.TemporaryFile) as mock_tempfile:
+            images = list(fetch_images(
+                self.app.db.session, self.collection, 1, 5, 100, 10))
+        self.assertEqual(images, chunks)
+        self.assertEqual(mock_tempfile.call_count, 5)
+        self.assertEqual(PDF_SPILLED_PAGES.get() - spilled, 5)
+
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
+    def test_failed_fetch_yields_none(self, mock_s3_cls):
+        """Verify an image that cannot be fetched is yielded as None in its place instead of raising."""
+        mock_s3, chunks = self._mock_s3(mock_s3_cls)
+        read = mock_s3.read_object_s3.side_effect
+
+        def failing_read(object_name):
+            if object_name.split('/')[-1].split('.')[0] == 'page2':
+                raise ConnectionError('S3 unavailable')
+            return read(object_name)
+
+        mock_s3.read_object_s3.side_effect = failing_read
+        images = list(fetch_images(self.app.db.session, self.collection, 1, 5, 100, 1000))
+        self.assertEqual(images, chunks[:2] + [None] + chunks[3:])
+
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
+    def test_fetch_ahead_is_bounded(self, mock_s3_cls):
+        """Verify only IMAGE_PDF_FETCH_AHEAD images are fetched ahead of the page being consumed."""
+        mock_s3, chunks = self._mock_s3(mock_s3_cls)
+        self.app.config['IMAGE_PDF_FETCH_AHEAD'] = 2
+
+        images = fetch_images(self.app.db.session, self.collection, 1, 5, 100, 1000)
+        self.assertEqual(next(images), chunks[0])
+        time.sleep(0.1)
+        self.assertEqual(mock_s3.read_object_s3.call_count, 3)
+        self.assertEqual(list(images), chunks[1:])
 
 
 class TestPdfEarlyLimitCheck(TestCaseDatabase):
@@ -259,7 +316,7 @@ class TestPdfEarlyLimitCheck(TestCaseDatabase):
 
     def test_over_limit_returns_400(self):
         """Verify requesting more pages than IMAGE_PDF_PAGE_LIMIT returns 400 before hitting DB."""
-        url = url_for('proxy.pdf_save', id='anything', page_start=1, page_end=200)
+        url = url_for('pdf.pdf_save', id='anything', page_start=1, page_end=200)
         r = self.client.get(url)
         self.assertStatus(r, 400)
         data = json.loads(r.data)
@@ -267,7 +324,7 @@ class TestPdfEarlyLimitCheck(TestCaseDatabase):
 
     def test_missing_id_returns_400(self):
         """Verify missing 'id' parameter returns 400."""
-        url = url_for('proxy.pdf_save', page_start=1, page_end=5)
+        url = url_for('pdf.pdf_save', page_start=1, page_end=5)
         r = self.client.get(url)
         self.assertStatus(r, 400)
 
@@ -5,6 +5,7 @@ from scan_explorer_service.models import Collection, Page, Article
 from scan_explorer_service.tests.base import TestCaseDatabase
 from scan_explorer_service.models import Base
 import json
+from datetime import timedelta
 
 class TestManifest(TestCaseDatabase):
 
@@ -251,5 +252,98 @@ class TestCanvasDictIsolation(TestCaseDatabase):
         self.assertTrue(canvas_ids_1.isdisjoint(canvas_ids_2))
 
 
+class TestConditionalManifest(TestCaseDatabase):
+    """Verify ETag/Last-Modified validators and 304 responses on manifest and canvas endpoints."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+
+        self.collection = Collection(type='type', journal='condJ', volume='0001')
+        self.app.db.session.add(self.collection)
+        self.app.db.session.commit()
+
+        self.article = Article(bibcode='2000condJ...1..001A', collection_id=self.collection.id)
+        self.app.db.session.add(self.article)
+        self.app.db.session.commit()
+
+        self.page = Page(name='c1', collection_id=self.collection.id, volume_running_page_num=1)
+        self.page.width = 100; self.page.height = 100; self.page.label = '1'
+        self.app.db.session.add(self.page)
+        self.app.db.session.commit()
+
+        self.article.pages.append(self.page)
+        self.app.db.session.commit()
+
+        self.article_id = self.article.id
+        self.collection_id = self.collection.id
+        self.page_id = self.page.id
+
+    @patch('scan_explorer_service.views.manifest.cache_get_manifest', return_value=None)
+    def test_manifest_has_validators(self, mock_cache_get):
+        r = self.client.get(url_for("manifest.get_manifest", id=self.collection_id))
+        self.assertStatus(r, 200)
+        self.assertIsNotNone(r.headers.get('ETag'))
+        self.assertIsNotNone(r.headers.get('Last-Modified'))
+
+    @patch('scan_explorer_service.views.manifest.cache_get_manifest', return_value=None)
+    def test_manifest_if_none_match_returns_304_without_building(self, mock_cache_get):
+        etag = self.client.get(url_for("manifest.get_manifest", id=self.article_id)).headers['ETag']
+
+        with patch('scan_explorer_service.views.manifest.manifest_factory') as mock_factory:
+            r = self.client.get(url_for("manifest.get_manifest", id=self.article_id),
+                                headers={'If-None-Match': etag})
+            self.assertStatus(r, 304)
+            self.assertEqual(r.data, b'')
+            mock_factory.create_manifest.assert_not_called()
+
+    @patch('scan_explorer_service.views.manifest.cache_get_manifest', return_value=None)
+    def test_manifest_etag_changes_when_collection_rewritten(self, mock_cache_get):
+        etag = self.client.get(url_for("manifest.get_manifest", id=self.collection_id)).headers['ETag']
+
+        page = self.app.db.session.query(Page).filter(Page.id == self.page_id).one()
+        page.updated = page.updated + timedelta(seconds=5)
+        self.app.db.session.commit()
+
+        r = self.client.get(url_for("manifest.get_manifest", id=self.collection_id),
+                            headers={'If-None-Match': etag})
+        self.assertStatus(r, 200)
+        self.assertNotEqual(r.headers['ETag'], etag)
+
+    @patch('scan_explorer_service.views.manifest.cache_get_manifest', return_value=None)
+    def test_manifest_if_modified_since_returns_304(self, mock_cache_get):
+        last_modified = self.client.get(url_for("manifest.get_manifest", id=self.collection_id)).headers['Last-Modified']
+
+        r = self.client.get(url_for("manifest.get_manifest", id=self.collection_id),
+                            headers={'If-Modified-Since': last_modified})
+        self.assertStatus(r, 304)
+
+    def test_canvas_if_none_match_returns_304(self):
+        etag = self.client.get(url_for("manifest.get_canvas", page_id=self.page_id)).headers['ETag']
+
+        with patch('scan_explorer_service.views.manifest.manifest_factory') as mock_factory:
+            r = self.client.get(url_for("manifest.get_canvas", page_id=self.page_id),
+                                headers={'If-None-Match': etag})
+            self.assertStatus(r, 304)
+            mock_factory.get_or_create_canvas.assert_not_called()
+
+    def test_canvas_stale_etag_returns_200(self):
+        r = self.client.get(url_for("manifest.get_canvas", page_id=self.page_id),
+                            headers={'If-None-Match': '"stale"'})
+        self.assertStatus(r, 200)
+        self.assertEqual(json.loads(r.data)['@type'], 'sc:Canvas')
+
+
 if __name__ == '__main__':
     unittest.main()
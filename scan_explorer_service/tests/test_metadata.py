@@ -281,6 +281,21 @@ class TestMetadata(TestCaseDatabase):
         ).fetchall()
         self.assertEqual(len(links), 2)
 
+    @patch('scan_explorer_service.views.metadata.prewarm_collection', side_effect=RuntimeError('prewarmer down'))
+    def test_put_collection_stored_when_caches_fail(self, mock_prewarm):
+        """A collection is reported stored when refreshing its caches fails after the commit."""
+        r = self.client.put(url_for("metadata.put_collection"), json=self.collection_json)
+        self.assertStatus(r, 200)
+        mock_prewarm.assert_called_once()
+        self.assertEqual(self.app.db.session.query(Collection).count(), 1)
+
+    @patch('scan_explorer_service.views.metadata.invalidate_pdf_cache', side_effect=RuntimeError('S3 down'))
+    def test_put_page_stored_when_caches_fail(self, mock_invalidate):
+        """A page is reported stored when refreshing its caches fails after the commit."""
+        r = self.client.put(url_for("metadata.put_page"), json=self.page_json)
+        self.assertStatus(r, 200)
+        mock_invalidate.assert_called_once()
+
 
 class TestNullPageHandling(TestCaseDatabase):
     """Tests for S2, S3, S5: null dereference guards when articles/collections have no pages."""
@@ -1,12 +1,16 @@
+import io
 import unittest
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
 import time
 from flask import url_for
 from unittest.mock import patch, MagicMock
 from scan_explorer_service.tests.base import TestCaseDatabase
-from scan_explorer_service.models import Article, Base, Collection, Page
+from scan_explorer_service.models import Article, Base, Collection, Page, PageColor
 from scan_explorer_service.utils.cache import cache_set_manifest, MANIFEST_CACHE_PREFIX
-from scan_explorer_service.views.image_proxy import fetch_images
+from scan_explorer_service.utils.page_images import fetch_images, sliding_window
+from scan_explorer_service.utils.transcode import transcode_page, reset_transcoder
 import scan_explorer_service.utils.cache as cache_mod
 
 
@@ -188,7 +192,7 @@ class TestPdfEarlyLimitCheck(TestCaseDatabase):
 
     def test_over_limit_returns_400_immediately(self):
         """Verifies that requesting more pages than the limit returns 400 without processing."""
-        response = self.client.get(url_for('proxy.pdf_save',
+        response = self.client.get(url_for('pdf.pdf_save',
                                            id=self.collection.id,
                                            page_start=1,
                                            page_end=150))
@@ -198,11 +202,12 @@ class TestPdfEarlyLimitCheck(TestCaseDatabase):
 
     def test_exactly_at_limit_passes(self):
         """Verifies that requesting exactly the page limit is allowed."""
-        with patch('scan_explorer_service.views.image_proxy.fetch_images') as mock_fi, \
-             patch('scan_explorer_service.views.image_proxy.img2pdf.convert') as mock_conv:
+        with patch('scan_explorer_service.views.pdf.fetch_images') as mock_fi, \
+             patch('scan_explorer_service.views.pdf.StreamingPdfWriter') as mock_writer:
             mock_fi.return_value = [b'data']
-            mock_conv.return_value = b'pdf'
-            response = self.client.get(url_for('proxy.pdf_save',
+            mock_writer.return_value.add_image.return_value = b'pdf'
+            mock_writer.return_value.close.return_value = b''
+            response = self.client.get(url_for('pdf.pdf_save',
                                                id=self.collection.id,
                                                page_start=1,
                                                page_end=100))
@@ -210,7 +215,7 @@ class TestPdfEarlyLimitCheck(TestCaseDatabase):
 
     def test_one_over_limit_returns_400(self):
         """Verifies that requesting one page over the limit returns 400."""
-        response = self.client.get(url_for('proxy.pdf_save',
+        response = self.client.get(url_for('pdf.pdf_save',
                                            id=self.collection.id,
                                            page_start=1,
                                            page_end=101))
@@ -218,36 +223,35 @@ class TestPdfEarlyLimitCheck(TestCaseDatabase):
 
     def test_no_page_end_passes_limit_check(self):
         """Verifies that omitting page_end bypasses the page limit check."""
-        with patch('scan_explorer_service.views.image_proxy.fetch_images') as mock_fi, \
-             patch('scan_explorer_service.views.image_proxy.img2pdf.convert') as mock_conv:
+        with patch('scan_explorer_service.views.pdf.fetch_images') as mock_fi, \
+             patch('scan_explorer_service.views.pdf.StreamingPdfWriter') as mock_writer:
             mock_fi.return_value = [b'data']
-            mock_conv.return_value = b'pdf'
-            response = self.client.get(url_for('proxy.pdf_save',
+            mock_writer.return_value.add_image.return_value = b'pdf'
+            mock_writer.return_value.close.return_value = b''
+            response = self.client.get(url_for('pdf.pdf_save',
                                                id=self.collection.id,
                                                page_start=1))
             self.assertEqual(response.status_code, 200)
 
-    @patch('scan_explorer_service.views.image_proxy.get_item')
+    @patch('scan_explorer_service.views.pdf.get_item')
     def test_over_limit_does_not_touch_db(self, mock_get_item):
         """Verifies that over-limit requests are rejected before any database access."""
-        response = self.client.get(url_for('proxy.pdf_save',
+        response = self.client.get(url_for('pdf.pdf_save',
                                            id=self.collection.id,
                                            page_start=1,
                                            page_end=200))
         self.assertEqual(response.status_code, 400)
         mock_get_item.assert_not_called()
 
-    def test_inverted_page_range_returns_empty_pdf(self):
-        """Verifies that an inverted page range (start > end) is handled gracefully."""
-        with patch('scan_explorer_service.views.image_proxy.fetch_images') as mock_fi, \
-             patch('scan_explorer_service.views.image_proxy.img2pdf.convert') as mock_conv:
-            mock_fi.return_value = []
-            mock_conv.return_value = b'pdf'
-            response = self.client.get(url_for('proxy.pdf_save',
+    def test_inverted_page_range_rejected(self):
+        """Verifies that an inverted page range (start > end) is rejected before any image is fetched."""
+        with patch('scan_explorer_service.views.pdf.fetch_images') as mock_fi:
+            response = self.client.get(url_for('pdf.pdf_save',
                                                id=self.collection.id,
                                                page_start=10,
                                                page_end=5))
-            self.assertIn(response.status_code, [200, 400])
+            self.assertEqual(response.status_code, 400)
+            mock_fi.assert_not_called()
 
 
 class TestParallelFetchImages(TestCaseDatabase):
@@ -296,7 +300,7 @@ class TestParallelFetchImages(TestCaseDatabase):
 
         self.pages = pages
 
-    @patch('scan_explorer_service.views.image_proxy.S3Provider')
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
     def test_fetch_images_returns_all_pages(self, mock_s3_cls):
         """Verifies that fetch_images returns image data for all pages in the range."""
         mock_s3 = MagicMock()
@@ -309,9 +313,9 @@ class TestParallelFetchImages(TestCaseDatabase):
         self.assertEqual(len(images), 5)
         self.assertTrue(all(img == b'image_data' for img in images))
 
-    @patch('scan_explorer_service.views.image_proxy.S3Provider')
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
     def test_fetch_images_respects_memory_limit(self, mock_s3_cls):
-        """Verifies that fetch_images stops fetching when the memory limit is reached."""
+        """Verifies that fetch_images still returns every page when the memory limit is reached."""
         mock_s3 = MagicMock()
         mock_s3.read_object_s3.return_value = b'x' * 1000
         mock_s3_cls.return_value = mock_s3
@@ -319,9 +323,10 @@ class TestParallelFetchImages(TestCaseDatabase):
         images = list(fetch_images(
             self.app.db.session, self.collection, 1, 5, 100,
             500))
-        self.assertLess(len(images), 5)
+        self.assertEqual(len(images), 5)
+        self.assertTrue(all(img == b'x' * 1000 for img in images))
 
-    @patch('scan_explorer_service.views.image_proxy.S3Provider')
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
     def test_fetch_images_skips_none_results(self, mock_s3_cls):
         """Verifies that fetch_images filters out None results from S3."""
         mock_s3 = MagicMock()
@@ -333,7 +338,20 @@ class TestParallelFetchImages(TestCaseDatabase):
             100 * 1024 * 1024))
         self.assertEqual(len(images), 4)
 
-    @patch('scan_explorer_service.views.image_proxy.S3Provider')
+    def test_sliding_window_bounds_requests(self):
+        """Verifies that the sliding window yields results in order with at most ahead requests in flight."""
+        submitted = []
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            window = sliding_window(executor, lambda n: submitted.append(n) or n * 10, range(10), 3, pending)
+            first = next(window).result()
+            self.assertEqual(first, 0)
+            self.assertEqual(len(pending), 3)
+            self.assertEqual([future.result() for future in window], [n * 10 for n in range(1, 10)])
+        self.assertEqual(sorted(submitted), list(range(10)))
+        self.assertEqual(len(pending), 0)
+
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
     def test_single_s3provider_instance(self, mock_s3_cls):
         """Verifies that fetch_images reuses a single S3Provider instance across all pages."""
         mock_s3 = MagicMock()
@@ -346,5 +364,75 @@ class TestParallelFetchImages(TestCaseDatabase):
         self.assertEqual(mock_s3_cls.call_count, 1)
 
 
+class TestPdfTranscode(TestCaseDatabase):
+    """Tests for the transcoding of page images put in generated PDFs."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PDF_TRANSCODE': True,
+            'IMAGE_PDF_TRANSCODE_WORKERS': 1,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        reset_transcoder()
+
+        self.collection = Collection(type='type', journal='journal', volume='volume')
+        self.app.db.session.add(self.collection)
+        self.app.db.session.commit()
+        self.app.db.session.refresh(self.collection)
+
+    def tearDown(self):
+        reset_transcoder()
+        super().tearDown()
+
+    @staticmethod
+    def _tiff(mode):
+        from PIL import Image, ImageDraw
+        im = Image.new(mode, (400, 300), 'white')
+        ImageDraw.Draw(im).rectangle((50, 50, 200, 150), fill='black')
+        data = io.BytesIO()
+        im.save(data, 'TIFF', dpi=(600, 600))
+        return data.getvalue()
+
+    def test_transcode_page_by_color_type(self):
+        """Verifies that BW pages become Group 4 TIFFs and Grayscale and Color pages JPEGs."""
+        from PIL import Image
+        bw = transcode_page(self._tiff('1'), 'BW')
+        with Image.open(io.BytesIO(bw)) as im:
+            self.assertEqual(im.info['compression'], 'group4')
+            self.assertEqual(im.tag_v2[278], im.height)
+        for mode, color_type in (('L', 'Grayscale'), ('RGB', 'Color')):
+            with Image.open(io.BytesIO(transcode_page(self._tiff(mode), color_type))) as im:
+                self.assertEqual(im.format, 'JPEG')
+                self.assertEqual(im.mode, mode)
+                self.assertEqual(round(im.info['dpi'][0]), 600)
+
+    def test_transcode_page_keeps_smaller_original(self):
+        """Verifies that an image is left as it is when transcoding does not make it smaller."""
+        data = transcode_page(self._tiff('1'), 'BW')
+        self.assertIs(transcode_page(data, 'BW'), data)
+        self.assertIs(transcode_page(data, None), data)
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_pdf_embeds_transcoded_pages(self, mock_fetch_images):
+        """Verifies that generated PDFs embed the transcoded images of the pages in order."""
+        mock_fetch_images.return_value = [(PageColor.BW, self._tiff('1')), (PageColor.Color, self._tiff('RGB'))]
+
+        response = self.client.get(url_for('pdf.pdf_save', id=self.collection.id, page_start=1, page_end=2))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/Count 2', response.data)
+        self.assertLess(response.data.index(b'/CCITTFaxDecode'), response.data.index(b'/DCTDecode'))
+        self.assertTrue(mock_fetch_images.call_args[1]['with_color_type'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,36 @@
 import unittest
 import json
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import requests
 from flask import url_for
 from unittest.mock import MagicMock, patch
 from scan_explorer_service.tests.base import TestCaseDatabase
-from scan_explorer_service.views.image_proxy import image_proxy, get_item, get_pages, fetch_images, fetch_object, fetch_article, img2pdf
+from scan_explorer_service.views.image_proxy import image_proxy
+from scan_explorer_service.utils.db_utils import get_item, get_pages
+from scan_explorer_service.utils.page_images import fetch_images
+from scan_explorer_service.utils.article_pdf import fetch_object, fetch_article
 from scan_explorer_service.models import Article, Base, Collection, Page
+from scan_explorer_service.utils.db_utils import page_by_image_path
+import scan_explorer_service.utils.upstream as upstream_mod
+import scan_explorer_service.utils.image_cache as image_cache_mod
+from scan_explorer_service.utils.image_cache import DiskImageCache
+from scan_explorer_service.utils.single_flight import SingleFlight
+from scan_explorer_service.utils.upstream import CircuitBreaker, RetryBudget
+from scan_explorer_service.utils.metrics import sample_value
+import scan_explorer_service.views.image_proxy as image_proxy_mod
+import scan_explorer_service.utils.cache as cache_mod
+import scan_explorer_service.utils.prewarm as prewarm_mod
+import scan_explorer_service.utils.prefetch as prefetch_mod
+import scan_explorer_service.utils.pdf_jobs as pdf_jobs_mod
+from scan_explorer_service.utils.pdf_cache import invalidate_pdf_cache
+import scan_explorer_service.utils.s3_utils as s3_utils_mod
+from scan_explorer_service.utils.s3_utils import S3Provider
 
 class TestProxy(TestCaseDatabase):
     """Tests for image proxy, thumbnail, PDF, and S3 fetch endpoints."""
@@ -70,6 +96,7 @@ class TestProxy(TestCaseDatabase):
         self.article2.pages.append(self.page)
         self.app.db.session.commit()
         self.app.db.session.refresh(self.article2)
+        cache_mod._article_pdf_local.clear()
 
     def mocked_request(*args, **kwargs):
         """Return mock HTTP responses based on URL path keywords."""
@@ -98,7 +125,7 @@ class TestProxy(TestCaseDatabase):
             return MockResponse({}, 400, {})
         return MockResponse({}, 200, {})
 
-    @patch('requests.request', side_effect=mocked_request)
+    @patch('requests.Session.request', side_effect=mocked_request)
     def test_get_image(self, mock_request):
         """Verifies that image proxy forwards requests and returns correct status codes."""
         url = url_for('proxy.image_proxy', path='valid-~image-~path')
@@ -115,7 +142,7 @@ class TestProxy(TestCaseDatabase):
         response = image_proxy('badrequest-~image-~path')
         assert(response.status_code == 400)
 
-    @patch('scan_explorer_service.views.image_proxy.requests.request')
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
     def test_image_proxy_closes_upstream_response(self, mock_request):
         """Verifies that the upstream response is closed after the streamed response completes."""
         mock_response = MagicMock()
@@ -130,7 +157,7 @@ class TestProxy(TestCaseDatabase):
         response.close()
         mock_response.close.assert_called()
 
-    @patch('requests.request', side_effect=mocked_request)
+    @patch('requests.Session.request', side_effect=mocked_request)
     def test_get_thumbnail(self, mock_request):
         """Verifies that thumbnail proxy returns a streamed 200 response for a valid article."""
         data = {
@@ -159,7 +186,7 @@ class TestProxy(TestCaseDatabase):
                 get_item(self.app.db.session, 'non-existent-id')
             assert("ID: non-existent-id not found" in str(context.exception))
 
-    @patch('scan_explorer_service.views.image_proxy.S3Provider')
+    @patch('scan_explorer_service.utils.page_images.S3Provider')
     def test_fetch_images(self, mock_s3_cls):
         """Verifies that fetch_images yields image bytes for each page in the range."""
         mock_s3 = MagicMock()
@@ -189,29 +216,340 @@ class TestProxy(TestCaseDatabase):
         mock_read_object_s3.assert_called_once_with(object_name)
         self.assertEqual(result, b'image-data')
 
-    @patch('scan_explorer_service.views.image_proxy.fetch_object')
+    @patch('scan_explorer_service.utils.s3_utils.get_s3_client')
+    def test_fetch_object_in_parallel_parts(self, mock_get_s3_client):
+        """Verifies that objects are read with concurrent ranged GETs into a single buffer when configured."""
+        content = bytes(range(256)) * 4
+        requested = []
+
+        def get_object(Bucket, Key, Range, IfMatch=None):
+            start, end = (int(n) for n in Range.split('=')[1].split('-'))
+            requested.append((start, IfMatch))
+            body = MagicMock()
+            body.iter_chunks.return_value = iter([content[start:end + 1]])
+            return {'Body': body, 'ETag': '"abc"', 'ContentLength': len(content[start:end + 1]),
+                    'ContentRange': f'bytes {start}-{min(end, len(content) - 1)}/{len(content)}'}
+
+        client = MagicMock()
+        client.get_object.side_effect = get_object
+        mock_get_s3_client.return_value = (client, None)
+        self.app.config.update({'AWS_BUCKET_NAME': 'bucket-name', 'S3_DOWNLOAD_CONCURRENCY': 4,
+                                'S3_DOWNLOAD_PART_SIZE': 100})
+
+        result = fetch_object('pdfs/article.pdf', 'AWS_BUCKET_NAME')
+
+        self.assertIsInstance(result, memoryview)
+        self.assertEqual(result, content)
+        self.assertEqual(sorted(requested), [(0, None)] + [(start, '"abc"') for start in range(100, 1024, 100)])
+        self.assertTrue(all(call[1]['Bucket'] == 'bucket-name' for call in client.get_object.call_args_list))
+        client.download_fileobj.assert_not_called()
+
+    @patch('scan_explorer_service.utils.s3_utils.get_s3_client')
+    def test_fetch_object_single_get(self, mock_get_s3_client):
+        """Verifies that without parallel parts an object is read with one GET into a buffer of its size."""
+        body = MagicMock()
+        body.iter_chunks.return_value = iter([b'%PDF', b'-1.3'])
+        client = MagicMock()
+        client.get_object.return_value = {'Body': body, 'ContentLength': 8}
+        mock_get_s3_client.return_value = (client, None)
+        self.app.config.update({'AWS_BUCKET_NAME': 'bucket-name', 'S3_DOWNLOAD_CONCURRENCY': 1})
+
+        result = fetch_object('pdfs/article.pdf', 'AWS_BUCKET_NAME')
+
+        self.assertIsInstance(result, memoryview)
+        self.assertEqual(result, b'%PDF-1.3')
+        client.get_object.assert_called_once_with(Bucket='bucket-name', Key='pdfs/article.pdf')
+        client.download_fileobj.assert_not_called()
+
+    @patch('scan_explorer_service.utils.article_pdf.fetch_object')
     def test_pdf_save_success_article(self, mock_fetch_object):
         """Verifies that PDF download for an article returns 200 with application/pdf content type."""
+        self.app.config['IMAGE_PDF_ARTICLE_DELIVERY'] = 'buffer'
         mock_fetch_object.return_value = b'my_image_name'
 
         data = {
             'id': self.article.id,  
         }
         
-        response = self.client.get(url_for('proxy.pdf_save', **data))
+        response = self.client.get(url_for('pdf.pdf_save', **data))
         
         assert(response.status_code == 200)
         assert('application/pdf' == response.content_type)
         assert(b'my_image_name' in response.data)
         mock_fetch_object.assert_called()
 
-    @patch('scan_explorer_service.views.image_proxy.img2pdf.convert')
-    @patch('scan_explorer_service.views.image_proxy.fetch_images')
-    def test_pdf_save_success_collection(self, mock_fetch_images, mock_img2pdf_convert):
-        """Verifies that PDF download for a collection page range returns converted PDF data."""
-        mock_fetch_images.return_value = [b'image_data_1', b'image_data_2', b'image_data_3']
+    @patch('scan_explorer_service.utils.article_pdf.fetch_object')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    def test_pdf_save_article_range(self, mock_open, mock_fetch_object):
+        """Verifies that a range request for an article PDF is answered with a streamed ranged S3 GET."""
+        body = MagicMock()
+        body.iter_chunks.return_value = iter([b'%P', b'DF'])
+        mock_open.return_value = {'Body': body, 'ContentRange': 'bytes 0-3/100', 'ContentLength': 4, 'ETag': '"abc"'}
 
-        mock_img2pdf_convert.return_value = b'pdf_data'
+        response = self.client.get(url_for('pdf.pdf_save', id=self.article.id), headers={'Range': 'bytes=0-3'})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.data, b'%PDF')
+        response.close()
+        body.read.assert_not_called()
+        body.close.assert_called_once()
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-3/100')
+        self.assertEqual(response.headers['Content-Length'], '4')
+        self.assertEqual(response.headers['ETag'], '"abc"')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        self.assertEqual(mock_open.call_args[0], ('pdfs/1988apj...333..341r.pdf',))
+        self.assertEqual(mock_open.call_args[1], {'Range': 'bytes=0-3'})
+        mock_fetch_object.assert_not_called()
+
+    @patch('scan_explorer_service.utils.article_pdf.fetch_object')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    def test_pdf_save_article_if_range_mismatch(self, mock_open, mock_fetch_object):
+        """Verifies that the whole PDF is sent when If-Range no longer matches the stored object."""
+        from botocore.exceptions import ClientError
+        self.app.config['IMAGE_PDF_ARTICLE_DELIVERY'] = 'buffer'
+        mock_open.side_effect = ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        mock_fetch_object.return_value = b'%PDF-whole'
+
+        response = self.client.get(url_for('pdf.pdf_save', id=self.article.id),
+                                   headers={'Range': 'bytes=4-', 'If-Range': '"old"'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'%PDF-whole')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(mock_open.call_args[1], {'Range': 'bytes=4-', 'IfMatch': '"old"'})
+
+    @patch('scan_explorer_service.utils.article_pdf.fetch_object')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    def test_pdf_save_article_streamed(self, mock_open, mock_fetch_object):
+        """Verifies that an article PDF is streamed from S3 in chunks instead of being read into memory."""
+        body = MagicMock()
+        body.iter_chunks.return_value = iter([b'%PDF', b'-1.4'])
+        mock_open.return_value = {'Body': body, 'ContentLength': 8, 'ETag': '"abc"'}
+
+        response = self.client.get(url_for('pdf.pdf_save', id=self.article.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.data, b'%PDF-1.4')
+        self.assertEqual(response.headers['Content-Length'], '8')
+        self.assertEqual(response.headers['ETag'], '"abc"')
+        self.assertIn('1988apj...333..341r.pdf', response.headers['Content-Disposition'])
+        mock_open.assert_called_once_with('pdfs/1988apj...333..341r.pdf')
+        mock_fetch_object.assert_not_called()
+        response.close()
+        body.close.assert_called_once()
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.presigned_url_s3', return_value='https://bucket.s3/article.pdf?sig')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.head_object_s3')
+    def test_pdf_save_article_redirect(self, mock_head, mock_presign, mock_fetch_images):
+        """Verifies that article PDFs are redirected to a presigned URL, and generated when there is none."""
+        from botocore.exceptions import ClientError
+        self.app.config['IMAGE_PDF_ARTICLE_DELIVERY'] = 'redirect'
+
+        response = self.client.get(url_for('pdf.pdf_save', id=self.article.id))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], 'https://bucket.s3/article.pdf?sig')
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        self.assertEqual(mock_presign.call_args[0], ('pdfs/1988apj...333..341r.pdf', 300))
+        self.assertIn('attachment', mock_presign.call_args[1]['ResponseContentDisposition'])
+
+        mock_head.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        mock_fetch_images.return_value = [self._jpeg('red')]
+        response = self.client.get(url_for('pdf.pdf_save', id=self.article.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data.startswith(b'%PDF-'))
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    def test_pdf_save_article_missing_is_remembered(self, mock_open, mock_fetch_images):
+        """Verifies that articles without a pre-rendered PDF are generated without trying S3 again until re-ingested."""
+        from botocore.exceptions import ClientError
+        mock_open.side_effect = ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        mock_fetch_images.side_effect = lambda *args, **kwargs: [self._jpeg('red')]
+
+        for _ in range(2):
+            response = self.client.get(url_for('pdf.pdf_save', id=self.article.id))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data.startswith(b'%PDF-'))
+        self.assertEqual(mock_open.call_count, 1)
+        self.assertIs(cache_mod.cache_get_article_pdf(self.article.id), False)
+
+        self.client.put(url_for('metadata.put_article'), json={'bibcode': self.article.id, 'collection_id': self.collection.id})
+        self.assertIsNone(cache_mod.cache_get_article_pdf(self.article.id))
+
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.list_keys_s3')
+    def test_pdf_index(self, mock_list, mock_open):
+        """Verifies that the index of pre-rendered PDFs is built from a listing of the bucket."""
+        mock_list.return_value = iter(['pdfs/1988apj...333..341r.pdf', 'pdfs/1988apj...333..341r.txt'])
+
+        response = self.client.post(url_for('pdf.pdf_index', id=self.collection.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'articles': 2, 'found': 1})
+        mock_list.assert_called_once_with('pdfs/1988apj...333')
+        self.assertIs(cache_mod.cache_get_article_pdf(self.article.id), True)
+        self.assertIs(cache_mod.cache_get_article_pdf(self.article2.id), False)
+
+        self.assertIsNone(fetch_article(self.article2, 100 * 1024 * 1024))
+        mock_open.assert_not_called()
+
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.list_keys_s3')
+    def test_pdf_index_every_collection(self, mock_list):
+        """Verifies that every collection is indexed by the command, one listing per year and volume, and not over HTTP."""
+        other = Collection(type='type', journal='other', volume='volume')
+        self.app.db.session.add(other)
+        self.app.db.session.commit()
+        self.app.db.session.add(Article(bibcode='2000AJ....120..001A', collection_id=other.id))
+        self.app.db.session.add(Article(bibcode='2001AJ....120..101B', collection_id=other.id))
+        self.app.db.session.commit()
+        mock_list.side_effect = lambda prefix: iter(['pdfs/2000aj....120..001a.pdf'])
+
+        response = self.client.post(url_for('pdf.pdf_index'))
+        self.assertEqual(response.status_code, 400)
+        mock_list.assert_not_called()
+
+        result = self.app.test_cli_runner().invoke(args=['index-article-pdfs'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('4 articles, 1 with a pre-rendered PDF', result.output)
+        self.assertEqual(sorted(call[0][0] for call in mock_list.call_args_list),
+                         ['pdfs/1988apj...333', 'pdfs/2000aj....120', 'pdfs/2001aj....120'])
+        self.assertIs(cache_mod.cache_get_article_pdf('2000AJ....120..001A'), True)
+        self.assertIs(cache_mod.cache_get_article_pdf(self.article.id), False)
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_image_proxy_passes_range_through(self, mock_request):
+        """Verifies that Range headers reach the image server and partial responses reach the client."""
+        mock_response = MagicMock()
+        mock_response.status_code = 206
+        mock_response.headers = {'Content-Range': 'bytes 0-4/10', 'Accept-Ranges': 'bytes'}
+        mock_response.raw.stream.return_value = [b'abcde']
+        mock_request.return_value = mock_response
+
+        response = self.client.get(url_for('proxy.image_proxy', path='some-~image-~path'), headers={'Range': 'bytes=0-4'})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-4/10')
+        self.assertEqual(mock_request.call_args[1]['headers']['Range'], 'bytes=0-4')
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_image_info_from_database(self, mock_request):
+        """Verifies that info.json is built from the page dimensions without contacting the image server."""
+        with self.app.test_request_context():
+            image_path = self.page.image_path
+
+        response = self.client.get(url_for('proxy.image_proxy', path=f'{image_path}/info.json'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'application/json')
+        mock_request.assert_not_called()
+        info = response.get_json()
+        self.assertEqual((info['width'], info['height']), (1000, 1000))
+        self.assertTrue(info['@id'].endswith(image_path))
+        self.assertEqual(info['sizes'][-1], {'width': 1000, 'height': 1000})
+        self.assertEqual(info['tiles'][0]['scaleFactors'], [1, 2])
+
+        response = self.client.get(url_for('proxy.image_proxy', path=f'{image_path}/info.json'),
+                                   headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        mock_request.assert_not_called()
+
+    def test_page_by_image_path(self):
+        """Verifies that a page is looked up by name within the collection named in its identifier."""
+        other = Collection(type='type', journal='ApJ..', volume='0333')
+        self.app.db.session.add(other)
+        self.app.db.session.commit()
+        other_page = Page(name='page', collection_id=other.id, volume_running_page_num=1)
+        self.app.db.session.add(other_page)
+        self.app.db.session.commit()
+
+        with self.app.test_request_context():
+            session = self.app.db.session
+            self.assertEqual(page_by_image_path(session, self.page.image_path).id, self.page.id)
+            self.assertEqual(page_by_image_path(session, other_page.image_path).id, other_page.id)
+            self.assertIsNone(page_by_image_path(session, other_page.image_path.replace('0333', '0334')))
+            self.assertIsNone(page_by_image_path(session, 'page.tif'))
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_image_info_falls_back_to_image_server(self, mock_request):
+        """Verifies that info.json of a page without known dimensions is proxied to the image server."""
+        self.page.width = None
+        self.app.db.session.commit()
+        with self.app.test_request_context():
+            image_path = self.page.image_path
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {'Content-Type': 'application/json'}
+        mock_response.raw.stream.return_value = [b'{"width": 1}']
+        mock_request.return_value = mock_response
+
+        response = self.client.get(url_for('proxy.image_proxy', path=f'{image_path}/info.json'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'{"width": 1}')
+        mock_request.assert_called_once()
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    def test_image_proxy_passthrough(self, mock_open, mock_request):
+        """Verifies that unmodified full images in their source format are streamed from S3."""
+        body = MagicMock()
+        body.iter_chunks.return_value = [b'II*\x00', b'tiff']
+        mock_open.return_value = {'Body': body, 'ETag': '"s3etag"', 'ContentLength': 8}
+
+        response = self.client.get(url_for('proxy.image_proxy', path='bitmaps-~type-~page.tif/full/full/0/default.tif'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'II*\x00tiff')
+        self.assertEqual(response.content_type, 'image/tiff')
+        self.assertEqual(response.headers['ETag'], '"s3etag"')
+        mock_open.assert_called_once_with('bitmaps/type/page.tif')
+        mock_request.assert_not_called()
+        response.close()
+        body.close.assert_called_once()
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    def test_image_proxy_passthrough_not_applicable(self, mock_open, mock_request):
+        """Verifies that transformed or re-encoded images and missing S3 objects go to the image server."""
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {'Content-Type': 'image/jpeg'}
+        mock_response.raw.stream.return_value = [b'jpeg']
+        mock_request.return_value = mock_response
+
+        self.client.get(url_for('proxy.image_proxy', path='bitmaps-~type-~page.tif/full/full/0/default.jpg'))
+        self.client.get(url_for('proxy.image_proxy', path='bitmaps-~type-~page.tif/full/full/0/gray.tif'))
+        mock_open.assert_not_called()
+
+        from botocore.exceptions import ClientError
+        mock_open.side_effect = ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        response = self.client.get(url_for('proxy.image_proxy', path='bitmaps-~type-~page.tif/full/max/0/default.tif'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_request.call_count, 3)
+
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.presigned_url_s3', return_value='https://bucket.s3/page.tif?sig')
+    def test_image_proxy_passthrough_redirect(self, mock_presign):
+        """Verifies that IMAGE_PASSTHROUGH = 'redirect' sends clients to a presigned S3 URL."""
+        self.app.config['IMAGE_PASSTHROUGH'] = 'redirect'
+        response = self.client.get(url_for('proxy.image_proxy', path='bitmaps-~type-~page.tif/full/full/0/default.tif'))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], 'https://bucket.s3/page.tif?sig')
+        mock_presign.assert_called_once_with('bitmaps/type/page.tif', 300)
+
+    @staticmethod
+    def _jpeg(color):
+        from PIL import Image
+        data = io.BytesIO()
+        Image.new('RGB', (60, 80), color).save(data, 'JPEG')
+        return data.getvalue()
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_pdf_save_success_collection(self, mock_fetch_images):
+        """Verifies that PDF download for a collection page range streams a page per image."""
+        images = [self._jpeg('red'), self._jpeg('green'), self._jpeg('blue')]
+        mock_fetch_images.return_value = images
 
         data = {
             'id': self.collection.id,  
@@ -219,12 +557,54 @@ class TestProxy(TestCaseDatabase):
             'page_end': 3
         }
         
-        response = self.client.get(url_for('proxy.pdf_save', **data))
+        response = self.client.get(url_for('pdf.pdf_save', **data))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content_type, 'application/pdf')
-        self.assertEqual(response.data, b'pdf_data')
+        self.assertTrue(response.is_streamed)
+        self.assertTrue(response.data.startswith(b'%PDF-'))
+        self.assertTrue(response.data.endswith(b'%%EOF\n'))
+        self.assertIn(b'/Count 3', response.data)
+        for image in images:
+            self.assertIn(image, response.data)
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_pdf_save_skips_unreadable_images(self, mock_fetch_images):
+        """Verifies that unreadable page images are left out, and that a PDF without any page is an error."""
+        mock_fetch_images.return_value = [b'not an image', self._jpeg('red'), b'not an image either']
+        response = self.client.get(url_for('pdf.pdf_save', id=self.collection.id, page_start=1, page_end=3))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/Count 1', response.data)
 
-        mock_img2pdf_convert.assert_called_once_with([b'image_data_1', b'image_data_2', b'image_data_3'])
+        mock_fetch_images.return_value = [b'not an image']
+        response = self.client.get(url_for('pdf.pdf_save', id=self.collection.id, page_start=1, page_end=1))
+        self.assertEqual(response.status_code, 400)
+
+    @patch('scan_explorer_service.views.pdf.fetch_article')
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    @patch('scan_explorer_service.utils.page_images.fetch_derivative')
+    def test_pdf_save_lite(self, mock_fetch_derivative, mock_fetch_images, mock_fetch_article):
+        """Verifies that a lite PDF is built from downscaled derivatives instead of the masters."""
+        mock_fetch_derivative.return_value = self._jpeg('red')
+
+        response = self.client.get(url_for('pdf.pdf_save', id=self.article.id, quality='lite'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/Count 2', response.data)
+        # 60x80 pixels at 150 dpi
+        self.assertIn(b'/MediaBox [ 0 0 28.8 38.4 ]', response.data)
+        paths = [call[0][0] for call in mock_fetch_derivative.call_args_list]
+        self.assertEqual(sorted(paths), [f'{page.image_path}/full/pct:25/0/gray.jpg' for page in (self.page, self.page1)])
+        mock_fetch_images.assert_not_called()
+        mock_fetch_article.assert_not_called()
+
+        mock_fetch_derivative.reset_mock()
+        response = self.client.get(url_for('pdf.pdf_save', id=self.collection.id, page_start=100, page_end=100, dpi=300))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_fetch_derivative.call_args[0][0], f'{self.page.image_path}/full/pct:50/0/gray.jpg')
+
+        response = self.client.get(url_for('pdf.pdf_save', id=self.collection.id, dpi=1200))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url_for('pdf.pdf_save', id=self.collection.id, quality='best'))
+        self.assertEqual(response.status_code, 400)
 
 
 class TestImageProxyRetry(TestCaseDatabase):
@@ -246,6 +626,7 @@ class TestImageProxyRetry(TestCaseDatabase):
     def setUp(self):
         Base.metadata.drop_all(bind=self.app.db.engine)
         Base.metadata.create_all(bind=self.app.db.engine)
+        upstream_mod.reset_resilience()
 
     def _make_mock_response(self, data, status_code, headers=None):
         """Build a mock HTTP response with streamable raw data."""
@@ -263,20 +644,19 @@ class TestImageProxyRetry(TestCaseDatabase):
                 pass
         return MockResponse(data, status_code, headers or {})
 
-    @patch('requests.request')
-    def test_retry_on_cold_cache_400(self, mock_request):
-        """Verifies that a 400 from Cantaloupe triggers a retry that succeeds."""
+    @patch('requests.Session.request')
+    def test_no_retry_on_400(self, mock_request):
+        """Verifies that a 400 from Cantaloupe is returned without a retry."""
         fail = self._make_mock_response([b'error'], 400)
-        success = self._make_mock_response([b'ok'], 200)
-        mock_request.side_effect = [fail, success]
+        mock_request.return_value = fail
 
         url = url_for('proxy.image_proxy', path='some-~image-~path')
         response = self.client.get(url)
 
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(mock_request.call_count, 1)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_retry_on_cold_cache_500(self, mock_request):
         """Verifies that a 500 from Cantaloupe triggers a retry that succeeds."""
         fail = self._make_mock_response([b'error'], 500)
@@ -289,7 +669,7 @@ class TestImageProxyRetry(TestCaseDatabase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(mock_request.call_count, 2)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_no_retry_on_success(self, mock_request):
         """Verifies that a successful response does not trigger any retries."""
         success = self._make_mock_response([b'ok'], 200)
@@ -301,18 +681,34 @@ class TestImageProxyRetry(TestCaseDatabase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(mock_request.call_count, 1)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_returns_error_after_exhausted_retries(self, mock_request):
         """Verifies that the error response is returned after all retries are exhausted."""
-        fail = self._make_mock_response([b'error'], 400)
+        fail = self._make_mock_response([b'error'], 500)
         mock_request.return_value = fail
 
         url = url_for('proxy.image_proxy', path='some-~image-~path')
         response = self.client.get(url)
 
-        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.status_code, 500)
         self.assertEqual(mock_request.call_count, 2)
 
+    @patch('scan_explorer_service.utils.image_utils.time.sleep')
+    @patch('requests.Session.request')
+    def test_long_backoff_not_waited(self, mock_request, mock_sleep):
+        """Verifies that a retry needing a long backoff answers 503 with Retry-After instead of sleeping."""
+        mock_request.return_value = self._make_mock_response([b'error'], 503)
+        self.app.config['IMAGE_PROXY_RETRY_DELAY'] = 5
+        self.app.config['IMAGE_PROXY_RETRY_MAX_WAIT'] = 0
+
+        url = url_for('proxy.image_proxy', path='some-~image-~path')
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(mock_request.call_count, 1)
+        mock_sleep.assert_not_called()
+
 
 class TestProxyNullHandling(TestCaseDatabase):
     """Tests for S4 and S6: null/error handling in image_proxy.py."""
@@ -346,13 +742,15 @@ class TestProxyNullHandling(TestCaseDatabase):
         self.app.db.session.add(self.article_no_pages)
         self.app.db.session.commit()
         self.article_no_pages_id = self.article_no_pages.id
+        cache_mod._article_pdf_local.clear()
 
-    @patch('scan_explorer_service.views.image_proxy.fetch_object')
+    @patch('scan_explorer_service.utils.article_pdf.fetch_object')
     def test_pdf_save_article_no_pages_returns_400(self, mock_fetch_object):
         """Verifies that PDF download returns 400 when article has no pages and no pre-built PDF."""
+        self.app.config['IMAGE_PDF_ARTICLE_DELIVERY'] = 'buffer'
         mock_fetch_object.side_effect = ValueError("File content is empty")
 
-        response = self.client.get(url_for('proxy.pdf_save', id=self.article_no_pages_id))
+        response = self.client.get(url_for('pdf.pdf_save', id=self.article_no_pages_id))
         self.assertEqual(response.status_code, 400)
         data = json.loads(response.data)
         self.assertIn('No pages found', data['Message'])
@@ -364,15 +762,16 @@ class TestProxyNullHandling(TestCaseDatabase):
                 get_pages(self.article_no_pages, self.app.db.session, 1, 10, 100)
             self.assertIn('No pages found', str(ctx.exception))
 
-    @patch('scan_explorer_service.views.image_proxy.fetch_object')
+    @patch('scan_explorer_service.utils.article_pdf.fetch_object')
     def test_fetch_article_exception_no_unbound_local(self, mock_fetch_object):
         """Verifies that fetch_article handles S3 exceptions without an UnboundLocalError."""
+        self.app.config['IMAGE_PDF_ARTICLE_DELIVERY'] = 'buffer'
         mock_fetch_object.side_effect = ValueError("S3 error")
 
         result = fetch_article(self.article_no_pages, 100 * 1024 * 1024)
         self.assertIsNone(result)
 
-    @patch('scan_explorer_service.views.image_proxy.fetch_object')
+    @patch('scan_explorer_service.utils.article_pdf.fetch_object')
     def test_thumbnail_empty_collection_returns_400(self, mock_fetch_object):
         """Verifies that thumbnail endpoint returns 400 for a collection with no pages."""
         response = self.client.get(url_for('proxy.image_proxy_thumbnail',
@@ -380,5 +779,1419 @@ class TestProxyNullHandling(TestCaseDatabase):
         self.assertEqual(response.status_code, 400)
 
 
+class TestUpstreamPool(TestCaseDatabase):
+    """Tests for the pooled keep-alive upstream session used by the image proxy."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PROXY_POOL_CONNECTIONS': 2,
+            'IMAGE_PROXY_POOL_MAXSIZE': 7,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        upstream_mod.reset_session()
+
+    def tearDown(self):
+        upstream_mod.reset_session()
+        super().tearDown()
+
+    def test_session_is_reused(self):
+        """Verifies that the same session is returned for repeated calls in one worker."""
+        self.assertIs(upstream_mod.get_session(), upstream_mod.get_session())
+
+    def test_pool_sized_from_config(self):
+        """Verifies that the adapter pool size and host count come from the config."""
+        adapter = upstream_mod.get_session().get_adapter('http://')
+        self.assertIsInstance(adapter, upstream_mod.PooledAdapter)
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(adapter._pool_connections, 2)
+
+    def test_session_recreated_after_fork(self):
+        """Verifies that a forked worker does not reuse the parent's session."""
+        session = upstream_mod.get_session()
+        with patch('scan_explorer_service.utils.process.os.getpid', return_value=-1):
+            self.assertIsNot(upstream_mod.get_session(), session)
+
+    @patch('requests.Session.request')
+    def test_image_proxy_uses_pooled_session(self, mock_request):
+        """Verifies that image requests are sent through the pooled session."""
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.raw.stream.return_value = [b'ok']
+        mock_request.return_value = mock_response
+
+        self.client.get(url_for('proxy.image_proxy', path='some-~image-~path'))
+        self.client.get(url_for('proxy.image_proxy', path='other-~image-~path'))
+        self.assertEqual(mock_request.call_count, 2)
+
+    def test_pool_stats_reports_hosts(self):
+        """Verifies that pool stats list the upstream host with its capacity and usage."""
+        adapter = upstream_mod.get_session().get_adapter('http://')
+        adapter.poolmanager.connection_from_url('http://localhost:8182/iiif/2/')
+
+        stats = upstream_mod.pool_stats()
+        host = stats['hosts']['http://localhost:8182']
+        self.assertEqual(host['maxsize'], 7)
+        self.assertEqual(host['in_use'], 0)
+        self.assertFalse(host['saturated'])
+
+    def test_stats_endpoint(self):
+        """Verifies that the stats endpoint exposes pool counters as JSON."""
+        upstream_mod.get_session()
+        response = self.client.get(url_for('image_admin.image_proxy_stats'))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertIn('saturated_requests', data['pool'])
+        self.assertIn('hosts', data['pool'])
+
+
+class TestImageDiskCache(TestCaseDatabase):
+    """Tests for the local disk cache of IIIF derivatives in front of the image server."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        self.cache_dir = tempfile.mkdtemp()
+        self.app.config['IMAGE_CACHE_DIR'] = self.cache_dir
+        image_cache_mod.reset_image_cache()
+
+    def tearDown(self):
+        image_cache_mod.reset_image_cache()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().tearDown()
+
+    def _mock_response(self, chunks, status_code=200, headers=None):
+        response = MagicMock()
+        response.status_code = status_code
+        response.headers = headers if headers is not None else {'Content-Type': 'image/jpeg'}
+        response.raw.stream.return_value = chunks
+        return response
+
+    @patch('requests.Session.request')
+    def test_second_request_served_from_disk(self, mock_request):
+        """Verifies that a completed upstream stream is cached and replayed without an upstream call."""
+        mock_request.return_value = self._mock_response([b'abc', b'def'])
+        url = url_for('proxy.image_proxy', path='p-~a.tif/square/480,480/0/gray.jpg')
+
+        first = self.client.get(url)
+        self.assertEqual(first.data, b'abcdef')
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        first.close()
+
+        second = self.client.get(url)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, b'abcdef')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.content_type, 'image/jpeg')
+        second.close()
+        self.assertEqual(mock_request.call_count, 1)
+
+    @patch('requests.Session.request')
+    def test_cached_entry_revalidated_from_stored_validators(self, mock_request):
+        """Verifies that conditional requests on cached entries use the stored upstream validators."""
+        mock_request.return_value = self._mock_response(
+            [b'abc'], headers={'Content-Type': 'image/jpeg', 'ETag': '"upstream"'})
+        url = url_for('proxy.image_proxy', path='p-~a.tif/full/max/0/default.jpg')
+        self.client.get(url).data
+
+        r = self.client.get(url, headers={'If-None-Match': '"upstream"'})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.headers['X-Cache'], 'HIT')
+        self.assertEqual(mock_request.call_count, 1)
+
+    @patch('requests.Session.request')
+    def test_error_responses_not_cached(self, mock_request):
+        """Verifies that non-200 upstream responses are never written to the cache."""
+        mock_request.return_value = self._mock_response([b'missing'], status_code=404)
+        url = url_for('proxy.image_proxy', path='p-~b.tif/full/max/0/default.jpg')
+
+        self.client.get(url).close()
+        self.client.get(url).close()
+        self.assertEqual(mock_request.call_count, 2)
+
+    def test_oversized_entry_dropped(self):
+        """Verifies that entries above the per-entry limit are not published."""
+        cache = DiskImageCache(self.cache_dir, max_bytes=1000, max_entry_bytes=4)
+        writer = cache.writer('big', [('Content-Type', 'image/jpeg')])
+        writer.write(b'12345')
+        writer.commit()
+        self.assertIsNone(cache.get('big'))
+        self.assertEqual([n for n in os.listdir(self.cache_dir) if n.startswith('.tmp-')], [])
+
+    def test_least_recently_used_evicted(self):
+        """Verifies that eviction removes the least recently used entry first."""
+        cache = DiskImageCache(self.cache_dir, max_bytes=10, max_entry_bytes=10, low_water=0.5)
+        for key in ('a', 'b'):
+            writer = cache.writer(key, [])
+            writer.write(b'1234')
+            writer.commit()
+        os.utime(cache.get('a')[0], (0, 0))
+        os.utime(cache.get('b')[0], (1, 1))
+
+        writer = cache.writer('c', [])
+        writer.write(b'1234')
+        writer.commit()
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+
+class TestImageConditionalGet(TestCaseDatabase):
+    """Tests for ETag handling and 304 responses in the image proxy."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+
+    def _mock_response(self, headers):
+        response = MagicMock()
+        response.status_code = 200
+        response.headers = headers
+        response.raw.stream.return_value = [b'img']
+        return response
+
+    @patch('requests.Session.request')
+    def test_upstream_etag_passed_through(self, mock_request):
+        """Verifies that an upstream ETag is forwarded unchanged."""
+        mock_request.return_value = self._mock_response({'ETag': '"upstream"'})
+        r = self.client.get(url_for('proxy.image_proxy', path='p-~a.tif/full/max/0/default.jpg'))
+        self.assertEqual(r.headers['ETag'], '"upstream"')
+
+    @patch('requests.Session.request')
+    def test_path_etag_revalidates_without_upstream(self, mock_request):
+        """Verifies that a matching If-None-Match is answered with 304 without contacting the upstream."""
+        mock_request.return_value = self._mock_response({})
+        url = url_for('proxy.image_proxy', path='p-~a.tif/full/max/0/default.jpg')
+        etag = self.client.get(url).headers['ETag']
+
+        r = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(mock_request.call_count, 1)
+
+    @patch('requests.Session.request')
+    def test_path_etag_differs_per_derivative(self, mock_request):
+        """Verifies that different derivatives of the same page get different tags."""
+        mock_request.return_value = self._mock_response({})
+        etag = self.client.get(url_for('proxy.image_proxy', path='p-~a.tif/full/max/0/default.jpg')).headers['ETag']
+
+        r = self.client.get(url_for('proxy.image_proxy', path='p-~a.tif/full/200,/0/default.jpg'),
+                            headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(mock_request.call_count, 2)
+
+
+class TestImageCoalescing(TestCaseDatabase):
+    """Tests for single-flight coalescing of identical concurrent image requests."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PROXY_COALESCE_WAIT': 5,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        image_proxy_mod._single_flight = SingleFlight()
+        self.path = 'p-~a.tif/full/max/0/default.jpg'
+
+    def _mock_response(self, chunks):
+        response = MagicMock()
+        response.status_code = 200
+        response.headers = {'Content-Type': 'image/jpeg'}
+        response.raw.stream.return_value = chunks
+        return response
+
+    def test_single_flight_join(self):
+        """Verifies that the first caller leads and later callers follow until the flight finishes."""
+        sf = SingleFlight()
+        flight, leader = sf.join('k')
+        other, follower_leads = sf.join('k')
+        self.assertTrue(leader)
+        self.assertFalse(follower_leads)
+        self.assertIs(flight, other)
+
+        sf.finish('k', flight, 'result')
+        self.assertEqual(sf.wait(other, timeout=0), 'result')
+        self.assertTrue(sf.join('k')[1])
+
+    @patch('requests.Session.request')
+    def test_follower_receives_leader_bytes(self, mock_request):
+        """Verifies that a request joining an in-flight fetch reuses the leader's bytes."""
+        flight, _ = image_proxy_mod._single_flight.join(self.path)
+        result = (200, [('Content-Type', 'image/jpeg')], b'shared')
+        threading.Timer(0.1, image_proxy_mod._single_flight.finish, args=(self.path, flight, result)).start()
+
+        response = self.client.get(url_for('proxy.image_proxy', path=self.path))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'shared')
+        mock_request.assert_not_called()
+
+    @patch('requests.Session.request')
+    def test_follower_fetches_when_leader_gives_up(self, mock_request):
+        """Verifies that followers go upstream themselves when the leader could not share."""
+        mock_request.return_value = self._mock_response([b'own'])
+        flight, _ = image_proxy_mod._single_flight.join(self.path)
+        threading.Timer(0.1, image_proxy_mod._single_flight.finish, args=(self.path, flight, None)).start()
+
+        response = self.client.get(url_for('proxy.image_proxy', path=self.path))
+        self.assertEqual(response.data, b'own')
+        self.assertEqual(mock_request.call_count, 1)
+
+    @patch('requests.Session.request')
+    def test_leader_releases_flight(self, mock_request):
+        """Verifies that a completed leader stream leaves no flight behind."""
+        mock_request.return_value = self._mock_response([b'a', b'b'])
+        response = self.client.get(url_for('proxy.image_proxy', path=self.path))
+        self.assertEqual(response.data, b'ab')
+        response.close()
+        self.assertEqual(image_proxy_mod._single_flight.stats()['in_flight'], 0)
+
+    def test_oversized_body_not_shared(self):
+        """Verifies that bodies above IMAGE_PROXY_COALESCE_MAX_BYTES are streamed but not shared."""
+        self.app.config['IMAGE_PROXY_COALESCE_MAX_BYTES'] = 3
+        finish = image_proxy_mod._single_flight.finish
+        with patch.object(image_proxy_mod._single_flight, 'finish', wraps=finish) as mock_finish, \
+                self.app.test_request_context():
+            response = image_proxy_mod.coalesced_image_response(
+                lambda: self._mock_response([b'ab', b'cd']), self.path, 'etag', None)
+            self.assertEqual(b''.join(response.response), b'abcd')
+            response.close()
+        self.assertIsNone(mock_finish.call_args[0][2])
+
+    def test_shared_before_leader_client_reads(self):
+        """Verifies that followers are released once the upstream body was read, not once the leader's client got it."""
+        with self.app.test_request_context():
+            response = image_proxy_mod.coalesced_image_response(
+                lambda: self._mock_response([b'ab', b'cd']), self.path, 'etag', None)
+            self.assertEqual(image_proxy_mod._single_flight.stats()['in_flight'], 0)
+            self.assertEqual(response.get_data(), b'abcd')
+
+    @patch('requests.Session.request')
+    def test_error_status_not_shared(self, mock_request):
+        """Verifies that only 200 responses are shared with followers."""
+        upstream = self._mock_response([b'missing'])
+        upstream.status_code = 404
+        mock_request.return_value = upstream
+        finish = image_proxy_mod._single_flight.finish
+        with patch.object(image_proxy_mod._single_flight, 'finish', wraps=finish) as mock_finish:
+            response = self.client.get(url_for('proxy.image_proxy', path=self.path))
+            self.assertEqual(response.status_code, 404)
+            response.close()
+        self.assertIsNone(mock_finish.call_args[0][2])
+
+    @patch('requests.Session.request')
+    def test_conditional_leader_fetches_whole_image(self, mock_request):
+        """Verifies that a revalidating leader fetches the whole image for its followers and still gets its 304."""
+        upstream = self._mock_response([b'image'])
+        upstream.headers = {'Content-Type': 'image/jpeg', 'ETag': '"upstream"'}
+        mock_request.return_value = upstream
+        finish = image_proxy_mod._single_flight.finish
+        with patch.object(image_proxy_mod._single_flight, 'finish', wraps=finish) as mock_finish:
+            response = self.client.get(url_for('proxy.image_proxy', path=self.path),
+                                       headers={'If-None-Match': '"upstream"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('If-None-Match', mock_request.call_args[1]['headers'])
+        self.assertEqual(mock_finish.call_args[0][2][2], b'image')
+
+    @patch('requests.Session.request')
+    def test_follower_answers_own_conditional_request(self, mock_request):
+        """Verifies that a follower compares its own conditional headers with the shared validators."""
+        flight, _ = image_proxy_mod._single_flight.join(self.path)
+        result = (200, [('Content-Type', 'image/jpeg'), ('ETag', '"shared"')], b'shared')
+        threading.Timer(0.1, image_proxy_mod._single_flight.finish, args=(self.path, flight, result)).start()
+
+        response = self.client.get(url_for('proxy.image_proxy', path=self.path), headers={'If-None-Match': '"shared"'})
+        self.assertEqual(response.status_code, 304)
+        mock_request.assert_not_called()
+
+    @patch('scan_explorer_service.views.image_proxy.release_lock')
+    @patch('scan_explorer_service.views.image_proxy.acquire_lock')
+    @patch('requests.Session.request')
+    def test_redis_lock_held_across_workers(self, mock_request, mock_acquire, mock_release):
+        """Verifies that the cross-worker Redis lock is taken and released when enabled."""
+        self.app.config['IMAGE_PROXY_COALESCE_REDIS'] = True
+        mock_request.return_value = self._mock_response([b'x'])
+        lock = MagicMock()
+        mock_acquire.return_value = lock
+
+        response = self.client.get(url_for('proxy.image_proxy', path=self.path))
+        self.assertEqual(response.data, b'x')
+        response.close()
+        mock_acquire.assert_called_once()
+        mock_release.assert_called_with(lock)
+
+
+class TestImageProxyResilience(TestCaseDatabase):
+    """Tests for retry classification, the retry budget and the circuit breaker."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PROXY_RETRIES': 2,
+            'IMAGE_PROXY_RETRY_DELAY': 0,
+            'IMAGE_PROXY_BREAKER_MIN_REQUESTS': 4,
+            'IMAGE_PROXY_BREAKER_ERROR_RATE': 0.5,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        upstream_mod.reset_resilience()
+
+    def tearDown(self):
+        upstream_mod.reset_resilience()
+        super().tearDown()
+
+    def _mock_response(self, status_code):
+        response = MagicMock()
+        response.status_code = status_code
+        response.headers = {}
+        response.raw.stream.return_value = [b'body']
+        return response
+
+    @patch('requests.Session.request')
+    def test_404_not_retried(self, mock_request):
+        """Verifies that a missing image is returned immediately without retrying."""
+        mock_request.return_value = self._mock_response(404)
+        response = self.client.get(url_for('proxy.image_proxy', path='missing-~path'))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(mock_request.call_count, 1)
+
+    @patch('requests.Session.request')
+    def test_timeout_retried_then_504(self, mock_request):
+        """Verifies that timeouts are retried and reported as 504 once retries are exhausted."""
+        mock_request.side_effect = requests.ReadTimeout('slow')
+        response = self.client.get(url_for('proxy.image_proxy', path='slow-~path'))
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(mock_request.call_count, 3)
+
+    @patch('requests.Session.request')
+    def test_retry_budget_limits_retries(self, mock_request):
+        """Verifies that no retry is attempted once the worker's retry budget is spent."""
+        upstream_mod.get_retry_budget().tokens = 0
+        upstream_mod.get_retry_budget().min_per_second = 0
+        mock_request.return_value = self._mock_response(503)
+        response = self.client.get(url_for('proxy.image_proxy', path='failing-~path'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertGreaterEqual(upstream_mod.get_retry_budget().denied, 1)
+
+    @patch('requests.Session.request')
+    def test_open_breaker_fails_fast(self, mock_request):
+        """Verifies that an open breaker answers 503 with Retry-After without contacting the upstream."""
+        mock_request.return_value = self._mock_response(500)
+        self.client.get(url_for('proxy.image_proxy', path='failing-~path'))
+        self.client.get(url_for('proxy.image_proxy', path='failing-~path'))
+        self.assertEqual(upstream_mod.get_breaker().state, CircuitBreaker.OPEN)
+
+        calls = mock_request.call_count
+        response = self.client.get(url_for('proxy.image_proxy', path='other-~path'))
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(mock_request.call_count, calls)
+
+    def test_breaker_half_open_probe(self):
+        """Verifies that after the cooldown a single probe is allowed and its success closes the breaker."""
+        now = [0.0]
+        breaker = CircuitBreaker(error_rate=0.5, min_requests=2, window=10, cooldown=5, clock=lambda: now[0])
+        breaker.record(False)
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        now[0] = 6.0
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    @patch('requests.Session.request')
+    def test_breaker_probe_released_on_unexpected_error(self, mock_request):
+        """Verifies that a probe failing with an unexpected exception reopens the breaker instead of blocking it."""
+        now = [0.0]
+        breaker = CircuitBreaker(error_rate=0.5, min_requests=2, window=10, cooldown=5, clock=lambda: now[0])
+        breaker.record(False)
+        breaker.record(False)
+        now[0] = 6.0
+
+        mock_request.side_effect = requests.exceptions.InvalidHeader('bad header')
+        with patch('scan_explorer_service.utils.image_utils.get_breaker', return_value=breaker):
+            with self.assertRaises(requests.exceptions.InvalidHeader):
+                self.client.get(url_for('proxy.image_proxy', path='probe-~path'))
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+            now[0] = 12.0
+            mock_request.side_effect = None
+            mock_request.return_value = self._mock_response(200)
+            response = self.client.get(url_for('proxy.image_proxy', path='probe-~path'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    @patch('requests.Session.request')
+    def test_hop_by_hop_headers_not_forwarded(self, mock_request):
+        """Verifies that connection-specific request headers are not forwarded to the image server."""
+        mock_request.return_value = self._mock_response(200)
+        self.client.get(url_for('proxy.image_proxy', path='some-~path'),
+                        headers={'Connection': 'close, X-Trace', 'Keep-Alive': 'timeout=5', 'TE': 'trailers',
+                                 'Upgrade': 'h2c', 'X-Trace': '1', 'Proxy-Authorization': 'Basic abc', 'User-Agent': 'viewer'})
+        sent = {name.lower() for name in mock_request.call_args[1]['headers']}
+        self.assertFalse(sent & {'connection', 'keep-alive', 'te', 'upgrade', 'x-trace', 'proxy-authorization'})
+        self.assertIn('user-agent', sent)
+
+    def test_breaker_ignores_old_failures(self):
+        """Verifies that failures outside the window do not count towards the error rate."""
+        now = [0.0]
+        breaker = CircuitBreaker(error_rate=0.5, min_requests=2, window=10, cooldown=5, clock=lambda: now[0])
+        breaker.record(False)
+        now[0] = 20.0
+        breaker.record(True)
+        breaker.record(False)
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_retry_budget_refills(self):
+        """Verifies that traffic and time both earn retry tokens."""
+        now = [0.0]
+        budget = RetryBudget(ratio=0.5, min_per_second=1, max_tokens=1, clock=lambda: now[0])
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        now[0] = 1.0
+        self.assertTrue(budget.withdraw())
+
+    def test_stats_endpoint_reports_breaker(self):
+        """Verifies that breaker and retry budget state is exposed for monitoring."""
+        upstream_mod.get_breaker()
+        upstream_mod.get_retry_budget()
+        data = json.loads(self.client.get(url_for('image_admin.image_proxy_stats')).data)
+        self.assertEqual(data['breaker']['state'], 'closed')
+        self.assertIn('tokens', data['retry_budget'])
+
+
+class TestThumbnailIndex(TestCaseDatabase):
+    """Tests for the precomputed thumbnail path index."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'OPEN_SEARCH_URL': 'http://localhost:1234',
+            'OPEN_SEARCH_INDEX': 'test',
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        cache_mod._thumbnail_local.clear()
+        self.collection_json = {
+            'type': 'type',
+            'journal': 'journal',
+            'volume': 'volume',
+            'pages': [{
+                'name': 'pageA',
+                'color_type': 'BW',
+                'page_type': 'Normal',
+                'label': '1',
+                'width': 100,
+                'height': 100,
+                'volume_running_page_num': 1,
+                'articles': [{'bibcode': '2000ApJ...001..001A'}],
+            }]
+        }
+
+    def _mock_response(self):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.raw.stream.return_value = [b'thumb']
+        return mock_response
+
+    @patch('scan_explorer_service.views.image_proxy.item_thumbnail_path')
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_ingest_populates_index(self, mock_request, mock_lookup):
+        """Verifies that thumbnails of an ingested collection are served without a database lookup."""
+        mock_request.return_value = self._mock_response()
+        r = self.client.put(url_for('metadata.put_collection'), json=self.collection_json)
+        self.assertEqual(r.status_code, 200)
+        collection_id = r.get_json()['id']
+
+        for type, id in (('collection', collection_id), ('article', '2000ApJ...001..001A')):
+            response = self.client.get(url_for('proxy.image_proxy_thumbnail', id=id, type=type))
+            self.assertEqual(response.status_code, 200)
+        mock_lookup.assert_not_called()
+        self.assertIn('pageA/square/480,480/0/bitonal.jpg', mock_request.call_args[0][1])
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_miss_populates_index(self, mock_request):
+        """Verifies that a thumbnail missing from the index is resolved once and then indexed."""
+        mock_request.return_value = self._mock_response()
+        collection_id = self.client.put(url_for('metadata.put_collection'), json=self.collection_json).get_json()['id']
+        cache_mod._thumbnail_local.clear()
+
+        self.assertIsNone(cache_mod.cache_get_thumbnail('collection', collection_id))
+        response = self.client.get(url_for('proxy.image_proxy_thumbnail', id=collection_id, type='collection'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(cache_mod.cache_get_thumbnail('collection', collection_id))
+
+    def test_invalid_type(self):
+        """Verifies that an unknown item type is rejected before any lookup."""
+        response = self.client.get(url_for('proxy.image_proxy_thumbnail', id='x', type='volume'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_thumbnails(self):
+        """Verifies that many thumbnail URLs are resolved in one request and indexed for the next one."""
+        self.collection_json['pages'].insert(0, dict(self.collection_json['pages'][0], name='pageB', volume_running_page_num=2))
+        collection_id = self.client.put(url_for('metadata.put_collection'), json=self.collection_json).get_json()['id']
+        cache_mod._thumbnail_local.clear()
+        items = [{'id': collection_id, 'type': 'collection'},
+                 {'id': '2000ApJ...001..001A', 'type': 'article'},
+                 {'id': '2000ApJ...999..999Z', 'type': 'article'},
+                 {'id': 'missing', 'type': 'page'}]
+
+        response = self.client.post(url_for('proxy.image_proxy_thumbnails'), json=items)
+
+        self.assertEqual(response.status_code, 200)
+        thumbnails = response.get_json()['thumbnails']
+        self.assertEqual([(t['id'], t['type']) for t in thumbnails], [(i['id'], i['type']) for i in items])
+        self.assertIn('pageA/square/480,480/0/bitonal.jpg', thumbnails[0]['url'])
+        self.assertIn('pageA/square/480,480/0/bitonal.jpg', thumbnails[1]['url'])
+        self.assertIsNone(thumbnails[2]['url'])
+        self.assertIsNone(thumbnails[3]['url'])
+
+        with patch('scan_explorer_service.views.image_proxy.item_thumbnail_paths') as mock_lookup:
+            response = self.client.post(url_for('proxy.image_proxy_thumbnails'), json=items[:2])
+            self.assertEqual(len(response.get_json()['thumbnails']), 2)
+            mock_lookup.assert_not_called()
+
+    def test_batch_thumbnails_invalid(self):
+        """Verifies that malformed, oversized and mistyped batches are rejected."""
+        self.app.config['IMAGE_THUMBNAIL_BATCH_LIMIT'] = 2
+        url = url_for('proxy.image_proxy_thumbnails')
+        self.assertEqual(self.client.post(url, json={'id': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post(url, json=[{'id': 'x', 'type': 'page'}] * 3).status_code, 400)
+        self.assertEqual(self.client.post(url, json=[{'id': 'x', 'type': 'volume'}]).status_code, 400)
+
+
+class TestS3ClientRegistry(TestCaseDatabase):
+    """Tests for the S3 client shared by the threads of a worker."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'AWS_BUCKET_NAME_IMAGE': 'image-bucket',
+            'AWS_BUCKET_NAME_PDF': 'pdf-bucket',
+            'S3_MAX_POOL_CONNECTIONS': 16,
+        })
+
+    def setUp(self):
+        s3_utils_mod.reset_s3_client()
+
+    def tearDown(self):
+        s3_utils_mod.reset_s3_client()
+        super().tearDown()
+
+    @patch('scan_explorer_service.utils.s3_utils.boto3')
+    def test_client_is_shared(self, mock_boto3):
+        """Verifies that every S3Provider of a worker, in any thread, uses a single configured client."""
+        created = sample_value('scan_s3_client_create_seconds_count')
+        providers = []
+
+        def provide():
+            providers.append(S3Provider(self.app.config, 'AWS_BUCKET_NAME_IMAGE'))
+
+        threads = [threading.Thread(target=provide) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        providers.append(S3Provider(self.app.config, 'AWS_BUCKET_NAME_PDF'))
+
+        mock_boto3.session.Session.return_value.client.assert_called_once()
+        config = mock_boto3.session.Session.return_value.client.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections, 16)
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(len({id(provider.client) for provider in providers}), 1)
+        self.assertEqual(providers[-1].bucket_name, 'pdf-bucket')
+        self.assertEqual(sample_value('scan_s3_client_create_seconds_count') - created, 1)
+
+    @patch('scan_explorer_service.utils.s3_utils.boto3')
+    def test_saturated_requests_counted(self, mock_boto3):
+        """Verifies that requests sent while the S3 pool has no idle connection are counted."""
+        client = mock_boto3.session.Session.return_value.client.return_value
+        pool = client._endpoint.http_session._manager.connection_from_url.return_value
+        S3Provider(self.app.config, 'AWS_BUCKET_NAME_IMAGE')
+        before_send = client.meta.events.register.call_args[0][1]
+        requests, saturated = sample_value('scan_s3_requests_total'), sample_value('scan_s3_saturated_requests_total')
+
+        pool.pool.qsize.return_value = 3
+        before_send(request=MagicMock(url='https://s3.amazonaws.com/image-bucket/key'))
+        pool.pool.qsize.return_value = 0
+        before_send(request=MagicMock(url='https://s3.amazonaws.com/image-bucket/key'))
+
+        self.assertEqual(sample_value('scan_s3_requests_total'), requests + 2)
+        self.assertEqual(sample_value('scan_s3_saturated_requests_total'), saturated + 1)
+
+    @patch('scan_explorer_service.utils.s3_utils.boto3')
+    def test_client_is_created_again_after_fork(self, mock_boto3):
+        """Verifies that a forked worker does not reuse the connections of its parent."""
+        S3Provider(self.app.config, 'AWS_BUCKET_NAME_IMAGE')
+        with patch('scan_explorer_service.utils.process.os.getpid', return_value=-1):
+            S3Provider(self.app.config, 'AWS_BUCKET_NAME_IMAGE')
+        self.assertEqual(mock_boto3.session.Session.return_value.client.call_count, 2)
+
+
+class TestPdfCache(TestCaseDatabase):
+    """Tests for the store of generated PDFs."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'OPEN_SEARCH_URL': 'http://localhost:1234',
+            'OPEN_SEARCH_INDEX': 'test',
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PDF_CACHE': 'local',
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        self.pdf_dir = tempfile.mkdtemp()
+        self.app.config['IMAGE_PDF_CACHE_DIR'] = self.pdf_dir
+        self.collection_json = {
+            'type': 'type',
+            'journal': 'journal',
+            'volume': 'volume',
+            'pages': [{'name': 'pageA', 'color_type': 'BW', 'page_type': 'Normal', 'label': '1',
+                       'width': 100, 'height': 100, 'volume_running_page_num': 1}],
+        }
+        self.collection_id = self.client.put(url_for('metadata.put_collection'), json=self.collection_json).get_json()['id']
+
+    def tearDown(self):
+        shutil.rmtree(self.pdf_dir, ignore_errors=True)
+        super().tearDown()
+
+    @staticmethod
+    def _jpeg():
+        from PIL import Image
+        data = io.BytesIO()
+        Image.new('RGB', (60, 80), 'red').save(data, 'JPEG')
+        return data.getvalue()
+
+    def _get_pdf(self):
+        response = self.client.get(url_for('pdf.pdf_save', id=self.collection_id, page_start=1, page_end=1))
+        data = response.data
+        response.close()
+        return response, data
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_generated_pdf_is_reused(self, mock_fetch_images):
+        """Verifies that a generated PDF is stored and served again without fetching page images."""
+        mock_fetch_images.side_effect = lambda *args: iter([self._jpeg()])
+
+        response, generated = self._get_pdf()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        response, stored = self._get_pdf()
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(stored, generated)
+        self.assertEqual(mock_fetch_images.call_count, 1)
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_put_collection_invalidates(self, mock_fetch_images):
+        """Verifies that rewriting a collection drops its generated PDFs."""
+        mock_fetch_images.side_effect = lambda *args: iter([self._jpeg()])
+        self._get_pdf()
+
+        self.client.put(url_for('metadata.put_collection'), json=self.collection_json)
+        response, _ = self._get_pdf()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(mock_fetch_images.call_count, 2)
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_incomplete_pdf_is_not_stored(self, mock_fetch_images):
+        """Verifies that a PDF with pages left out is not stored."""
+        mock_fetch_images.side_effect = lambda *args: iter([self._jpeg(), b'not an image'])
+        self._get_pdf()
+        response, _ = self._get_pdf()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_unfetched_first_page_is_counted(self, mock_fetch_images):
+        """Verifies that a PDF whose first page image could not be fetched is marked and not stored."""
+        mock_fetch_images.side_effect = lambda *args: iter([None, self._jpeg()])
+        response, data = self._get_pdf()
+        self.assertIn(b'/Count 1', data)
+        self.assertIn(b'/Subject (Incomplete, 1 missing pages)', data)
+        response, _ = self._get_pdf()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_unfetched_page_is_left_out(self, mock_fetch_images):
+        """Verifies that a page image that could not be fetched is left out of a complete PDF, which is not stored."""
+        mock_fetch_images.side_effect = lambda *args: iter([self._jpeg(), None, self._jpeg()])
+        response, data = self._get_pdf()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/Count 2', data)
+        self.assertIn(b'/Subject (Incomplete, 1 missing pages)', data)
+        self.assertTrue(data.rstrip().endswith(b'%%EOF'))
+        response, _ = self._get_pdf()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    def test_s3_store_errors_are_not_misses(self, mock_open):
+        """Verifies that only a missing object is a miss of the S3 store, and other S3 errors are raised."""
+        from botocore.exceptions import ClientError
+        from scan_explorer_service.utils.pdf_cache import S3PdfStore
+        store = S3PdfStore(self.app.config)
+
+        mock_open.side_effect = ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        self.assertIsNone(store.open('generated/key.pdf'))
+        mock_open.side_effect = ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetObject')
+        with self.assertRaises(ClientError):
+            store.open('generated/key.pdf')
+
+
+class TestPdfJobs(TestCaseDatabase):
+    """Tests for PDF generation in background jobs."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'OPEN_SEARCH_URL': 'http://localhost:1234',
+            'OPEN_SEARCH_INDEX': 'test',
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PDF_JOB_PAGE_LIMIT': 5,
+            'IMAGE_PDF_CACHE': 'local',
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        self.pdf_dir = tempfile.mkdtemp()
+        self.app.config['IMAGE_PDF_CACHE_DIR'] = self.pdf_dir
+        cache_mod._pdf_job_local.clear()
+        cache_mod._pdf_jobs_local.clear()
+        self.collection = Collection(type='type', journal='journal', volume='volume')
+        self.app.db.session.add(self.collection)
+        self.app.db.session.commit()
+        self.app.db.session.refresh(self.collection)
+        for i in range(1, 4):
+            page = Page(name=f'page{i}', collection_id=self.collection.id, volume_running_page_num=i)
+            page.label = str(i)
+            self.app.db.session.add(page)
+        self.app.db.session.commit()
+
+    def tearDown(self):
+        pdf_jobs_mod.reset_pdf_job_runner(wait=True)
+        shutil.rmtree(self.pdf_dir, ignore_errors=True)
+        super().tearDown()
+
+    @staticmethod
+    def _jpeg():
+        from PIL import Image
+        data = io.BytesIO()
+        Image.new('RGB', (60, 80), 'red').save(data, 'JPEG')
+        return data.getvalue()
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_job_lifecycle(self, mock_fetch_images):
+        """Verifies that a job is queued, reports its progress and serves its PDF once done."""
+        mock_fetch_images.side_effect = lambda *args: iter([self._jpeg()] * 3)
+
+        response = self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id))
+        self.assertEqual(response.status_code, 202)
+        job = response.get_json()
+        self.assertEqual(job['total'], 3)
+        self.assertIn(job['id'], response.headers['Location'])
+        pdf_jobs_mod.reset_pdf_job_runner(wait=True)
+
+        response = self.client.get(url_for('pdf.pdf_job_status', job_id=job['id']))
+        self.assertEqual(response.status_code, 200)
+        status = response.get_json()
+        self.assertEqual((status['state'], status['pages_done'], status['pages_skipped']), ('done', 3, 0))
+
+        response = self.client.get(url_for('pdf.pdf_job_download', job_id=job['id']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'application/pdf')
+        self.assertIn(b'/Count 3', response.data)
+        response.close()
+
+        response = self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id))
+        self.assertEqual(response.get_json()['id'], job['id'])
+        self.assertEqual(mock_fetch_images.call_count, 1)
+
+    @patch('scan_explorer_service.views.pdf.fetch_images', side_effect=lambda *args: iter([b'not an image']))
+    def test_failed_job(self, mock_fetch_images):
+        """Verifies that a job whose images cannot be converted fails and has nothing to download."""
+        job = self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id)).get_json()
+        pdf_jobs_mod.reset_pdf_job_runner(wait=True)
+
+        status = self.client.get(url_for('pdf.pdf_job_status', job_id=job['id'])).get_json()
+        self.assertEqual(status['state'], 'failed')
+        self.assertIsNotNone(status['error'])
+        response = self.client.get(url_for('pdf.pdf_job_download', job_id=job['id']))
+        self.assertEqual(response.status_code, 409)
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_stale_job_resubmitted(self, mock_fetch_images):
+        """Verifies that a job left running by a worker that stopped is reported failed and replaced when resubmitted."""
+        mock_fetch_images.side_effect = lambda *args: iter([self._jpeg()] * 3)
+        job = self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id)).get_json()
+        pdf_jobs_mod.reset_pdf_job_runner(wait=True)
+        status = cache_mod.cache_get_pdf_job(job['id'])
+        status.update(state='running', heartbeat_at='2000-01-01T00:00:00+00:00')
+        cache_mod.cache_set_pdf_job(job['id'], status)
+
+        status = self.client.get(url_for('pdf.pdf_job_status', job_id=job['id'])).get_json()
+        self.assertEqual(status['state'], 'failed')
+
+        response = self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id))
+        self.assertEqual(response.get_json()['id'], job['id'])
+        self.assertEqual(response.get_json()['state'], 'done')
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_job_with_removed_pdf_resubmitted(self, mock_fetch_images):
+        """Verifies that a finished job whose PDF was removed, e.g. by a lifecycle rule, runs again when resubmitted."""
+        mock_fetch_images.side_effect = lambda *args: iter([self._jpeg()] * 3)
+        job = self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id)).get_json()
+        pdf_jobs_mod.reset_pdf_job_runner(wait=True)
+        shutil.rmtree(self.pdf_dir)
+
+        response = self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json()['id'], job['id'])
+        pdf_jobs_mod.reset_pdf_job_runner(wait=True)
+        self.assertEqual(mock_fetch_images.call_count, 2)
+        response = self.client.get(url_for('pdf.pdf_job_download', job_id=job['id']))
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    @patch('scan_explorer_service.views.pdf.fetch_images')
+    def test_invalidation_removes_jobs(self, mock_fetch_images):
+        """Verifies that invalidating the PDFs of a collection forgets its jobs."""
+        mock_fetch_images.side_effect = lambda *args: iter([self._jpeg()] * 3)
+        job = self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id)).get_json()
+        pdf_jobs_mod.reset_pdf_job_runner(wait=True)
+        self.assertEqual(cache_mod.cache_get_pdf_job(job['id'])['collection_id'], self.collection.id)
+
+        invalidate_pdf_cache(self.collection.id)
+        self.assertEqual(self.client.get(url_for('pdf.pdf_job_status', job_id=job['id'])).status_code, 404)
+
+    def test_invalid_jobs(self):
+        """Verifies that jobs without an id, over the page limit or for unknown items are rejected."""
+        self.assertEqual(self.client.post(url_for('pdf.pdf_job_submit')).status_code, 400)
+        self.assertEqual(self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id,
+                                                  page_start=1, page_end=6)).status_code, 400)
+        self.assertEqual(self.client.post(url_for('pdf.pdf_job_submit', id='unknown')).status_code, 400)
+        self.assertEqual(self.client.get(url_for('pdf.pdf_job_status', job_id='unknown')).status_code, 404)
+
+    def test_jobs_need_shared_store(self):
+        """Verifies that jobs are rejected when their PDF would only be kept on the host that generated it."""
+        self.app.config['IMAGE_PDF_CACHE_DIR'] = None
+        self.assertEqual(self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id)).status_code, 503)
+        self.app.config['IMAGE_PDF_CACHE'] = None
+        self.assertEqual(self.client.post(url_for('pdf.pdf_job_submit', id=self.collection.id)).status_code, 503)
+
+
+class TestSprite(TestCaseDatabase):
+    """Tests for the thumbnail sprite and its offset map."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'OPEN_SEARCH_URL': 'http://localhost:1234',
+            'OPEN_SEARCH_INDEX': 'test',
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_SPRITE_TILE_SIZE': 50,
+            'IMAGE_SPRITE_COLUMNS': 2,
+            'IMAGE_SPRITE_PAGE_LIMIT': 5,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        self.cache_dir = tempfile.mkdtemp()
+        self.app.config['IMAGE_CACHE_DIR'] = self.cache_dir
+        image_cache_mod.reset_image_cache()
+        self.collection = Collection(type='type', journal='journal', volume='volume')
+        self.app.db.session.add(self.collection)
+        self.app.db.session.commit()
+        self.app.db.session.refresh(self.collection)
+        for i in range(1, 4):
+            page = Page(name=f'page{i}', collection_id=self.collection.id, volume_running_page_num=i)
+            page.label = str(i)
+            self.app.db.session.add(page)
+        self.app.db.session.commit()
+
+    def tearDown(self):
+        image_cache_mod.reset_image_cache()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().tearDown()
+
+    def _mock_response(self):
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.new('RGB', (480, 480), (0, 0, 0)).save(buf, 'JPEG')
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {'Content-Type': 'image/jpeg'}
+        mock_response.content = buf.getvalue()
+        return mock_response
+
+    def test_sprite_map(self):
+        """Verifies that the offset map lays pages out row by row."""
+        response = self.client.get(url_for('sprite.sprite_map', id=self.collection.id))
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual((data['width'], data['height']), (100, 100))
+        self.assertEqual([(p['x'], p['y']) for p in data['pages']], [(0, 0), (50, 0), (0, 50)])
+        self.assertEqual([p['label'] for p in data['pages']], ['1', '2', '3'])
+        self.assertIn('sprite.jpg', data['sprite'])
+
+        response = self.client.get(url_for('sprite.sprite_map', id=self.collection.id),
+                                   headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_sprite_image_is_cached(self, mock_request):
+        """Verifies that a sprite is composited from page thumbnails once and then served from the cache."""
+        from PIL import Image
+        mock_request.return_value = self._mock_response()
+        url = url_for('sprite.sprite_image', id=self.collection.id, page_start=1, page_end=3)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertTrue(all('square/480,480' in call[0][1] for call in mock_request.call_args_list))
+        sprite = Image.open(io.BytesIO(response.data))
+        self.assertEqual(sprite.size, (100, 100))
+        self.assertLess(sum(sprite.getpixel((25, 25))), 100)
+        self.assertGreater(sum(sprite.getpixel((75, 75))), 700)
+        response.close()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(mock_request.call_count, 3)
+        response.close()
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_sprite_image_is_cached_without_disk_cache(self, mock_request):
+        """Verifies that a sprite is not composited again when IMAGE_CACHE_DIR is not set."""
+        self.app.config['IMAGE_CACHE_DIR'] = None
+        mock_request.return_value = self._mock_response()
+        url = url_for('sprite.sprite_image', id=self.collection.id, page_start=1, page_end=3)
+
+        first = self.client.get(url)
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        second = self.client.get(url)
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(mock_request.call_count, 3)
+
+    def test_sprite_page_limit(self):
+        """Verifies that a sprite cannot span more pages than IMAGE_SPRITE_PAGE_LIMIT."""
+        response = self.client.get(url_for('sprite.sprite_image', id=self.collection.id, page_start=1, page_end=10))
+        self.assertEqual(response.status_code, 400)
+
+
+class TestPrewarm(TestCaseDatabase):
+    """Tests for warming the image server after a collection is ingested."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'OPEN_SEARCH_URL': 'http://localhost:1234',
+            'OPEN_SEARCH_INDEX': 'test',
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PREWARM_ENABLED': True,
+            'IMAGE_PREWARM_FIRST_PAGES': 1,
+            'IMAGE_PREWARM_SIZES': ['info.json', 'full/1000,'],
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        prewarm_mod.reset_prewarmer()
+        self.collection_json = {
+            'type': 'type',
+            'journal': 'journal',
+            'volume': 'volume',
+            'pages': [{
+                'name': f'page{i}',
+                'color_type': 'Grayscale',
+                'page_type': 'Normal',
+                'label': str(i),
+                'width': 100,
+                'height': 100,
+                'volume_running_page_num': i,
+                'articles': [{'bibcode': f'2000ApJ...001..00{i}A'}],
+            } for i in (1, 2)]
+        }
+
+    def tearDown(self):
+        prewarm_mod.reset_prewarmer()
+        super().tearDown()
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_put_collection_prewarms(self, mock_request):
+        """Verifies that thumbnails and the configured sizes of the first pages are requested after ingest."""
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.content = b'image'
+        mock_request.return_value = mock_response
+
+        r = self.client.put(url_for('metadata.put_collection'), json=self.collection_json)
+        self.assertEqual(r.status_code, 200)
+        collection_id = r.get_json()['id']
+        prewarm_mod._prewarmer.current().shutdown()
+
+        urls = sorted(call[0][1] for call in mock_request.call_args_list)
+        self.assertEqual(len(urls), 4)
+        self.assertTrue(any(url.endswith('page1.tif/info.json') for url in urls))
+        self.assertTrue(any(url.endswith('page1.tif/full/1000,/0/gray.jpg') for url in urls))
+        self.assertTrue(any(url.endswith('page2.tif/square/480,480/0/gray.jpg') for url in urls))
+        headers = mock_request.call_args_list[0][1]['headers']
+        self.assertIn('X-Forwarded-Host', headers)
+
+        status = self.client.get(url_for('image_admin.image_proxy_prewarm', id=collection_id)).get_json()
+        self.assertEqual(status['state'], 'done')
+        self.assertEqual((status['total'], status['warmed'], status['failed']), (4, 4, 0))
+        self.assertEqual(len(self.client.get(url_for('image_admin.image_proxy_prewarm')).get_json()['jobs']), 1)
+
+    @patch('scan_explorer_service.utils.cache._get_redis')
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_status_shared_between_workers(self, mock_request, mock_get_redis):
+        """Verifies that the status of a prewarm job is published to Redis and read back from it by any worker."""
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.content = b'image'
+        mock_request.return_value = mock_response
+        stored = {}
+        redis_client = MagicMock()
+        redis_client.pipeline.return_value.setex.side_effect = lambda key, ttl, value: stored.__setitem__(key, value)
+        redis_client.get.side_effect = stored.get
+        mock_get_redis.return_value = redis_client
+
+        r = self.client.put(url_for('metadata.put_collection'), json=self.collection_json)
+        collection_id = r.get_json()['id']
+        prewarm_mod.reset_prewarmer()
+        key = f'{cache_mod.PREWARM_JOB_CACHE_PREFIX}{collection_id}'
+        self.assertEqual(json.loads(stored[key])['state'], 'done')
+        self.assertEqual(redis_client.pipeline.return_value.zadd.call_args[0][0], cache_mod.PREWARM_JOBS_KEY)
+
+        status = self.client.get(url_for('image_admin.image_proxy_prewarm', id=collection_id)).get_json()
+        self.assertEqual((status['state'], status['warmed']), ('done', 4))
+        redis_client.zrevrange.return_value = [collection_id]
+        redis_client.mget.side_effect = lambda keys: [stored.get(key) for key in keys]
+        jobs = self.client.get(url_for('image_admin.image_proxy_prewarm')).get_json()['jobs']
+        self.assertEqual([job['id'] for job in jobs], [collection_id])
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_prewarm_disabled(self, mock_request):
+        """Verifies that nothing is requested when IMAGE_PREWARM_ENABLED is off."""
+        self.app.config['IMAGE_PREWARM_ENABLED'] = False
+        r = self.client.put(url_for('metadata.put_collection'), json=self.collection_json)
+        self.assertEqual(r.status_code, 200)
+        self.assertIsNone(prewarm_mod._prewarmer.current())
+        mock_request.assert_not_called()
+        response = self.client.get(url_for('image_admin.image_proxy_prewarm', id=r.get_json()['id']))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestPrefetch(TestCaseDatabase):
+    """Tests for prefetching the derivatives of the following pages."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+            'IMAGE_PREFETCH_DEPTH': 2,
+        })
+
+    def setUp(self):
+        Base.metadata.drop_all(bind=self.app.db.engine)
+        Base.metadata.create_all(bind=self.app.db.engine)
+        self.cache_dir = tempfile.mkdtemp()
+        self.app.config['IMAGE_CACHE_DIR'] = self.cache_dir
+        image_cache_mod.reset_image_cache()
+        prefetch_mod.reset_prefetcher()
+        image_proxy_mod._volume_image_paths.clear()
+
+        collection = Collection(type='type', journal='journal', volume='volume')
+        self.app.db.session.add(collection)
+        self.app.db.session.commit()
+        self.pages = []
+        for i in range(1, 5):
+            page = Page(name=f'page{i}', collection_id=collection.id, volume_running_page_num=i)
+            self.app.db.session.add(page)
+            self.pages.append(page)
+        self.app.db.session.commit()
+        self.paths = [f'{page.image_path}/full/1000,/0/default.jpg' for page in self.pages]
+
+    def tearDown(self):
+        prefetch_mod.reset_prefetcher()
+        image_cache_mod.reset_image_cache()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().tearDown()
+
+    def _mock_response(self, *args, **kwargs):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {'Content-Type': 'image/jpeg'}
+        mock_response.content = b'image'
+        mock_response.raw.stream.return_value = [b'image']
+        return mock_response
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_prefetches_following_pages(self, mock_request):
+        """Verifies that requesting a page prefetches the same derivative of the next pages into the cache."""
+        mock_request.side_effect = self._mock_response
+
+        response = self.client.get(url_for('proxy.image_proxy', path=self.paths[0]))
+        response.close()
+        prefetch_mod._prefetcher.current().shutdown()
+
+        urls = [call[0][1] for call in mock_request.call_args_list]
+        self.assertEqual(len(urls), 3)
+        self.assertTrue(any(url.endswith(self.paths[1]) for url in urls))
+        self.assertTrue(any(url.endswith(self.paths[2]) for url in urls))
+
+        response = self.client.get(url_for('proxy.image_proxy', path=self.paths[1]))
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        response.close()
+
+        stats = json.loads(self.client.get(url_for('image_admin.image_proxy_stats')).data)['prefetch']
+        self.assertEqual(stats['prefetched'], 2)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_prefetch_disabled(self, mock_request):
+        """Verifies that nothing is prefetched when IMAGE_PREFETCH_DEPTH is 0."""
+        mock_request.side_effect = self._mock_response
+        self.app.config['IMAGE_PREFETCH_DEPTH'] = 0
+
+        response = self.client.get(url_for('proxy.image_proxy', path=self.paths[0]))
+        response.close()
+
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertIsNone(prefetch_mod._prefetcher.current())
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_tiles_not_prefetched(self, mock_request):
+        """Verifies that only whole page derivatives are prefetched."""
+        mock_request.side_effect = self._mock_response
+        image_path = self.pages[0].image_path
+
+        response = self.client.get(url_for('proxy.image_proxy', path=f'{image_path}/0,0,512,512/512,/0/default.jpg'))
+        response.close()
+
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertIsNone(prefetch_mod._prefetcher.current())
+        self.assertTrue(image_proxy_mod.prefetchable(f'{image_path}/square/480,480/0/gray.jpg'))
+        self.assertTrue(image_proxy_mod.prefetchable(f'{image_path}/full/max/0/default.jpg'))
+        self.assertFalse(image_proxy_mod.prefetchable(f'{image_path}/full/6000,/0/default.jpg'))
+        self.assertFalse(image_proxy_mod.prefetchable(f'{image_path}/full/pct:50/0/default.jpg'))
+
+    def test_prefetch_rate_limit(self):
+        """Verifies that prefetch requests beyond IMAGE_PREFETCH_RATE are skipped."""
+        now = [0.0]
+        fetched = []
+        prefetcher = prefetch_mod.Prefetcher(self.app, lambda path: [path + '1', path + '2', path + '3'],
+                                             lambda path: fetched.append(path) or b'image',
+                                             workers=1, rate=2, max_pending=10, tracked=100, clock=lambda: now[0])
+        prefetcher.schedule('page')
+        prefetcher.shutdown()
+        self.assertEqual(fetched, ['page1', 'page2'])
+        self.assertEqual(prefetcher.stats()['rate_limited'], 1)
+
+
+class TestImageMetrics(TestCaseDatabase):
+    """Tests for the image proxy metrics and the Server-Timing header."""
+
+    def create_app(self):
+        from scan_explorer_service.app import create_app
+        return create_app(**{
+            'SQLALCHEMY_DATABASE_URI': self.postgresql_url,
+            'SQLALCHEMY_ECHO': False,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': True,
+            'TRAP_BAD_REQUEST_ERRORS': True,
+            'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+        })
+
+    @patch('scan_explorer_service.utils.image_utils.upstream_request')
+    def test_streamed_image_is_recorded(self, mock_request):
+        """Verifies that kind, status, bytes and upstream time of a streamed image are recorded."""
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.raw.stream.return_value = [b'12345', b'678']
+        mock_request.return_value = mock_response
+        requests_before = sample_value('scan_image_requests_total', kind='tile', status=200)
+        bytes_before = sample_value('scan_image_bytes_total', kind='tile')
+        ttfb_before = sample_value('scan_image_upstream_ttfb_seconds_count', kind='tile')
+
+        response = self.client.get(url_for('proxy.image_proxy', path='some-~image/0,0,100,100/100,/0/default.jpg'))
+        self.assertEqual(response.data, b'12345678')
+        response.close()
+
+        self.assertIn('upstream;desc="time to first byte";dur=', response.headers['Server-Timing'])
+        self.assertEqual(sample_value('scan_image_requests_total', kind='tile', status=200), requests_before + 1)
+        self.assertEqual(sample_value('scan_image_bytes_total', kind='tile'), bytes_before + 8)
+        self.assertEqual(sample_value('scan_image_upstream_ttfb_seconds_count', kind='tile'), ttfb_before + 1)
+
+    @patch('scan_explorer_service.utils.s3_utils.S3Provider.open_object_s3')
+    def test_passthrough_image_is_recorded(self, mock_open):
+        """Verifies that images served from S3, which skip the image server, are recorded too."""
+        body = MagicMock()
+        body.iter_chunks.return_value = [b'II*\x00']
+        mock_open.return_value = {'Body': body, 'ETag': '"s3etag"', 'ContentLength': 4}
+        requests_before = sample_value('scan_image_requests_total', kind='full', status=200)
+        bytes_before = sample_value('scan_image_bytes_total', kind='full')
+
+        response = self.client.get(url_for('proxy.image_proxy', path='some-~image.tif/full/full/0/default.tif'))
+        self.assertEqual(response.data, b'II*\x00')
+        response.close()
+
+        self.assertEqual(sample_value('scan_image_requests_total', kind='full', status=200), requests_before + 1)
+        self.assertEqual(sample_value('scan_image_bytes_total', kind='full'), bytes_before + 4)
+
+    def test_cached_image_keeps_passthrough(self):
+        """Verifies that disk cache hits are still handed to the server as files, and recorded."""
+        body_path = os.path.join(tempfile.mkdtemp(), 'body')
+        with open(body_path, 'wb') as f:
+            f.write(b'cached')
+        timing = image_proxy_mod.ImageTiming('tile')
+        requests_before = sample_value('scan_image_requests_total', kind='tile', status=200)
+        bytes_before = sample_value('scan_image_bytes_total', kind='tile')
+
+        resp = image_proxy_mod.cached_image_response(body_path, [('Content-Type', 'image/jpeg')])
+        body = resp.response
+        resp = image_proxy_mod.instrument_image_response(resp, timing)
+        resp.response.close()
+
+        self.assertTrue(resp.direct_passthrough)
+        self.assertIs(resp.response, body)
+        self.assertEqual(sample_value('scan_image_requests_total', kind='tile', status=200), requests_before + 1)
+        self.assertEqual(sample_value('scan_image_bytes_total', kind='tile'), bytes_before + 6)
+
+    def test_request_kinds(self):
+        """Verifies the classification of IIIF requests."""
+        self.assertEqual(image_proxy_mod.image_request_kind('some-~image/info.json'), 'info')
+        self.assertEqual(image_proxy_mod.image_request_kind('some-~image/full/full/0/default.jpg'), 'full')
+        self.assertEqual(image_proxy_mod.image_request_kind('some-~image/square/480,480/0/gray.jpg'), 'thumbnail')
+        self.assertEqual(image_proxy_mod.image_request_kind('some-~image/0,0,512,512/512,/0/default.jpg'), 'tile')
+
+    def test_metrics_endpoint(self):
+        """Verifies that the scrape endpoint renders the Prometheus text format."""
+        self.client.get(url_for('proxy.image_proxy', path='some-~image/info.json'))
+
+        response = self.client.get(url_for('image_admin.image_proxy_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE scan_image_requests_total counter', response.data.decode())
+        self.assertIn('scan_image_request_seconds_bucket{kind="info",le="0.005"}', response.data.decode())
+
+    @patch.dict(os.environ)
+    def test_metrics_of_all_workers(self):
+        """Verifies that with PROMETHEUS_MULTIPROC_DIR set the values written by every worker are added up."""
+        directory = tempfile.mkdtemp()
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = directory
+        worker = ("from prometheus_client import Counter; "
+                  "Counter('test_requests', 'Test counter', ['kind'], registry=None).labels(kind='a').inc(2)")
+        for _ in range(2):
+            subprocess.run([sys.executable, '-c', worker], check=True)
+
+        response = self.client.get(url_for('image_admin.image_proxy_metrics'))
+        self.assertIn('test_requests_total{kind="a"} 4.0', response.data.decode())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,186 @@
+import io
+from flask import Response, current_app, request, send_file, redirect
+from botocore.exceptions import ClientError
+from prometheus_client import Counter
+from scan_explorer_service.models import Article, Collection
+from scan_explorer_service.utils.s3_utils import S3Provider
+from scan_explorer_service.utils.cache import cache_get_article_pdf, cache_set_article_pdfs
+
+CHUNK_SIZE = 64*1024
+
+# year (4), journal (5) and volume (4) at the start of a bibcode
+BIBCODE_VOLUME_LENGTH = 13
+
+ARTICLE_PDF_LOOKUPS = Counter(
+    'scan_article_pdf_lookups', 'Existence index lookups of pre-rendered article PDFs', ['result'])
+
+
+def fetch_object(object_name, bucket_name):
+    """Download a single object from S3, raising ValueError if the content is empty."""
+    file_content = S3Provider(current_app.config, bucket_name).read_object_s3(object_name)
+    if not file_content:
+        current_app.logger.error(f"Failed to fetch content for {object_name}. File might be empty.")
+        raise ValueError(f"File content is empty for {object_name}")
+    return file_content
+
+
+def partial_object_response(object_name, bucket_name, filename, mimetype):
+    """Answer a single range request with a ranged S3 GET, or None when If-Range does not match."""
+    conditions = {}
+    if request.if_range.etag:
+        conditions['IfMatch'] = f'"{request.if_range.etag}"'
+    elif request.if_range.date:
+        conditions['IfUnmodifiedSince'] = request.if_range.date
+
+    try:
+        s3_response = S3Provider(current_app.config, bucket_name).open_object_s3(
+            object_name, Range=request.range.to_header(), **conditions)
+    except ClientError as e:
+        error = e.response.get('Error', {})
+        if error.get('Code') == 'PreconditionFailed':
+            return None
+        if error.get('Code') == 'InvalidRange':
+            resp = Response(status=416)
+            if error.get('ActualObjectSize'):
+                resp.headers['Content-Range'] = f"bytes */{error['ActualObjectSize']}"
+            return resp
+        raise
+
+    body = s3_response['Body']
+    content_range = s3_response.get('ContentRange')
+    resp = Response(body.iter_chunks(CHUNK_SIZE), status=206 if content_range else 200, mimetype=mimetype)
+    resp.call_on_close(body.close)
+    if content_range:
+        resp.headers['Content-Range'] = content_range
+    if s3_response.get('ContentLength') is not None:
+        resp.content_length = s3_response['ContentLength']
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers.set('Content-Disposition', 'attachment', filename=filename)
+    if s3_response.get('ETag'):
+        resp.headers['ETag'] = s3_response['ETag']
+    if s3_response.get('LastModified'):
+        resp.last_modified = s3_response['LastModified']
+    return resp
+
+
+def fetch_article(item, memory_limit):
+    """Try to fetch a pre-rendered PDF for an article from the ads-classic-pdf S3 bucket."""
+    object_name = f'{item.id}.pdf'.lower()
+    exists = cache_get_article_pdf(item.id)
+    ARTICLE_PDF_LOOKUPS.labels(result='unknown' if exists is None else 'found' if exists else 'missing').inc()
+    if exists is False:
+        current_app.logger.debug(f"No pre-rendered PDF for {object_name}")
+        return None
+    try:
+        response = article_response(f'pdfs/{object_name}', object_name, memory_limit)
+        record_article_pdfs({item.id: True})
+        return response
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+            current_app.logger.debug(f"No pre-rendered PDF for {object_name}")
+            record_article_pdfs({item.id: False})
+            return None
+        current_app.logger.exception(f"Failed to get PDF for {object_name}: {str(e)}")
+    except Exception as e:
+        current_app.logger.exception(f"Failed to get PDF for {object_name}: {str(e)}")
+
+
+def article_response(full_path, object_name, memory_limit):
+    """Answer with a pre-rendered article PDF. Raises ClientError if it does not exist."""
+    delivery = current_app.config.get('IMAGE_PDF_ARTICLE_DELIVERY', 'stream')
+    if delivery == 'redirect':
+        return article_redirect_response(full_path, object_name)
+
+    if request.range is not None and len(request.range.ranges) == 1:
+        response = partial_object_response(full_path, 'AWS_BUCKET_NAME_PDF', object_name, 'application/pdf')
+        if response is not None:
+            return response
+
+    if delivery == 'stream':
+        return article_stream_response(full_path, object_name)
+
+    file_content = fetch_object(full_path, 'AWS_BUCKET_NAME_PDF')
+
+    if len(file_content) > memory_limit:
+        current_app.logger.error(f"Memory limit reached: {len(file_content)} > {memory_limit}")
+
+    file_stream = io.BytesIO(file_content)
+    file_stream.seek(0)
+    resp = send_file(
+        file_stream,
+        as_attachment=True,
+        attachment_filename=object_name,
+        mimetype='application/pdf'
+    )
+    resp.headers['Accept-Ranges'] = 'bytes'
+    return resp
+
+
+def record_article_pdfs(exists):
+    """Remember whether the pre-rendered PDFs of articles exist, given as {bibcode: bool}."""
+    config = current_app.config
+    cache_set_article_pdfs({bibcode: True for bibcode, found in exists.items() if found},
+                           config.get('IMAGE_PDF_ARTICLE_FOUND_TTL', 86400))
+    cache_set_article_pdfs({bibcode: False for bibcode, found in exists.items() if not found},
+                           config.get('IMAGE_PDF_ARTICLE_MISSING_TTL', 3600))
+
+
+def index_article_pdfs(session, collection_id=None):
+    """Record which articles of a collection, or of all when None, have a pre-rendered PDF."""
+    if collection_id is not None:
+        return index_collection_pdfs(session, collection_id)
+    articles, found = 0, 0
+    collection_ids = [id for id, in session.query(Collection.id).order_by(Collection.id).all()]
+    for id in collection_ids:
+        counts = index_collection_pdfs(session, id)
+        articles += counts[0]
+        found += counts[1]
+    return articles, found
+
+
+def index_collection_pdfs(session, collection_id):
+    """Record whether the articles of one collection have a pre-rendered PDF, see index_article_pdfs."""
+    bibcodes = [bibcode for bibcode, in session.query(Article.id).filter(Article.collection_id == collection_id).all()]
+    if not bibcodes:
+        return 0, 0
+
+    # the articles of a collection can span years, so the bucket is listed once per year, journal
+    # and volume of their bibcodes rather than under a common prefix that can be as short as pdfs/
+    prefixes = sorted({bibcode.lower()[:BIBCODE_VOLUME_LENGTH] for bibcode in bibcodes})
+    s3 = S3Provider(current_app.config, 'AWS_BUCKET_NAME_PDF')
+    listed = {key[len('pdfs/'):-len('.pdf')] for prefix in prefixes
+              for key in s3.list_keys_s3(f'pdfs/{prefix}') if key.endswith('.pdf')}
+    exists = {bibcode: bibcode.lower() in listed for bibcode in bibcodes}
+    record_article_pdfs(exists)
+    return len(exists), sum(exists.values())
+
+
+def article_stream_response(object_name, filename):
+    """Stream a pre-rendered article PDF from S3 in chunks, without holding it in memory."""
+    obj = S3Provider(current_app.config, 'AWS_BUCKET_NAME_PDF').open_object_s3(object_name)
+    if not obj.get('ContentLength'):
+        obj['Body'].close()
+        raise ValueError(f"File content is empty for {object_name}")
+
+    resp = Response(obj['Body'].iter_chunks(CHUNK_SIZE), mimetype='application/pdf')
+    resp.headers['Content-Length'] = obj['ContentLength']
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers.set('Content-Disposition', 'attachment', filename=filename)
+    if obj.get('ETag'):
+        resp.headers['ETag'] = obj['ETag']
+    if obj.get('LastModified') is not None:
+        resp.last_modified = obj['LastModified']
+    resp.call_on_close(obj['Body'].close)
+    return resp
+
+
+def article_redirect_response(object_name, filename):
+    """Redirect to a presigned URL of a pre-rendered article PDF. Raises ClientError if it does not exist."""
+    s3 = S3Provider(current_app.config, 'AWS_BUCKET_NAME_PDF')
+    s3.head_object_s3(object_name)
+    url = s3.presigned_url_s3(object_name, current_app.config.get('IMAGE_PDF_ARTICLE_URL_EXPIRES', 300),
+                              ResponseContentType='application/pdf',
+                              ResponseContentDisposition=f'attachment; filename="{filename}"')
+    resp = redirect(url, code=302)
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
@@ -1,15 +1,45 @@
 import redis
+import base64
 import logging
 import threading
+import time
 import json as json_lib
+from collections import OrderedDict
+from datetime import datetime
 from flask import current_app
 
 logger = logging.getLogger(__name__)
 
 MANIFEST_CACHE_TTL = 86400
 MANIFEST_CACHE_PREFIX = 'scan:manifest:'
+MANIFEST_VALIDATOR_PREFIX = 'scan:manifest-validators:'
 SEARCH_CACHE_TTL = 60
 SEARCH_CACHE_PREFIX = 'scan:search:'
+LOCK_PREFIX = 'scan:lock:'
+REDIS_PIPELINE_CHUNK = 1000
+THUMBNAIL_CACHE_TTL = 30*86400
+THUMBNAIL_CACHE_PREFIX = 'scan:thumbnail:'
+THUMBNAIL_LOCAL_TTL = 300
+THUMBNAIL_LOCAL_MAX_ENTRIES = 100000
+IMAGE_INFO_CACHE_TTL = 86400
+IMAGE_INFO_CACHE_PREFIX = 'scan:image-info:'
+IMAGE_INFO_LOCAL_TTL = 300
+IMAGE_INFO_LOCAL_MAX_ENTRIES = 10000
+PDF_JOB_CACHE_TTL = 7*86400
+PDF_JOB_CACHE_PREFIX = 'scan:pdf-job:'
+PDF_JOBS_CACHE_PREFIX = 'scan:pdf-jobs:'
+PDF_JOB_LOCAL_MAX_ENTRIES = 1000
+PREWARM_JOB_CACHE_TTL = 86400
+PREWARM_JOB_CACHE_PREFIX = 'scan:prewarm-job:'
+PREWARM_JOBS_KEY = 'scan:prewarm-jobs'
+PREWARM_JOB_LOCAL_MAX_ENTRIES = 1000
+SPRITE_CACHE_TTL = 86400
+SPRITE_CACHE_PREFIX = 'scan:sprite:'
+SPRITE_LOCAL_TTL = 300
+SPRITE_LOCAL_MAX_ENTRIES = 50
+ARTICLE_PDF_CACHE_PREFIX = 'scan:article-pdf:'
+ARTICLE_PDF_LOCAL_TTL = 300
+ARTICLE_PDF_LOCAL_MAX_ENTRIES = 100000
 
 _redis_client = None
 _redis_lock = threading.Lock()
@@ -54,6 +84,21 @@ def _redis_get(prefix, key):
         return None
 
 
+def _redis_get_many(prefix, keys):
+    """Fetch many cached values with the same prefix in a single round trip, as {key: value} for the hits."""
+    r = _get_redis()
+    if r is None or not keys:
+        return {}
+    try:
+        values = r.mget([prefix + key for key in keys])
+    except redis.ConnectionError:
+        _reset_redis()
+        return {}
+    except Exception:
+        return {}
+    return {key: value for key, value in zip(keys, values) if value is not None}
+
+
 def _redis_set(prefix, key, value, ttl):
     """Store a value in Redis with the given prefix, key, and TTL."""
     r = _get_redis()
@@ -67,6 +112,38 @@ def _redis_set(prefix, key, value, ttl):
         logger.debug("Failed to write cache for key %s%s", prefix, key, exc_info=True)
 
 
+def _redis_set_many(prefix, mapping, ttl):
+    """Store many values with the same prefix and TTL in pipelines of REDIS_PIPELINE_CHUNK commands,
+    so that neither the client nor Redis buffers all of them at once."""
+    r = _get_redis()
+    if r is None or not mapping:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for count, (key, value) in enumerate(mapping.items(), 1):
+            pipe.setex(prefix + key, ttl, value)
+            if count % REDIS_PIPELINE_CHUNK == 0:
+                pipe.execute()
+        pipe.execute()
+    except redis.ConnectionError:
+        _reset_redis()
+    except Exception:
+        logger.debug("Failed to write %d cache entries for prefix %s", len(mapping), prefix, exc_info=True)
+
+
+def _redis_delete_many(prefix, keys):
+    """Delete many cached entries with the same prefix in a single round trip."""
+    r = _get_redis()
+    if r is None or not keys:
+        return
+    try:
+        r.delete(*[prefix + key for key in keys])
+    except redis.ConnectionError:
+        _reset_redis()
+    except Exception:
+        logger.debug("Failed to delete %d cache entries for prefix %s", len(keys), prefix, exc_info=True)
+
+
 def _redis_delete(prefix, key):
     """Delete a cached entry by prefix + key."""
     r = _get_redis()
@@ -80,6 +157,80 @@ def _redis_delete(prefix, key):
         logger.debug("Failed to delete cache for key %s%s", prefix, key, exc_info=True)
 
 
+class LocalCache:
+    """Bounded in-process LRU with per-entry expiry, used in front of Redis for hot keys."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if time.monotonic() > expires:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_thumbnail_local = LocalCache(THUMBNAIL_LOCAL_MAX_ENTRIES, THUMBNAIL_LOCAL_TTL)
+_image_info_local = LocalCache(IMAGE_INFO_LOCAL_MAX_ENTRIES, IMAGE_INFO_LOCAL_TTL)
+_pdf_job_local = LocalCache(PDF_JOB_LOCAL_MAX_ENTRIES, PDF_JOB_CACHE_TTL)
+_pdf_jobs_local = LocalCache(PDF_JOB_LOCAL_MAX_ENTRIES, PDF_JOB_CACHE_TTL)
+_prewarm_job_local = LocalCache(PREWARM_JOB_LOCAL_MAX_ENTRIES, PREWARM_JOB_CACHE_TTL)
+_sprite_local = LocalCache(SPRITE_LOCAL_MAX_ENTRIES, SPRITE_LOCAL_TTL)
+_article_pdf_local = LocalCache(ARTICLE_PDF_LOCAL_MAX_ENTRIES, ARTICLE_PDF_LOCAL_TTL)
+
+
+def acquire_lock(key, timeout, blocking_timeout):
+    """Take a Redis lock shared by all workers.
+
+    Returns the lock, or None when Redis is unavailable or the lock could not be taken
+    within blocking_timeout. Callers are expected to proceed in either case."""
+    r = _get_redis()
+    if r is None:
+        return None
+    try:
+        lock = r.lock(LOCK_PREFIX + key, timeout=timeout, blocking_timeout=blocking_timeout)
+        return lock if lock.acquire() else None
+    except redis.ConnectionError:
+        _reset_redis()
+    except Exception:
+        logger.debug("Failed to acquire lock %s%s", LOCK_PREFIX, key, exc_info=True)
+    return None
+
+
+def release_lock(lock):
+    """Release a lock returned by acquire_lock. Safe to call with None or an expired lock."""
+    if lock is None:
+        return
+    try:
+        lock.release()
+    except Exception:
+        logger.debug("Failed to release lock", exc_info=True)
+
+
 def cache_get_manifest(key):
     """Fetch a cached manifest JSON string."""
     return _redis_get(MANIFEST_CACHE_PREFIX, key)
@@ -91,8 +242,27 @@ def cache_set_manifest(key, json_str):
 
 
 def cache_delete_manifest(key):
-    """Invalidate a cached manifest. Called when a collection is updated via PUT."""
+    """Invalidate a cached manifest and its validators. Called when a collection is updated via PUT."""
     _redis_delete(MANIFEST_CACHE_PREFIX, key)
+    _redis_delete(MANIFEST_VALIDATOR_PREFIX, key)
+
+
+def cache_get_manifest_validators(key):
+    """Fetch the cached (etag, last_modified) pair for a manifest, or None."""
+    cached = _redis_get(MANIFEST_VALIDATOR_PREFIX, key)
+    if cached is None:
+        return None
+    try:
+        data = json_lib.loads(cached)
+        return data['etag'], datetime.fromisoformat(data['last_modified'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def cache_set_manifest_validators(key, etag, last_modified):
+    """Cache the validators of a manifest alongside it, with the same TTL."""
+    value = json_lib.dumps({'etag': etag, 'last_modified': last_modified.isoformat()})
+    _redis_set(MANIFEST_VALIDATOR_PREFIX, key, value, MANIFEST_CACHE_TTL)
 
 
 def cache_get_search(key):
@@ -112,3 +282,247 @@ def to_json_and_cache(result, cache_fn, cache_key):
     result_json = json_lib.dumps(result_dict) if isinstance(result_dict, dict) else result_dict
     cache_fn(cache_key, result_json)
     return result_dict
+
+
+def _thumbnail_key(type, id):
+    return f'{type}:{id}'
+
+
+def cache_get_thumbnail(type, id):
+    """Look up the IIIF thumbnail path of an item, first in process and then in Redis."""
+    key = _thumbnail_key(type, id)
+    path = _thumbnail_local.get(key)
+    if path is not None:
+        return path
+    path = _redis_get(THUMBNAIL_CACHE_PREFIX, key)
+    if path is not None:
+        _thumbnail_local.set(key, path)
+    return path
+
+
+def cache_get_thumbnails(items):
+    """Look up the thumbnail paths of many (type, id) items at once, returning {(type, id): path} for the hits."""
+    paths = {}
+    missing = {}
+    for type, id in items:
+        key = _thumbnail_key(type, id)
+        path = _thumbnail_local.get(key)
+        if path is not None:
+            paths[(type, id)] = path
+        else:
+            missing[key] = (type, id)
+    for key, path in _redis_get_many(THUMBNAIL_CACHE_PREFIX, list(missing)).items():
+        _thumbnail_local.set(key, path)
+        paths[missing[key]] = path
+    return paths
+
+
+def cache_set_thumbnails(paths):
+    """Store thumbnail paths given as {(type, id): path}, e.g. for a whole collection at ingest."""
+    mapping = {_thumbnail_key(type, id): path for (type, id), path in paths.items()}
+    for key, path in mapping.items():
+        _thumbnail_local.set(key, path)
+    _redis_set_many(THUMBNAIL_CACHE_PREFIX, mapping, THUMBNAIL_CACHE_TTL)
+
+
+def cache_delete_thumbnails(items):
+    """Invalidate thumbnail paths given as an iterable of (type, id)."""
+    for type, id in items:
+        key = _thumbnail_key(type, id)
+        _thumbnail_local.delete(key)
+        _redis_delete(THUMBNAIL_CACHE_PREFIX, key)
+
+
+def cache_get_image_info(identifier):
+    """Fetch the info.json built for an image, first in process and then in Redis.
+    An empty string means the image has no known dimensions and info.json must come from the image server."""
+    info = _image_info_local.get(identifier)
+    if info is not None:
+        return info
+    info = _redis_get(IMAGE_INFO_CACHE_PREFIX, identifier)
+    if info is not None:
+        _image_info_local.set(identifier, info)
+    return info
+
+
+def cache_set_image_info(identifier, json_str):
+    """Cache the info.json of an image, or an empty string when it cannot be built locally."""
+    _image_info_local.set(identifier, json_str)
+    _redis_set(IMAGE_INFO_CACHE_PREFIX, identifier, json_str, IMAGE_INFO_CACHE_TTL)
+
+
+def cache_delete_image_info(identifiers):
+    """Invalidate the info.json of the given images, e.g. when their collection is re-ingested."""
+    identifiers = list(identifiers)
+    for identifier in identifiers:
+        _image_info_local.delete(identifier)
+    _redis_delete_many(IMAGE_INFO_CACHE_PREFIX, identifiers)
+
+
+def cache_get_pdf_job(job_id):
+    """Fetch the status of a PDF job as a dict, from Redis so that any worker can answer polls.
+    Falls back to the jobs known to this process when Redis is unavailable."""
+    cached = _redis_get(PDF_JOB_CACHE_PREFIX, job_id)
+    if cached is None:
+        cached = _pdf_job_local.get(job_id)
+    if cached is None:
+        return None
+    try:
+        return json_lib.loads(cached)
+    except ValueError:
+        return None
+
+
+def cache_set_pdf_job(job_id, status):
+    """Store the status of a PDF job, given as a dict, among the jobs of its collection."""
+    json_str = json_lib.dumps(status)
+    collection_id = str(status['collection_id']) if status.get('collection_id') else None
+    _pdf_job_local.set(job_id, json_str)
+    if collection_id is not None:
+        _pdf_jobs_local.set(collection_id, (_pdf_jobs_local.get(collection_id) or frozenset()) | {job_id})
+    r = _get_redis()
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.setex(PDF_JOB_CACHE_PREFIX + job_id, PDF_JOB_CACHE_TTL, json_str)
+        if collection_id is not None:
+            jobs_key = PDF_JOBS_CACHE_PREFIX + collection_id
+            pipe.sadd(jobs_key, job_id)
+            pipe.expire(jobs_key, PDF_JOB_CACHE_TTL)
+        pipe.execute()
+    except redis.ConnectionError:
+        _reset_redis()
+    except Exception:
+        logger.debug("Failed to write the status of PDF job %s", job_id, exc_info=True)
+
+
+def cache_delete_pdf_jobs(collection_id):
+    """Forget the PDF jobs of a collection, e.g. once their PDFs were removed."""
+    collection_id = str(collection_id)
+    job_ids = set(_pdf_jobs_local.get(collection_id) or ())
+    _pdf_jobs_local.delete(collection_id)
+    r = _get_redis()
+    if r is not None:
+        jobs_key = PDF_JOBS_CACHE_PREFIX + collection_id
+        try:
+            job_ids.update(r.smembers(jobs_key))
+            r.delete(jobs_key, *[PDF_JOB_CACHE_PREFIX + job_id for job_id in job_ids])
+        except redis.ConnectionError:
+            _reset_redis()
+        except Exception:
+            logger.debug("Failed to delete the PDF jobs of %s", collection_id, exc_info=True)
+    for job_id in job_ids:
+        _pdf_job_local.delete(job_id)
+
+
+def cache_get_prewarm_job(key):
+    """Fetch the status of a prewarm job as a dict, from Redis so that any worker can report it.
+    Falls back to the jobs known to this process when Redis is unavailable."""
+    key = str(key)
+    cached = _redis_get(PREWARM_JOB_CACHE_PREFIX, key)
+    if cached is None:
+        cached = _prewarm_job_local.get(key)
+    if cached is None:
+        return None
+    try:
+        return json_lib.loads(cached)
+    except ValueError:
+        return None
+
+
+def cache_set_prewarm_job(key, status, history):
+    """Store the status of a prewarm job, given as a dict, and keep its key among the
+    `history` most recently queued jobs listed by cache_get_prewarm_jobs."""
+    key = str(key)
+    json_str = json_lib.dumps(status)
+    _prewarm_job_local.set(key, json_str)
+    r = _get_redis()
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.setex(PREWARM_JOB_CACHE_PREFIX + key, PREWARM_JOB_CACHE_TTL, json_str)
+        pipe.zadd(PREWARM_JOBS_KEY, {key: datetime.fromisoformat(status['queued_at']).timestamp()})
+        pipe.zremrangebyrank(PREWARM_JOBS_KEY, 0, -history - 1)
+        pipe.expire(PREWARM_JOBS_KEY, PREWARM_JOB_CACHE_TTL)
+        pipe.execute()
+    except redis.ConnectionError:
+        _reset_redis()
+    except Exception:
+        logger.debug("Failed to write the status of prewarm job %s", key, exc_info=True)
+
+
+def cache_get_prewarm_jobs():
+    """Statuses of the most recently queued prewarm jobs of all workers, newest first.
+    Returns None when Redis is unavailable."""
+    r = _get_redis()
+    if r is None:
+        return None
+    try:
+        keys = r.zrevrange(PREWARM_JOBS_KEY, 0, -1)
+    except redis.ConnectionError:
+        _reset_redis()
+        return None
+    except Exception:
+        return None
+    cached = _redis_get_many(PREWARM_JOB_CACHE_PREFIX, keys)
+    jobs = []
+    for key in keys:
+        try:
+            jobs.append(json_lib.loads(cached[key]))
+        except (KeyError, ValueError):
+            continue
+    return jobs
+
+
+def cache_get_sprite(key):
+    """Fetch a composed sprite JPEG, first in process and then in Redis, or None."""
+    body = _sprite_local.get(key)
+    if body is not None:
+        return body
+    cached = _redis_get(SPRITE_CACHE_PREFIX, key)
+    if cached is None:
+        return None
+    try:
+        body = base64.b64decode(cached)
+    except ValueError:
+        return None
+    _sprite_local.set(key, body)
+    return body
+
+
+def cache_set_sprite(key, body):
+    """Store a composed sprite JPEG. Redis values are decoded as text, so it is stored base64 encoded."""
+    _sprite_local.set(key, body)
+    _redis_set(SPRITE_CACHE_PREFIX, key, base64.b64encode(body).decode('ascii'), SPRITE_CACHE_TTL)
+
+
+def cache_get_article_pdf(bibcode):
+    """Whether a pre-rendered PDF of an article is known to exist, first in process and then in Redis.
+    Returns None when it is not known either way."""
+    key = bibcode.lower()
+    value = _article_pdf_local.get(key)
+    if value is None:
+        value = _redis_get(ARTICLE_PDF_CACHE_PREFIX, key)
+        if value is not None:
+            _article_pdf_local.set(key, value)
+    return None if value is None else value == '1'
+
+
+def cache_set_article_pdfs(exists, ttl):
+    """Record for ttl seconds whether the pre-rendered PDFs of articles exist, given as {bibcode: bool}."""
+    if ttl <= 0:
+        return
+    mapping = {bibcode.lower(): '1' if found else '0' for bibcode, found in exists.items()}
+    for key, value in mapping.items():
+        _article_pdf_local.set(key, value)
+    _redis_set_many(ARTICLE_PDF_CACHE_PREFIX, mapping, ttl)
+
+
+def cache_delete_article_pdfs(bibcodes):
+    """Forget whether the pre-rendered PDFs of the given articles exist, e.g. when they are re-ingested."""
+    keys = [bibcode.lower() for bibcode in bibcodes]
+    for key in keys:
+        _article_pdf_local.delete(key)
+    _redis_delete_many(ARTICLE_PDF_CACHE_PREFIX, keys)
@@ -1,5 +1,8 @@
+from typing import Union
+from flask import current_app
 from sqlalchemy import or_
-from scan_explorer_service.models import Article, Collection, Page
+from sqlalchemy.orm import joinedload, selectinload
+from scan_explorer_service.models import Article, Collection, Page, page_article_association_table
 
 
 def collection_exists(session, journal, volume):
@@ -76,30 +79,160 @@ def page_overwrite(session, page):
     persisted = page_get(session, page.collection_id, page.name, page.volume_running_page_num)
     overwrite(session, page, persisted)
 
-def article_thumbnail(session, id):
+def article_first_page(session, id):
     page = session.query(Page).join(Article, Page.articles).filter(
                 Article.id == id).order_by(Page.volume_running_page_num.asc()).first()
     if page is None:
         raise Exception(f"No pages found for article {id}")
-    return page.thumbnail_url
+    return page
 
-def collection_thumbnail(session, id):
+def collection_first_page(session, id):
     page = session.query(Page).filter(Page.collection_id == id).order_by(
         Page.volume_running_page_num.asc()).first()
     if page is None:
         raise Exception(f"No pages found for collection {id}")
-    return page.thumbnail_url
+    return page
+
+def article_thumbnail(session, id):
+    return article_first_page(session, id).thumbnail_url
+
+def collection_thumbnail(session, id):
+    return collection_first_page(session, id).thumbnail_url
 
 def page_thumbnail(session, id):
     page = session.query(Page).filter(Page.id == id).one()
     return page.thumbnail_url
 
-def item_thumbnail(session, id, type):
+def item_thumbnail_page(session, id, type):
     if type == 'page':
-        return page_thumbnail(session, id)
+        return session.query(Page).filter(Page.id == id).one()
     elif type == 'article':
-        return article_thumbnail(session, id)
+        return article_first_page(session, id)
     elif type == 'collection':
-        return collection_thumbnail(session, id)
+        return collection_first_page(session, id)
     else:
         raise Exception("Invalid type")
+
+def item_thumbnail(session, id, type):
+    return item_thumbnail_page(session, id, type).thumbnail_url
+
+def item_thumbnail_path(session, id, type):
+    return item_thumbnail_page(session, id, type).thumbnail_path
+
+def item_thumbnail_pages(session, items):
+    """
+    First pages of many (type, id) items as {(type, id): page}, items without pages are left out.
+
+    Uses one query per type, picking the first page of every article and collection with
+    DISTINCT ON instead of a query per item.
+    """
+    ids = {'page': set(), 'article': set(), 'collection': set()}
+    for type, id in items:
+        ids[type].add(id)
+
+    pages = {}
+    if ids['page']:
+        for page in session.query(Page).filter(Page.id.in_(list(ids['page']))).options(joinedload(Page.collection)):
+            pages[('page', page.id)] = page
+    if ids['article']:
+        article_id = page_article_association_table.c.article_id
+        rows = session.query(article_id, Page).select_from(Page)\
+            .join(page_article_association_table, page_article_association_table.c.page_id == Page.id)\
+            .filter(article_id.in_(list(ids['article']))).options(joinedload(Page.collection))\
+            .distinct(article_id).order_by(article_id, Page.volume_running_page_num.asc())
+        for id, page in rows:
+            pages[('article', id)] = page
+    if ids['collection']:
+        rows = session.query(Page).filter(Page.collection_id.in_(list(ids['collection']))).options(joinedload(Page.collection))\
+            .distinct(Page.collection_id).order_by(Page.collection_id, Page.volume_running_page_num.asc())
+        for page in rows:
+            pages[('collection', page.collection_id)] = page
+    return pages
+
+
+def item_thumbnail_paths(session, items):
+    """Thumbnail paths of many (type, id) items as {(type, id): path}, see item_thumbnail_pages."""
+    return {item: page.thumbnail_path for item, page in item_thumbnail_pages(session, items).items()}
+
+
+def collection_thumbnail_paths(session, collection_id):
+    """Thumbnail paths of a collection, its articles and its pages as {(type, id): path}."""
+    pages = session.query(Page).filter(Page.collection_id == collection_id)\
+        .options(selectinload(Page.articles), joinedload(Page.collection))\
+        .order_by(Page.volume_running_page_num.asc()).all()
+
+    paths = {}
+    for page in pages:
+        path = page.thumbnail_path
+        paths[('page', page.id)] = path
+        paths.setdefault(('collection', collection_id), path)
+        for article in page.articles:
+            paths.setdefault(('article', article.id), path)
+    return paths
+
+
+def page_by_image_path(session, image_path):
+    """Look up the page with the given IIIF identifier, or None.
+
+    The identifier is bitmaps/<type>/<journal>/<volume>/600/<name>, see Page.image_path, so the
+    page is looked up by name within the collection <journal><volume>. Dots of the journal and
+    volume are replaced by underscores in the identifier, an underscore there matches either."""
+    parts = image_path.split(current_app.config.get('IMAGE_API_SLASH_SUB', '%2F'))
+    if len(parts) < 6:
+        return None
+    journal, volume, name = parts[-4], parts[-3], parts[-1]
+    if name.endswith('.tif'):
+        name = name[:-len('.tif')]
+    collection_id = journal + volume
+    if '_' in collection_id:
+        # _ is the single character wildcard of LIKE
+        pattern = collection_id.replace('\\', '\\\\').replace('%', '\\%')
+        in_collection = Page.collection_id.like(pattern, escape='\\')
+    else:
+        in_collection = Page.collection_id == collection_id
+    candidates = session.query(Page).filter(Page.name == name, in_collection).options(joinedload(Page.collection)).all()
+    return next((candidate for candidate in candidates if candidate.image_path == image_path), None)
+
+
+def collection_page_image_paths(session, collection_id):
+    """IIIF identifiers of every page of a collection, in volume order."""
+    pages = session.query(Page).filter(Page.collection_id == collection_id)\
+        .options(joinedload(Page.collection)).order_by(Page.volume_running_page_num.asc()).all()
+    return [page.image_path for page in pages]
+
+
+def collection_image_paths(session, image_path):
+    """IIIF identifiers of every page in the volume of the page with the given identifier, in volume order."""
+    page = page_by_image_path(session, image_path)
+    if page is None:
+        return []
+    return collection_page_image_paths(session, page.collection_id)
+
+
+def get_item(session, id):
+    """Look up an Article or Collection by ID, raising if neither exists."""
+    item: Union[Article, Collection] = (
+                session.query(Article).filter(Article.id == id).one_or_none()
+                or session.query(Collection).filter(Collection.id == id).one_or_none())
+    if not item:
+        raise Exception("ID: " + str(id) + " not found")
+
+    return item
+
+
+def get_pages(item, session, page_start, page_end, page_limit):
+    """Query pages for an Article or Collection within the given page range.
+    For articles, page numbers are relative to the article's first page in the volume."""
+    if isinstance(item, Article):
+        first_page = item.pages.first()
+        if first_page is None:
+            raise Exception(f"No pages found for article {item.id}")
+        start_page = first_page.volume_running_page_num
+        query = session.query(Page).filter(Page.articles.any(Article.id == item.id),
+            Page.volume_running_page_num  >= page_start + start_page - 1,
+            Page.volume_running_page_num  <= page_end + start_page - 1).order_by(Page.volume_running_page_num).limit(page_limit)
+    elif isinstance(item, Collection):
+        query = session.query(Page).filter(Page.collection_id == item.id,
+            Page.volume_running_page_num >= page_start,
+            Page.volume_running_page_num <= page_end).order_by(Page.volume_running_page_num).limit(page_limit)
+    return query
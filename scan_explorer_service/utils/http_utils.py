@@ -0,0 +1,62 @@
+import hashlib
+from datetime import datetime, timezone
+from flask import current_app, request
+
+
+def make_etag(*parts):
+    """Build a strong entity tag value from the given parts."""
+    raw = '\x1f'.join(str(p) for p in parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+# RFC 7230 section 6.1, connection-specific headers that a proxy must not forward
+HOP_BY_HOP_HEADERS = frozenset(('connection', 'keep-alive', 'te', 'trailer', 'transfer-encoding', 'upgrade'))
+
+
+def forwardable_headers(headers, exclude=('host', 'accept')):
+    """The (name, value) pairs of request headers to send on to an upstream server, as a dict.
+
+    Hop-by-hop headers, Proxy-* headers and any header named in Connection are dropped, so
+    that e.g. a Connection: close from a front proxy does not close pooled upstream connections."""
+    headers = list(headers)
+    dropped = set(HOP_BY_HOP_HEADERS).union(exclude)
+    for name, value in headers:
+        if name.lower() == 'connection':
+            dropped.update(token.strip().lower() for token in value.split(','))
+    return {name: value for name, value in headers
+            if name.lower() not in dropped and not name.lower().startswith('proxy-')}
+
+
+def _to_naive_utc(value: datetime):
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=0)
+
+
+def is_not_modified(etag=None, last_modified=None):
+    """Check the current request's conditional headers against the given validators.
+
+    If-None-Match takes precedence over If-Modified-Since, as required by RFC 7232."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.if_none_match:
+        return etag is not None and request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return _to_naive_utc(last_modified) <= _to_naive_utc(request.if_modified_since)
+    return False
+
+
+def set_validators(response, etag=None, last_modified=None):
+    """Attach ETag and Last-Modified headers to a response and return it."""
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _to_naive_utc(last_modified).replace(tzinfo=timezone.utc)
+    return response
+
+
+def not_modified_response(etag=None, last_modified=None):
+    """Build an empty 304 response carrying the validators."""
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
@@ -0,0 +1,207 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from flask import current_app
+from scan_explorer_service.utils.process import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class DiskImageCache:
+    """
+    Local disk cache for IIIF derivatives streamed from the image server.
+
+    Entries are keyed by the canonical IIIF path. Each entry is a body file plus a small
+    JSON sidecar holding the upstream headers. Hits bump the file mtime so that the
+    eviction pass, which rescans the directory, sees a least-recently-used order shared
+    by every worker that writes to the same directory.
+    """
+
+    def __init__(self, directory, max_bytes, max_entry_bytes, low_water=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._bytes = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def canonical_key(path):
+        """Normalise an IIIF path so equivalent requests share one entry."""
+        return path.strip('/')
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(self.canonical_key(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        """Return (body_path, headers) for a cached entry, or None on a miss.
+
+        The body is served by path so the WSGI server can use its file wrapper (sendfile)."""
+        body_path = self._entry_path(key)
+        try:
+            with open(body_path + '.json') as f:
+                headers = json.load(f)
+            os.utime(body_path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return body_path, headers
+
+    def contains(self, key):
+        """Check whether an entry exists without counting a hit or miss."""
+        return os.path.exists(self._entry_path(key) + '.json')
+
+    def writer(self, key, headers):
+        """Return a writer that stages a new entry and publishes it on commit."""
+        return CacheWriter(self, key, headers)
+
+    def _publish(self, key, tmp_path, headers, size):
+        body_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        os.replace(tmp_path, body_path)
+        meta_tmp = os.path.join(os.path.dirname(body_path),
+                                f'.{os.path.basename(body_path)}.{os.getpid()}.{threading.get_ident()}')
+        with open(meta_tmp, 'w') as f:
+            json.dump(headers, f)
+        os.replace(meta_tmp, body_path + '.json')
+
+        with self._lock:
+            self.stores += 1
+            if self._bytes is not None:
+                self._bytes += size
+            over_budget = self._bytes is None or self._bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _scan(self):
+        """List (mtime, size, body_path) for every entry in the cache directory."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json') or name.startswith('.'):
+                    continue
+                body_path = os.path.join(root, name)
+                try:
+                    st = os.stat(body_path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, body_path))
+        return entries
+
+    def evict(self):
+        """Delete least-recently-used entries until the cache is below its low-water mark."""
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * self.low_water
+            for _, size, body_path in sorted(entries):
+                if total <= target:
+                    break
+                for p in (body_path + '.json', body_path):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+                total -= size
+                evicted += 1
+        with self._lock:
+            self._bytes = total
+            self.evictions += evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'max_bytes': self.max_bytes,
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+            }
+
+
+class CacheWriter:
+    """Stages a streamed body in a temporary file next to its final location."""
+
+    def __init__(self, cache: DiskImageCache, key, headers):
+        self.cache = cache
+        self.key = key
+        self.headers = headers
+        self.size = 0
+        self._closed = False
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.directory, prefix='.tmp-')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        if self._closed:
+            return
+        self.size += len(chunk)
+        if self.size > self.cache.max_entry_bytes:
+            self.abort()
+            return
+        self._file.write(chunk)
+
+    def commit(self):
+        """Publish the staged body. Oversized or aborted entries are silently dropped."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._file.close()
+            self.cache._publish(self.key, self.tmp_path, self.headers, self.size)
+        except OSError:
+            logger.warning("Failed to store image cache entry %s", self.key, exc_info=True)
+            self._remove_tmp()
+
+    def abort(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._file.close()
+        self._remove_tmp()
+
+    def _remove_tmp(self):
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+_image_cache = PerProcess(DiskImageCache)
+
+
+def get_image_cache():
+    """Return the worker's disk image cache, or None when IMAGE_CACHE_DIR is not configured."""
+    directory = current_app.config.get('IMAGE_CACHE_DIR')
+    if not directory:
+        return None
+    cache = _image_cache.current()
+    if cache is not None and cache.directory != directory:
+        _image_cache.reset()
+    try:
+        return _image_cache.get(
+            directory,
+            current_app.config.get('IMAGE_CACHE_MAX_BYTES', 5*1024*1024*1024),
+            current_app.config.get('IMAGE_CACHE_MAX_ENTRY_BYTES', 20*1024*1024))
+    except OSError:
+        logger.warning("Image cache directory %s unavailable, caching disabled", directory)
+        return None
+
+
+def reset_image_cache():
+    """Drop the cached instance so the next call to get_image_cache rebuilds it."""
+    _image_cache.reset()
@@ -0,0 +1,44 @@
+import math
+
+# Profile details advertised by Cantaloupe for IIIF Image API 2, so that viewers behave the
+# same whether info.json comes from the database or from the image server
+IMAGE_INFO_FORMATS = ['jpg', 'tif', 'png', 'gif']
+IMAGE_INFO_QUALITIES = ['bitonal', 'color', 'gray', 'default']
+IMAGE_INFO_SUPPORTS = ['baseUriRedirect', 'canonicalLinkHeader', 'cors', 'jsonldMediaType', 'mirroring',
+                       'profileLinkHeader', 'regionByPct', 'regionByPx', 'regionSquare', 'rotationArbitrary',
+                       'rotationBy90s', 'sizeAboveFull', 'sizeByConfinedWh', 'sizeByDistortedWh', 'sizeByForcedWh',
+                       'sizeByH', 'sizeByPct', 'sizeByW', 'sizeByWh']
+
+
+def image_info(image_id, width, height, context, profile, tile_size=512, min_size=64):
+    """
+    Build an IIIF Image API 2 info.json document for an image of known dimensions.
+
+    sizes lists every halving of the image down to min_size, smallest first, and tiles
+    uses a single square tile size with scale factors up to the one at which the whole
+    image fits in a tile.
+    """
+    sizes = []
+    factor = 1
+    while min(width, height) / factor >= min_size:
+        sizes.append({'width': math.ceil(width / factor), 'height': math.ceil(height / factor)})
+        factor *= 2
+
+    scale_factors = [1]
+    while max(width, height) / scale_factors[-1] > tile_size:
+        scale_factors.append(scale_factors[-1] * 2)
+
+    return {
+        '@context': context,
+        '@id': image_id,
+        'protocol': 'http://iiif.io/api/image',
+        'width': width,
+        'height': height,
+        'sizes': list(reversed(sizes)),
+        'tiles': [{'width': tile_size, 'height': tile_size, 'scaleFactors': scale_factors}],
+        'profile': [profile, {
+            'formats': IMAGE_INFO_FORMATS,
+            'qualities': IMAGE_INFO_QUALITIES,
+            'supports': IMAGE_INFO_SUPPORTS,
+        }],
+    }
@@ -0,0 +1,153 @@
+import re
+import time
+from urllib import parse as urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from flask import current_app, request
+from scan_explorer_service.utils.upstream import upstream_request, get_breaker, get_retry_budget, backoff_delay, \
+    UpstreamUnavailable
+from scan_explorer_service.utils.image_cache import get_image_cache
+from scan_explorer_service.utils.http_utils import make_etag
+
+
+def forwarded_headers():
+    """Headers telling the image server the public location of the proxy, used for the ids in info.json."""
+    return {
+        'X-Forwarded-Host': current_app.config.get('PROXY_SERVER'),
+        'X-Forwarded-Path': current_app.config.get('PROXY_PREFIX').rstrip('/') + '/image',
+    }
+
+
+def upstream_url(path):
+    """Image server URL of an IIIF path."""
+    req_url = urlparse.urljoin(f'{current_app.config.get("IMAGE_API_BASE_URL")}/', path)
+    return re.sub(r"[+&]", "%2B", req_url)
+
+
+def upstream_image(encoded_url, req_headers, method=None, params=None, data=None, timing=None):
+    """Request an image from the image server.
+
+    Retryable failures (IMAGE_PROXY_RETRY_STATUSES, timeouts and connection errors, e.g. on a
+    Cantaloupe cold cache) are retried with jittered exponential backoff while the worker's
+    retry budget allows it. A backoff longer than IMAGE_PROXY_RETRY_MAX_WAIT is not waited
+    for: UpstreamUnavailable is raised with the backoff as retry_after instead. The circuit
+    breaker rejects requests outright while the image server is failing. Raises
+    UpstreamUnavailable when no response can be returned.
+
+    The method, query parameters and form data default to those of the current request. When
+    timing is given, the time to the response headers and the number of retries are stored in it."""
+    config = current_app.config
+    method = request.method if method is None else method
+    params = request.args if params is None else params
+    data = request.form if data is None else data
+    retries = config.get('IMAGE_PROXY_RETRIES', 1)
+    retry_delay = config.get('IMAGE_PROXY_RETRY_DELAY', 0.5)
+    retry_max_delay = config.get('IMAGE_PROXY_RETRY_MAX_DELAY', 2)
+    retry_max_wait = config.get('IMAGE_PROXY_RETRY_MAX_WAIT', 0.01)
+    retry_statuses = config.get('IMAGE_PROXY_RETRY_STATUSES', [500, 502, 503, 504])
+    timeout = (config.get('IMAGE_PROXY_CONNECT_TIMEOUT', 5), config.get('IMAGE_PROXY_READ_TIMEOUT', 60))
+
+    breaker = get_breaker()
+    budget = get_retry_budget()
+    budget.deposit()
+
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise UpstreamUnavailable('Image server unavailable', 503, retry_after=breaker.retry_after())
+
+        r, error = None, None
+        sent = time.perf_counter()
+        try:
+            r = upstream_request(method, encoded_url, params=params, stream=True, timeout=timeout,
+                                 headers=req_headers, allow_redirects=False, data=data)
+            if timing is not None:
+                timing.ttfb = time.perf_counter() - sent
+                timing.retries = attempt
+        except requests.Timeout as e:
+            error = UpstreamUnavailable(f'Image server timed out: {e}', 504)
+        except requests.ConnectionError as e:
+            error = UpstreamUnavailable(f'Image server unreachable: {e}', 502)
+        finally:
+            # any other exception counts as a failure too, so that a half-open breaker is never left
+            # waiting for the outcome of its probe
+            breaker.record(r is not None and r.status_code < 500)
+
+        if r is not None and r.status_code not in retry_statuses:
+            return r
+
+        failure = f'status {r.status_code}' if r is not None else str(error)
+        delay = backoff_delay(attempt, retry_delay, retry_max_delay)
+        if attempt < retries and delay > retry_max_wait:
+            # sleeping would hold the worker, so the client is asked to come back instead
+            if r is not None:
+                r.close()
+            raise UpstreamUnavailable(f'Image server failed ({failure})', 503, retry_after=delay)
+
+        if attempt >= retries or not budget.withdraw():
+            if r is not None:
+                return r
+            raise error
+
+        current_app.logger.warning(
+            f"Upstream image request failed ({failure}), "
+            f"retrying in {delay:.3f}s (attempt {attempt + 1}/{retries})")
+        if r is not None:
+            r.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def upstream_headers(r, path_etag):
+    """Headers of an upstream response that are safe to forward, with a path tag added when missing."""
+    excluded_headers = ['content-encoding','content-length', 'transfer-encoding', 'connection']
+    headers = [(name, value) for (name, value) in r.headers.items() if name.lower() not in excluded_headers]
+    if r.status_code == 200 and not any(name.lower() == 'etag' for name, _ in headers):
+        headers.append(('ETag', f'"{path_etag}"'))
+    return headers
+
+
+def fetch_derivative(path):
+    """Return the bytes of an IIIF derivative from the disk cache or the image server, or None.
+    Derivatives fetched from the image server are stored in the disk cache when it is enabled."""
+    cache = get_image_cache()
+    cached = cache.get(path) if cache is not None else None
+    if cached is not None:
+        try:
+            with open(cached[0], 'rb') as f:
+                return f.read()
+        except OSError:
+            pass
+
+    try:
+        r = upstream_image(upstream_url(path), forwarded_headers(), method='GET', params={}, data={})
+    except UpstreamUnavailable as e:
+        current_app.logger.warning(f"Image request for {path} failed: {e}")
+        return None
+    try:
+        if r.status_code != 200:
+            current_app.logger.warning(f"Image request for {path} returned {r.status_code}")
+            return None
+        body = r.content
+    finally:
+        r.close()
+
+    if cache is not None:
+        writer = cache.writer(path, upstream_headers(r, make_etag('image', path.strip('/'))))
+        writer.write(body)
+        writer.commit()
+    return body
+
+
+def fetch_derivatives(paths, workers):
+    """Fetch several IIIF derivatives concurrently, returning their bytes (or None) in order."""
+    if not paths:
+        return []
+    app = current_app._get_current_object()
+
+    def _fetch(path):
+        with app.app_context():
+            return fetch_derivative(path)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(paths)))) as executor:
+        return list(executor.map(_fetch, paths))
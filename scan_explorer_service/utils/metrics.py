@@ -0,0 +1,22 @@
+import os
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTE_BUCKETS = (1024, 10*1024, 100*1024, 1024*1024, 10*1024*1024, 100*1024*1024)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render():
+    """Render the metrics in the Prometheus text format, of all workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def sample_value(name, **labels):
+    """Value of a sample of this process, or 0 when it was never recorded."""
+    value = REGISTRY.get_sample_value(name, {key: str(value) for key, value in labels.items()})
+    return value if value is not None else 0
@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import itertools
+from flask import current_app
+from prometheus_client import Counter
+from scan_explorer_service.models import PageColor
+from scan_explorer_service.utils.db_utils import get_pages
+from scan_explorer_service.utils.s3_utils import S3Provider
+from scan_explorer_service.utils.image_utils import fetch_derivative
+from scan_explorer_service.utils.spill import SpillBuffer, peak_resident_memory
+
+try:
+    from gevent.pool import Pool as GeventPool
+except ImportError:
+    GeventPool = None
+
+# Resolution of the page images in AWS_BUCKET_NAME_IMAGE, see Page.image_path_basic
+MASTER_DPI = 600
+
+# marks a page image that could not be fetched, as opposed to an empty one
+FETCH_FAILED = object()
+
+PDF_SPILLED_PAGES = Counter(
+    'scan_pdf_spilled_pages', 'Page images spilled to disk while generating a PDF')
+
+
+def fetch_images(session, item, page_start, page_end, page_limit, memory_limit, with_color_type=False):
+    """Yield page images from S3 in page order, fetching IMAGE_PDF_FETCH_AHEAD ahead.
+    Uses gevent pool for parallel fetching when available."""
+    
+    query = get_pages(item, session, page_start, page_end, page_limit)
+    pages = query.all()
+
+    page_objects = []
+    color_types = []
+    for page in pages[:page_limit]:
+        image_path, fmt = page.image_path_basic
+        object_name = '/'.join(image_path) + fmt
+        page_objects.append(object_name)
+        color_types.append(page.color_type)
+
+    config = current_app.config
+    app_logger = current_app.logger
+    s3 = S3Provider(config, 'AWS_BUCKET_NAME_IMAGE')
+    spill = SpillBuffer(memory_limit, config.get('IMAGE_PDF_SPILL_DIR'))
+
+    def _fetch(obj_name):
+        try:
+            im_data = s3.read_object_s3(obj_name)
+        except Exception as e:
+            app_logger.warning(f"Failed to fetch page image {obj_name}, leaving the page out: {e}")
+            return FETCH_FAILED
+        return spill.hold(im_data) if im_data else None
+
+    ahead = max(1, config.get('IMAGE_PDF_FETCH_AHEAD', 20))
+    pool = None
+    executor = None
+    pending = deque()
+    if GeventPool is not None:
+        pool = GeventPool(size=20)
+        results = pool.imap(_fetch, page_objects, maxsize=ahead)
+    else:
+        executor = ThreadPoolExecutor(max_workers=min(20, ahead), thread_name_prefix='pdf-fetch')
+        results = (future.result() for future in sliding_window(executor, _fetch, page_objects, ahead, pending))
+
+    consumed = 0
+    breached = False
+    try:
+        for held in results:
+            consumed += 1
+            if held is None:
+                continue
+            if held is FETCH_FAILED:
+                yield (color_types[consumed - 1], None) if with_color_type else None
+                continue
+            if not breached and spill.is_spilled(held):
+                breached = True
+                resident, rss = spill.breach
+                app_logger.warning(f"Memory limit reached: {resident} bytes of page images in memory, "
+                                   f"limit {memory_limit}, RSS {rss} bytes, spilling to disk")
+            if with_color_type:
+                yield color_types[consumed - 1], spill.release(held)
+            else:
+                yield spill.release(held)
+    finally:
+        if pool is not None:
+            pool.join(timeout=5)
+            pool.kill(block=False)
+        if executor is not None:
+            for future in pending:
+                if not future.cancel():
+                    future.add_done_callback(lambda f: f.result() not in (None, FETCH_FAILED) and spill.discard(f.result()))
+            executor.shutdown(wait=False)
+        if spill.spilled:
+            PDF_SPILLED_PAGES.inc(spill.spilled)
+            app_logger.warning(f"Spilled {spill.spilled} of {spill.held} page images ({spill.spilled_bytes} of "
+                               f"{spill.held_bytes} bytes) to disk, at most {spill.peak} bytes in memory, "
+                               f"peak RSS {peak_resident_memory()} bytes")
+
+
+def sliding_window(executor, fn, items, ahead, pending):
+    """Yield the futures of fn(item) in order, keeping up to ahead of them submitted in pending."""
+    remaining = iter(items)
+    for item in itertools.islice(remaining, ahead):
+        pending.append(executor.submit(fn, item))
+    while pending:
+        future = pending.popleft()
+        # keep the window full while the page is converted
+        for item in itertools.islice(remaining, 1):
+            pending.append(executor.submit(fn, item))
+        yield future
+
+
+def lite_image_path(page, dpi):
+    """IIIF path of a page image downscaled from the master to dpi."""
+    quality = 'color' if page.color_type == PageColor.Color else 'gray'
+    return f'{page.image_path}/full/pct:{dpi * 100 / MASTER_DPI:g}/0/{quality}.jpg'
+
+
+def lite_images(session, item, page_start, page_end, page_limit, dpi):
+    """Yield page images downscaled to dpi by the image server in page order."""
+    pages = get_pages(item, session, page_start, page_end, page_limit).all()
+    paths = [lite_image_path(page, dpi) for page in pages[:page_limit]]
+    if not paths:
+        return
+    app = current_app._get_current_object()
+
+    def _fetch(path):
+        with app.app_context():
+            return fetch_derivative(path)
+
+    ahead = max(1, current_app.config.get('IMAGE_PDF_FETCH_AHEAD', 20))
+    workers = current_app.config.get('IMAGE_PDF_LITE_WORKERS', 8)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, ahead, len(paths))), thread_name_prefix='pdf-lite')
+    pending = deque()
+    try:
+        for path, future in zip(paths, sliding_window(executor, _fetch, paths, ahead, pending)):
+            try:
+                im_data = future.result()
+            except Exception as e:
+                current_app.logger.warning(f"Failed to fetch page image {path}, leaving the page out: {e}")
+                yield None
+                continue
+            if im_data:
+                yield im_data
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+from flask import current_app
+from botocore.exceptions import ClientError
+from scan_explorer_service.utils.s3_utils import S3Provider
+from scan_explorer_service.utils.cache import cache_delete_pdf_jobs
+
+CHUNK_SIZE = 64*1024
+
+
+def pdf_cache_prefix(collection_id):
+    return f"{current_app.config.get('IMAGE_PDF_CACHE_PREFIX', 'generated/')}{collection_id}/"
+
+
+def pdf_cache_key(collection, item_id, page_start, page_end, dpi=None):
+    """Key of a generated PDF. It includes the collection's updated timestamp, so a rewritten
+    collection never serves documents built from its previous pages, and the resolution of
+    documents built from downscaled images."""
+    updated = collection.updated.strftime('%Y%m%dT%H%M%S%f') if collection.updated else 'none'
+    resolution = f'-{dpi}dpi' if dpi else ''
+    return f'{pdf_cache_prefix(collection.id)}{item_id}/{page_start}-{page_end}-{updated}{resolution}.pdf'
+
+
+class S3PdfStore:
+    """Generated PDFs kept in AWS_BUCKET_NAME_PDF, next to the pre-rendered article PDFs."""
+
+    def __init__(self, config):
+        self.s3 = S3Provider(config, 'AWS_BUCKET_NAME_PDF')
+
+    def open(self, key):
+        """Return (chunks, size, close) for a stored PDF, or None if it is not stored.
+        Other S3 errors are raised rather than taken for a missing PDF."""
+        try:
+            obj = self.s3.open_object_s3(key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return obj['Body'].iter_chunks(CHUNK_SIZE), obj.get('ContentLength'), obj['Body'].close
+
+    def exists(self, key):
+        try:
+            self.s3.head_object_s3(key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def put(self, key, fileobj):
+        self.s3.upload_fileobj_s3(fileobj, key)
+
+    def delete_prefix(self, prefix):
+        self.s3.delete_prefix_s3(prefix)
+
+
+class LocalPdfStore:
+    """Generated PDFs kept in a local directory, a stand-in for object storage in development."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split('/'))
+
+    def open(self, key):
+        try:
+            f = open(self._path(key), 'rb')
+        except OSError:
+            return None
+        return iter(lambda: f.read(CHUNK_SIZE), b''), os.fstat(f.fileno()).st_size, f.close
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def put(self, key, fileobj):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(fileobj, f, CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def delete_prefix(self, prefix):
+        shutil.rmtree(self._path(prefix.rstrip('/')), ignore_errors=True)
+
+
+def _local_pdf_store():
+    return LocalPdfStore(current_app.config.get('IMAGE_PDF_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'scan-explorer-pdfs'))
+
+
+def get_pdf_store():
+    """Store for generated PDFs as configured by IMAGE_PDF_CACHE, or None when disabled."""
+    kind = current_app.config.get('IMAGE_PDF_CACHE')
+    if kind == 's3':
+        return S3PdfStore(current_app.config)
+    if kind == 'local':
+        return _local_pdf_store()
+    return None
+
+
+def get_pdf_job_store():
+    """Store for the results of PDF jobs, or None when there is no store shared by every host.
+    Jobs need S3, or an explicit IMAGE_PDF_CACHE_DIR on a shared volume, because their status
+    can be polled and their PDF downloaded through any host."""
+    kind = current_app.config.get('IMAGE_PDF_CACHE')
+    if kind == 'local' and not current_app.config.get('IMAGE_PDF_CACHE_DIR'):
+        return None
+    return get_pdf_store()
+
+
+def invalidate_pdf_cache(collection_id):
+    """Remove the generated PDFs of a collection and its articles, e.g. when it is re-ingested.
+    Results of PDF jobs are stored under the same prefix and are removed too, with the jobs."""
+    cache_delete_pdf_jobs(collection_id)
+    store = get_pdf_store()
+    if store is None:
+        return
+    try:
+        store.delete_prefix(pdf_cache_prefix(collection_id))
+    except Exception as e:
+        current_app.logger.warning(f"Failed to invalidate generated PDFs of {collection_id}: {e}")
@@ -0,0 +1,169 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from scan_explorer_service.utils.process import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class PdfJob:
+    """A PDF generated in the background, with its progress in pages."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, id, item_id, collection_id, page_start, page_end, key, total):
+        self.id = id
+        self.item_id = item_id
+        self.collection_id = collection_id
+        self.page_start = page_start
+        self.page_end = page_end
+        self.key = key
+        self.total = total
+        self.pages_done = 0
+        self.pages_skipped = 0
+        self.state = self.QUEUED
+        self.error = None
+        self.result_key = None
+        self.queued_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self.heartbeat_at = self.queued_at
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'item_id': self.item_id,
+            'collection_id': self.collection_id,
+            'page_start': self.page_start,
+            'page_end': self.page_end,
+            'key': self.key,
+            'state': self.state,
+            'total': self.total,
+            'pages_done': self.pages_done,
+            'pages_skipped': self.pages_skipped,
+            'error': self.error,
+            'result_key': self.result_key,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'heartbeat_at': self.heartbeat_at,
+        }
+
+
+class PdfJobRunner:
+    """
+    Runs PDF jobs on `workers` background threads so that large exports do not occupy
+    request workers.
+
+    run(job, progress) generates the document of a job inside an app context and returns
+    the key it was stored under, calling progress() after each page. publish(job) is called
+    on every state change and page so that the status can be polled from any worker, and every
+    `heartbeat` seconds for queued and running jobs so that the jobs of a worker that died can be
+    told apart by is_stale. Jobs beyond `max_pending` queued or running ones are rejected.
+    """
+
+    def __init__(self, app, run, publish, workers, max_pending, heartbeat=30):
+        self.app = app
+        self.run = run
+        self.publish = publish
+        self.workers = workers
+        self.max_pending = max_pending
+        self.heartbeat = heartbeat
+        self.pending = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-job')
+        self._heart = threading.Thread(target=self._beat, name='pdf-job-heartbeat', daemon=True)
+        self._heart.start()
+
+    def submit(self, job):
+        """Queue a job. Returns False, without queueing it, when the queue is full."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+            self._jobs[job.id] = job
+        self._publish(job)
+        self._executor.submit(self._run, job)
+        return True
+
+    def _publish(self, job):
+        job.heartbeat_at = _now()
+        self.publish(job)
+
+    def _beat(self):
+        while not self._stopped.wait(self.heartbeat):
+            with self._lock:
+                jobs = list(self._jobs.values())
+            if not jobs:
+                continue
+            try:
+                with self.app.app_context():
+                    for job in jobs:
+                        self._publish(job)
+            except Exception:
+                logger.warning("Failed to publish the heartbeat of PDF jobs", exc_info=True)
+
+    def _run(self, job):
+        try:
+            with self.app.app_context():
+                job.state = PdfJob.RUNNING
+                job.started_at = _now()
+                self._publish(job)
+                try:
+                    job.result_key = self.run(job, lambda: self._publish(job))
+                    job.state = PdfJob.DONE
+                except Exception as e:
+                    logger.warning("PDF job %s failed", job.id, exc_info=True)
+                    job.state = PdfJob.FAILED
+                    job.error = str(e)
+                job.finished_at = _now()
+                self._publish(job)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self._jobs.pop(job.id, None)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        self._stopped.set()
+
+
+def is_stale(status, stale_after):
+    """Whether the status of a queued or running job was not published for stale_after seconds,
+    i.e. the worker that had the job stopped, e.g. on a restart or deploy, and the job will never finish."""
+    if status.get('state') not in (PdfJob.QUEUED, PdfJob.RUNNING):
+        return False
+    heartbeat = status.get('heartbeat_at') or status.get('queued_at')
+    return datetime.now(timezone.utc) - datetime.fromisoformat(heartbeat) > timedelta(seconds=stale_after)
+
+
+def _create_pdf_job_runner(run, publish):
+    config = current_app.config
+    return PdfJobRunner(current_app._get_current_object(), run, publish,
+                        config.get('IMAGE_PDF_JOB_WORKERS', 2),
+                        config.get('IMAGE_PDF_JOB_MAX_PENDING', 20),
+                        config.get('IMAGE_PDF_JOB_HEARTBEAT', 30))
+
+
+_runner = PerProcess(_create_pdf_job_runner, close=lambda runner, wait: runner.shutdown(wait=wait))
+
+
+def get_pdf_job_runner(run, publish):
+    """Return the worker's PDF job runner, creating it on first use and again after a fork."""
+    return _runner.get(run, publish)
+
+
+def reset_pdf_job_runner(wait=True):
+    """Stop the PDF job runner, waiting for queued jobs when wait is set."""
+    _runner.reset(wait)
@@ -0,0 +1,97 @@
+import img2pdf
+
+PDF_VERSION = '1.3'
+PAGES_ID = 1
+CATALOG_ID = 2
+
+
+class StreamingPdfWriter:
+    """
+    Writes a PDF with one page per image, emitting every page as soon as its image is added.
+
+    Images are parsed and embedded by img2pdf the same way img2pdf.convert does it, but the
+    objects of a page are serialised and dropped right away instead of being kept until the
+    whole document is written, so memory holds a single page whatever the document length.
+    The page tree, the catalog and the cross-reference table are written by close().
+    When dpi is given, it is used as the resolution of every image instead of the one the
+    image declares, e.g. for derivatives from the image server which do not carry one.
+    """
+
+    def __init__(self, dpi=None):
+        self.dpi = dpi
+        header = f'%PDF-{PDF_VERSION}\n'.encode('ascii') + b'%\xe2\xe3\xcf\xd3\n'
+        self.offset = len(header)
+        self.page_ids = []
+        self._chunks = [header]
+        self._offsets = {}
+        self._new = []
+        self._next_id = CATALOG_ID + 1
+        self._pages = img2pdf.MyPdfDict()
+        self._pages.identifier = PAGES_ID
+        # pdfdoc builds the page objects and registers them through addpage and addobj below
+        self._doc = img2pdf.pdfdoc(img2pdf.Engine.internal, PDF_VERSION, nodate=True)
+        self._doc.writer = self
+
+    def addpage(self, page):
+        page[b'/Parent'] = self._pages
+        self.addobj(page)
+        self.page_ids.append(page.identifier)
+
+    def addobj(self, obj):
+        obj.identifier = self._next_id
+        self._next_id += 1
+        self._new.append(obj)
+
+    def add_image(self, rawdata):
+        """Add a page for every frame of an image and return the bytes to write next."""
+        for (color, ndpi, imgformat, imgdata, smaskdata, imgwidthpx, imgheightpx, palette,
+             inverted, depth, rotation, iccp) in img2pdf.read_images(rawdata, None):
+            if self.dpi:
+                ndpi = (self.dpi, self.dpi)
+            pagewidth, pageheight, imgwidthpdf, imgheightpdf = img2pdf.default_layout_fun(imgwidthpx, imgheightpx, ndpi)
+            userunit = None
+            if pagewidth > 14400.0 or pageheight > 14400.0:
+                userunit = img2pdf.find_scale(pagewidth, pageheight)
+                pagewidth, pageheight = pagewidth / userunit, pageheight / userunit
+                imgwidthpdf, imgheightpdf = imgwidthpdf / userunit, imgheightpdf / userunit
+            self._doc.add_imagepage(color, imgwidthpx, imgheightpx, imgformat, imgdata, smaskdata,
+                                    imgwidthpdf, imgheightpdf, (pagewidth - imgwidthpdf) / 2.0,
+                                    (pageheight - imgheightpdf) / 2.0, pagewidth, pageheight,
+                                    userunit, palette, inverted, depth, rotation, iccp=iccp)
+        return self._flush()
+
+    def _flush(self):
+        for obj in self._new:
+            self._write(obj.identifier, obj.tostring())
+        self._new = []
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+    def _write(self, obj_id, data):
+        self._offsets[obj_id] = self.offset
+        self.offset += len(data)
+        self._chunks.append(data)
+
+    def close(self, missing_pages=0):
+        """Return the page tree, catalog, cross-reference table and trailer that end the document.
+        With missing_pages, the document information says how many pages were left out."""
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        self._write(PAGES_ID, f'{PAGES_ID} 0 obj\n<< /Type /Pages /Kids [ {kids} ] /Count {len(self.page_ids)} >>\nendobj\n'.encode())
+        # JPEG 2000 or transparency raise the version of the document above the one in the header
+        version = f' /Version /{self._doc.output_version}' if self._doc.output_version > PDF_VERSION else ''
+        self._write(CATALOG_ID, f'{CATALOG_ID} 0 obj\n<< /Type /Catalog /Pages {PAGES_ID} 0 R{version} >>\nendobj\n'.encode())
+        info = ''
+        if missing_pages:
+            info_id = self._next_id
+            self._next_id += 1
+            self._write(info_id, f'{info_id} 0 obj\n<< /Subject (Incomplete, {missing_pages} missing pages) >>\nendobj\n'.encode())
+            info = f' /Info {info_id} 0 R'
+
+        xref_offset = self.offset
+        size = self._next_id
+        xref = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        xref += [f'{self._offsets[obj_id]:010d} 00000 n \n' for obj_id in range(1, size)]
+        xref.append(f'trailer\n<< /Size {size} /Root {CATALOG_ID} 0 R{info} >>\nstartxref\n{xref_offset}\n%%EOF\n')
+        self._chunks.append(''.join(xref).encode('ascii'))
+        return self._flush()
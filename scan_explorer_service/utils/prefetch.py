@@ -0,0 +1,156 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from scan_explorer_service.utils.process import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Fetches the derivatives of the pages following a requested page in the background.
+
+    resolve(path) returns the paths to prefetch for a requested path and fetch(path) stores
+    one of them in the proxy cache, both are called on one of `workers` threads inside an
+    app context. At most `rate` prefetch requests per second are sent and requests beyond
+    `max_pending` queued resolutions are dropped, so prefetching never competes with
+    readers for the image server. The last `tracked` prefetched paths are remembered so
+    that cache hits on them can be counted.
+    """
+
+    def __init__(self, app, resolve, fetch, workers, rate, max_pending, tracked, clock=time.monotonic):
+        self.app = app
+        self.resolve = resolve
+        self.fetch = fetch
+        self.rate = rate
+        self.max_pending = max_pending
+        self.tracked = tracked
+        self.clock = clock
+        self.pending = 0
+        self.scheduled = 0
+        self.dropped = 0
+        self.prefetched = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.hits = 0
+        self._tokens = float(rate)
+        self._updated = clock()
+        self._in_flight = set()
+        self._prefetched = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+
+    def schedule(self, path):
+        """Queue the prefetch of the neighbours of a requested path. Returns False if dropped."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.pending += 1
+            self.scheduled += 1
+        self._executor.submit(self._run, path)
+        return True
+
+    def _take_token(self):
+        now = self.clock()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _admit(self, path):
+        with self._lock:
+            if path in self._in_flight or path in self._prefetched:
+                return False
+            if not self._take_token():
+                self.rate_limited += 1
+                return False
+            self._in_flight.add(path)
+            return True
+
+    def _run(self, path):
+        try:
+            with self.app.app_context():
+                for neighbour in self.resolve(path):
+                    if not self._admit(neighbour):
+                        continue
+                    try:
+                        ok = self.fetch(neighbour) is not None
+                    except Exception:
+                        logger.debug("Failed to prefetch %s", neighbour, exc_info=True)
+                        ok = False
+                    with self._lock:
+                        self._in_flight.discard(neighbour)
+                        if ok:
+                            self.prefetched += 1
+                            self._prefetched[neighbour] = True
+                            while len(self._prefetched) > self.tracked:
+                                self._prefetched.popitem(last=False)
+                        else:
+                            self.failed += 1
+        except Exception:
+            logger.warning("Failed to resolve prefetch for %s", path, exc_info=True)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def record_hit(self, path):
+        """Count a cache hit on a derivative if it was put in the cache by the prefetcher."""
+        with self._lock:
+            if self._prefetched.pop(path, None) is not None:
+                self.hits += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'scheduled': self.scheduled,
+                'dropped': self.dropped,
+                'prefetched': self.prefetched,
+                'failed': self.failed,
+                'rate_limited': self.rate_limited,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.prefetched if self.prefetched else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def _create_prefetcher(resolve, fetch):
+    config = current_app.config
+    return Prefetcher(current_app._get_current_object(), resolve, fetch,
+                      config.get('IMAGE_PREFETCH_WORKERS', 2),
+                      config.get('IMAGE_PREFETCH_RATE', 10),
+                      config.get('IMAGE_PREFETCH_MAX_PENDING', 100),
+                      config.get('IMAGE_PREFETCH_TRACKED', 10000))
+
+
+_prefetcher = PerProcess(_create_prefetcher, close=lambda prefetcher, wait: prefetcher.shutdown(wait=wait))
+
+
+def get_prefetcher(resolve, fetch):
+    """Return the worker's prefetcher, creating it on first use and again after a fork."""
+    return _prefetcher.get(resolve, fetch)
+
+
+def prefetch_stats():
+    """Prefetch counters of the current worker, or None if nothing was prefetched yet."""
+    prefetcher = _prefetcher.current()
+    return prefetcher.stats() if prefetcher is not None else None
+
+
+def record_prefetch_hit(path):
+    prefetcher = _prefetcher.current()
+    if prefetcher is not None:
+        prefetcher.record_hit(path)
+
+
+def reset_prefetcher(wait=True):
+    """Stop the prefetcher, waiting for queued prefetches when wait is set."""
+    _prefetcher.reset(wait)
@@ -0,0 +1,211 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from flask import current_app
+from scan_explorer_service.models import Page
+from scan_explorer_service.utils.process import PerProcess
+from scan_explorer_service.utils.image_utils import fetch_derivative
+from scan_explorer_service.utils.cache import cache_set_prewarm_job
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class PrewarmJob:
+    """Progress of the warm-up of one collection."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    REJECTED = 'rejected'
+
+    def __init__(self, key, total):
+        self.key = key
+        self.total = total
+        self.warmed = 0
+        self.failed = 0
+        self.state = self.QUEUED
+        self.queued_at = _now()
+        self.started_at = None
+        self.finished_at = None
+
+    def as_dict(self):
+        return {
+            'id': self.key,
+            'state': self.state,
+            'total': self.total,
+            'warmed': self.warmed,
+            'failed': self.failed,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class Prewarmer:
+    """
+    Requests derivatives in the background so that the image server and the proxy caches
+    are warm before readers arrive.
+
+    All jobs share `workers` threads, which bounds the load put on the image server. Jobs
+    that would take the number of queued requests over `max_pending` are rejected rather
+    than queued. publish(status) is called inside an app context whenever the status of a
+    job changes, so that it can be stored where every worker can read it. The last `history`
+    jobs are also kept in the worker.
+    """
+
+    def __init__(self, app, fetch, publish, workers, max_pending, history):
+        self.app = app
+        self.fetch = fetch
+        self.publish = publish
+        self.workers = workers
+        self.max_pending = max_pending
+        self.history = history
+        self.pending = 0
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prewarm')
+
+    def submit(self, key, paths):
+        """Queue the given IIIF paths for warming and return the job tracking them."""
+        job = PrewarmJob(key, len(paths))
+        with self._lock:
+            if self.pending + len(paths) > self.max_pending:
+                job.state = PrewarmJob.REJECTED
+                job.finished_at = job.queued_at
+            elif not paths:
+                job.state = PrewarmJob.DONE
+                job.finished_at = job.queued_at
+            else:
+                self.pending += len(paths)
+            self._record(job)
+        self._publish(job)
+
+        if job.state == PrewarmJob.REJECTED:
+            logger.warning("Prewarm queue full, skipping %d requests for %s", len(paths), key)
+        elif paths:
+            for path in paths:
+                self._executor.submit(self._warm, job, path)
+        return job
+
+    def _record(self, job):
+        self._jobs.pop(job.key, None)
+        self._jobs[job.key] = job
+        while len(self._jobs) > self.history:
+            self._jobs.popitem(last=False)
+
+    def _publish(self, job):
+        # the status is read under the publish lock so that a late publication never
+        # overwrites a newer one
+        with self._publish_lock:
+            with self._lock:
+                status = job.as_dict()
+            try:
+                self.publish(status)
+            except Exception:
+                logger.warning("Failed to publish the status of prewarm job %s", job.key, exc_info=True)
+
+    def _warm(self, job, path):
+        with self.app.app_context():
+            with self._lock:
+                started = job.state == PrewarmJob.QUEUED
+                if started:
+                    job.state = PrewarmJob.RUNNING
+                    job.started_at = _now()
+            if started:
+                self._publish(job)
+            try:
+                ok = self.fetch(path) is not None
+            except Exception:
+                logger.warning("Failed to prewarm %s", path, exc_info=True)
+                ok = False
+            with self._lock:
+                self.pending -= 1
+                if ok:
+                    job.warmed += 1
+                else:
+                    job.failed += 1
+                if job.warmed + job.failed == job.total:
+                    job.state = PrewarmJob.DONE
+                    job.finished_at = _now()
+            self._publish(job)
+
+    def status(self, key=None):
+        """Return the status of one job, or None if unknown, or an overview of all recent jobs."""
+        with self._lock:
+            if key is not None:
+                job = self._jobs.get(key)
+                return job.as_dict() if job is not None else None
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'jobs': [job.as_dict() for job in reversed(self._jobs.values())],
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def _create_prewarmer(fetch, publish):
+    config = current_app.config
+    return Prewarmer(current_app._get_current_object(), fetch, publish,
+                     config.get('IMAGE_PREWARM_WORKERS', 4),
+                     config.get('IMAGE_PREWARM_MAX_PENDING', 5000),
+                     config.get('IMAGE_PREWARM_HISTORY', 100))
+
+
+_prewarmer = PerProcess(_create_prewarmer, close=lambda prewarmer, wait: prewarmer.shutdown(wait=wait))
+
+
+def get_prewarmer(fetch, publish):
+    """Return the worker's prewarmer, creating it on first use and again after a fork."""
+    return _prewarmer.get(fetch, publish)
+
+
+def prewarm_status(key=None):
+    """Status of the current worker's prewarmer, see Prewarmer.status."""
+    prewarmer = _prewarmer.current()
+    if prewarmer is None:
+        return None if key is not None else {'workers': 0, 'pending': 0, 'jobs': []}
+    return prewarmer.status(key)
+
+
+def reset_prewarmer(wait=True):
+    """Stop the prewarmer, waiting for queued requests when wait is set."""
+    _prewarmer.reset(wait)
+
+
+def prewarm_paths(session, collection_id, thumbnails):
+    """IIIF paths warmed after a collection is ingested: the article and collection thumbnails,
+    then IMAGE_PREWARM_SIZES of the first IMAGE_PREWARM_FIRST_PAGES pages."""
+    config = current_app.config
+    paths = [path for (type, _), path in thumbnails.items() if type != 'page']
+
+    pages = session.query(Page).filter(Page.collection_id == collection_id).order_by(
+        Page.volume_running_page_num.asc()).limit(config.get('IMAGE_PREWARM_FIRST_PAGES', 10)).all()
+    for page in pages:
+        for size in config.get('IMAGE_PREWARM_SIZES', ['info.json', 'square/480,480']):
+            if size == 'info.json':
+                paths.append(f'{page.image_path}/info.json')
+            else:
+                paths.append(f'{page.image_path}/{size}/0/{page.image_color_quality}.jpg')
+
+    return list(dict.fromkeys(paths))[:config.get('IMAGE_PREWARM_MAX_REQUESTS', 500)]
+
+
+def prewarm_collection(session, collection_id, thumbnails):
+    """Queue the warm-up of a freshly ingested collection when IMAGE_PREWARM_ENABLED is set."""
+    if not current_app.config.get('IMAGE_PREWARM_ENABLED', False):
+        return None
+    paths = prewarm_paths(session, collection_id, thumbnails)
+    return get_prewarmer(fetch_derivative, publish_prewarm_job).submit(collection_id, paths)
+
+
+def publish_prewarm_job(status):
+    cache_set_prewarm_job(status['id'], status, current_app.config.get('IMAGE_PREWARM_HISTORY', 100))
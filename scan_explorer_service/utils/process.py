@@ -0,0 +1,45 @@
+import os
+import threading
+
+
+class PerProcess:
+    """
+    An object shared by all threads of a worker process, created on first use.
+
+    It is created again when the process id changes so that forked workers never
+    share the sockets, threads or child processes of their parent.
+    """
+
+    def __init__(self, factory, close=None):
+        self._factory = factory
+        self._close = close
+        self._instance = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The instance created by this process, or None if it was not created yet."""
+        instance = self._instance
+        if instance is None or self._pid != os.getpid():
+            return None
+        return instance
+
+    def get(self, *args, **kwargs):
+        """Return the instance, calling factory(*args, **kwargs) if this process has none yet."""
+        instance = self.current()
+        if instance is not None:
+            return instance
+        with self._lock:
+            pid = os.getpid()
+            if self._instance is None or self._pid != pid:
+                self._instance = self._factory(*args, **kwargs)
+                self._pid = pid
+            return self._instance
+
+    def reset(self, *args, **kwargs):
+        """Drop the instance, passing it with the given arguments to the close callback."""
+        with self._lock:
+            if self._instance is not None and self._close is not None:
+                self._close(self._instance, *args, **kwargs)
+            self._instance = None
+            self._pid = None
@@ -1,7 +1,108 @@
-import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError, ParamValidationError
+from prometheus_client import Counter, Histogram
+from scan_explorer_service.utils.metrics import sample_value
+from scan_explorer_service.utils.process import PerProcess
+
+READ_CHUNK_SIZE = 1024*1024
+
+S3_CLIENT_CREATE_SECONDS = Histogram(
+    'scan_s3_client_create_seconds', 'Time to create the S3 client of a worker process')
+S3_REQUESTS = Counter(
+    'scan_s3_requests', 'Requests sent to S3')
+S3_SATURATED_REQUESTS = Counter(
+    'scan_s3_saturated_requests', 'Requests sent to S3 while every pooled connection was in use, on a new connection')
+
+
+def _create_s3_client(config):
+    start = time.monotonic()
+    # boto3 sessions are not thread safe, so the client gets one of its own
+    client = boto3.session.Session().client(
+        's3', endpoint_url=config.get('S3_ENDPOINT_URL'),
+        config=Config(max_pool_connections=config.get('S3_MAX_POOL_CONNECTIONS', 50),
+                      tcp_keepalive=config.get('S3_TCP_KEEPALIVE', True)))
+    _count_pool_use(client)
+    part_size = config.get('S3_DOWNLOAD_PART_SIZE', 8*1024*1024)
+    transfer_config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+                                     max_concurrency=config.get('S3_TRANSFER_CONCURRENCY', 10))
+    S3_CLIENT_CREATE_SECONDS.observe(time.monotonic() - start)
+    return client, transfer_config
+
+
+def _count_pool_use(client):
+    """Count the requests of a client, and those sent while its pool had no idle connection.
+
+    botocore does not wait for a pooled connection: once S3_MAX_POOL_CONNECTIONS are checked
+    out, requests open a new connection that is closed after use, so saturated requests pay
+    for a connection setup."""
+    manager = client._endpoint.http_session._manager
+
+    def before_send(request, **kwargs):
+        pool = manager.connection_from_url(request.url)
+        S3_REQUESTS.inc()
+        if pool.pool is not None and pool.pool.qsize() == 0:
+            S3_SATURATED_REQUESTS.inc()
+
+    client.meta.events.register('before-send.s3', before_send)
+
+
+_s3_client = PerProcess(_create_s3_client)
+
+
+def get_s3_client(config):
+    """
+    Return the S3 client and transfer config shared by all threads of the worker process.
+
+    They are created on first use and again after a fork. botocore clients are thread safe,
+    so every S3Provider uses the same connection pool of S3_MAX_POOL_CONNECTIONS
+    connections, kept alive with S3_TCP_KEEPALIVE, instead of resolving credentials and
+    opening new connections for every request.
+    """
+    return _s3_client.get(config)
+
+
+def s3_pool_stats():
+    """Report the connection pool usage of the worker's S3 client, like upstream.pool_stats."""
+    created = _s3_client.current()
+    hosts = {}
+    if created is not None:
+        pools = created[0]._endpoint.http_session._manager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+            maxsize = pool.pool.maxsize
+            in_use = maxsize - pool.pool.qsize()
+            hosts[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+                'maxsize': maxsize,
+                'in_use': in_use,
+                'available': maxsize - in_use,
+                'saturated': in_use >= maxsize,
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+            }
+    return {'requests': sample_value('scan_s3_requests_total'),
+            'saturated_requests': sample_value('scan_s3_saturated_requests_total'), 'hosts': hosts}
+
+
+def reset_s3_client():
+    """Drop the shared S3 client, e.g. after its configuration changed."""
+    _s3_client.reset()
+
+
+def _read_into(body, view):
+    """Read a streamed S3 body into a memoryview of exactly its size."""
+    offset = 0
+    for chunk in body.iter_chunks(READ_CHUNK_SIZE):
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    if offset != len(view):
+        raise ValueError(f"Expected {len(view)} bytes but read {offset}")
 
 
 class S3Provider:
@@ -16,27 +117,138 @@ class S3Provider:
         config: 
         """
         
-        self.s3 = boto3.resource("s3")
-        self.bucket = self.s3.Bucket(config.get(bucket_name))
+        self.client, self.transfer_config = get_s3_client(config)
+        self.bucket_name = config.get(bucket_name)
+        self.part_size = config.get('S3_DOWNLOAD_PART_SIZE', 8*1024*1024)
+        self.concurrency = config.get('S3_DOWNLOAD_CONCURRENCY', 1)
 
 
     def write_object_s3(self, file_bytes, object_name):
         try:
-            response = self.bucket.put_object(Body=file_bytes, Key=object_name)
+            response = self.client.put_object(Bucket=self.bucket_name, Body=file_bytes, Key=object_name)
         except (ClientError, ParamValidationError) as e:
             current_app.logger.exception(f"Error writing object {object_name}: {str(e)}")
             raise e
-        return response.e_tag
+        return response['ETag']
 
     def read_object_s3(self, object_name):
+        """Read a whole object into a buffer of its size and return a memoryview of it. With
+        S3_DOWNLOAD_CONCURRENCY above 1 it is read in parallel parts, otherwise with a single GET."""
+        if self.concurrency > 1:
+            return self.read_object_parts_s3(object_name, self.part_size, self.concurrency)
+        try:
+            obj = self.client.get_object(Bucket=self.bucket_name, Key=object_name)
+            view = memoryview(bytearray(obj['ContentLength']))
+            _read_into(obj['Body'], view)
+            return view
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                current_app.logger.exception(f"Error reading object {object_name}: {str(e)}")
+            raise
+        except Exception as e:
+            current_app.logger.exception(f"Unexpected error reading object {object_name}: {str(e)}")
+            raise
+
+    def read_object_parts_s3(self, object_name, part_size, concurrency):
+        """
+        Read a whole object with concurrent ranged GETs of part_size bytes.
+
+        The headers of the first GET tell the size of the object, and the other parts are
+        requested on up to `concurrency` threads while the first one is read, on the condition
+        that the object still has the same ETag. Every part is written in place in a single
+        buffer, and a memoryview of the buffer is returned so that the object is not copied again.
+        """
+        client = self.client
         try:
-            with io.BytesIO() as s3_obj:
-                self.bucket.download_fileobj(object_name, s3_obj)
-                s3_obj.seek(0)
-                s3_file = s3_obj.read()
-                return s3_file
+            try:
+                first = client.get_object(Bucket=self.bucket_name, Key=object_name, Range=f'bytes=0-{part_size - 1}')
+            except ClientError as e:
+                # ranges cannot be satisfied by empty objects
+                if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                    return memoryview(b'')
+                raise
+            content_range = first.get('ContentRange')
+            size = int(content_range.rsplit('/', 1)[1]) if content_range else first['ContentLength']
+            view = memoryview(bytearray(size))
+
+            def read_part(start):
+                end = min(start + part_size, size)
+                part = client.get_object(Bucket=self.bucket_name, Key=object_name,
+                                         Range=f'bytes={start}-{end - 1}', IfMatch=first['ETag'])
+                _read_into(part['Body'], view[start:end])
+
+            starts = range(part_size, size, part_size)
+            if not starts:
+                _read_into(first['Body'], view)
+                return view
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(starts))) as executor:
+                parts = [executor.submit(read_part, start) for start in starts]
+                _read_into(first['Body'], view[:part_size])
+                for part in parts:
+                    part.result()
+            return view
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchKey':
+                current_app.logger.exception(f"Error reading object {object_name}: {str(e)}")
+            raise
         except Exception as e:
             current_app.logger.exception(f"Unexpected error reading object {object_name}: {str(e)}")
             raise
 
+    def open_object_s3(self, object_name, **kwargs):
+        """
+        Start a GET of an object without reading its body.
+
+        Extra keyword arguments are passed to the GET, e.g. Range, IfMatch or IfNoneMatch. The caller
+        streams the returned response's Body and must close it.
+        """
+        try:
+            return self.client.get_object(Bucket=self.bucket_name, Key=object_name, **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('304', 'NoSuchKey', 'InvalidRange', 'PreconditionFailed'):
+                current_app.logger.exception(f"Error opening object {object_name}: {str(e)}")
+            raise
+
+    def head_object_s3(self, object_name):
+        """Metadata of an object, e.g. ContentLength and ETag. Raises ClientError if it does not exist."""
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=object_name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                current_app.logger.exception(f"Error reading metadata of object {object_name}: {str(e)}")
+            raise
+
+    def presigned_url_s3(self, object_name, expires_in, **params):
+        """URL from which the object can be downloaded without credentials for expires_in seconds.
+        Extra keyword arguments are added to the GET, e.g. ResponseContentDisposition."""
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket_name, 'Key': object_name, **params}, ExpiresIn=expires_in)
 
+    def upload_fileobj_s3(self, fileobj, object_name):
+        """Upload a file object, in parts when it is large, without reading it into memory."""
+        try:
+            self.client.upload_fileobj(fileobj, self.bucket_name, object_name, Config=self.transfer_config)
+        except (ClientError, ParamValidationError) as e:
+            current_app.logger.exception(f"Error uploading object {object_name}: {str(e)}")
+            raise
+
+    def list_keys_s3(self, prefix):
+        """Yield the key of every object whose key starts with prefix, a page of the listing at a time."""
+        try:
+            for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket_name, Prefix=prefix):
+                for obj in page.get('Contents', []):
+                    yield obj['Key']
+        except ClientError as e:
+            current_app.logger.exception(f"Error listing objects under {prefix}: {str(e)}")
+            raise
+
+    def delete_prefix_s3(self, prefix):
+        """Delete every object whose key starts with prefix."""
+        try:
+            for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket_name, Prefix=prefix):
+                keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+                if keys:
+                    self.client.delete_objects(Bucket=self.bucket_name, Delete={'Objects': keys, 'Quiet': True})
+        except ClientError as e:
+            current_app.logger.exception(f"Error deleting objects under {prefix}: {str(e)}")
+            raise
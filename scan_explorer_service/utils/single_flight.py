@@ -0,0 +1,64 @@
+import threading
+
+
+class Flight:
+    """A single in-progress upstream request that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls within a worker.
+
+    The first caller for a key becomes the leader and performs the work, every caller
+    that joins while the leader is running becomes a follower and receives the leader's
+    result. A result of None tells followers to do the work themselves.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.shared = 0
+
+    def join(self, key):
+        """Return (flight, is_leader) for the given key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.followers += 1
+                return flight, False
+            flight = Flight()
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key, flight, result):
+        """Publish the leader's result and release every follower."""
+        flight.result = result
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.done.set()
+
+    def wait(self, flight, timeout):
+        """Wait for the leader's result. Returns None on timeout or when the leader gave up."""
+        flight.done.wait(timeout)
+        result = flight.result
+        if result is not None:
+            with self._lock:
+                self.shared += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'shared': self.shared,
+            }
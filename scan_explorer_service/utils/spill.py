@@ -0,0 +1,85 @@
+import os
+import resource
+import sys
+import tempfile
+import threading
+
+
+def resident_memory():
+    """Resident set size of the process in bytes, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_resident_memory():
+    """Highest resident set size of the process so far in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class SpillBuffer:
+    """
+    Holds fetched images until they are consumed, keeping at most `limit` bytes in memory.
+
+    hold(data) is called as soon as an image is fetched and release(held) when it is its
+    turn to be used. An image that would take the bytes held in memory over the limit is
+    written to a temporary file in `directory` instead and read back by release, so that
+    fetching can run ahead of the consumer without the limit ever cutting a document short.
+    """
+
+    def __init__(self, limit, directory=None):
+        self.limit = limit
+        self.directory = directory
+        self.resident = 0
+        self.peak = 0
+        self.held = 0
+        self.held_bytes = 0
+        self.spilled = 0
+        self.spilled_bytes = 0
+        # bytes in memory and RSS when the first image was spilled
+        self.breach = None
+        self._lock = threading.Lock()
+
+    def hold(self, data):
+        with self._lock:
+            self.held += 1
+            self.held_bytes += len(data)
+            if self.resident + len(data) <= self.limit:
+                self.resident += len(data)
+                self.peak = max(self.peak, self.resident)
+                return data
+            self.spilled += 1
+            self.spilled_bytes += len(data)
+            if self.breach is None:
+                self.breach = (self.resident, resident_memory())
+        spill = tempfile.TemporaryFile(dir=self.directory)
+        spill.write(data)
+        return spill
+
+    @staticmethod
+    def is_spilled(held):
+        return not isinstance(held, (bytes, bytearray, memoryview))
+
+    def release(self, held):
+        """Return the bytes of a held image, reading them back from disk if it was spilled."""
+        if not self.is_spilled(held):
+            with self._lock:
+                self.resident -= len(held)
+            return held
+        try:
+            held.seek(0)
+            return held.read()
+        finally:
+            held.close()
+
+    def discard(self, held):
+        """Drop a held image that will not be used."""
+        if not self.is_spilled(held):
+            with self._lock:
+                self.resident -= len(held)
+        else:
+            held.close()
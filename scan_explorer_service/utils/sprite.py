@@ -0,0 +1,36 @@
+import io
+import math
+from PIL import Image
+
+
+def sprite_layout(count, tile_size, columns):
+    """Return (width, height, offsets) of a sprite with count square tiles laid out row by row."""
+    columns = max(1, min(columns, count))
+    rows = math.ceil(count / columns)
+    offsets = [((i % columns) * tile_size, (i // columns) * tile_size) for i in range(count)]
+    return columns * tile_size, rows * tile_size, offsets
+
+
+def build_sprite(images, tile_size, columns, quality=80):
+    """Composite thumbnails into a single JPEG sprite.
+
+    images is a list of encoded thumbnails, one per tile. Tiles whose image is missing or
+    cannot be decoded are left blank so that the offset map stays valid."""
+    width, height, offsets = sprite_layout(len(images), tile_size, columns)
+    sheet = Image.new('RGB', (width, height), 'white')
+    for data, (x, y) in zip(images, offsets):
+        if not data:
+            continue
+        try:
+            with Image.open(io.BytesIO(data)) as im:
+                # Let the JPEG decoder downscale while decoding, much cheaper than a full decode
+                im.draft('RGB', (tile_size, tile_size))
+                tile = im.convert('RGB')
+        except (OSError, ValueError):
+            continue
+        tile.thumbnail((tile_size, tile_size))
+        sheet.paste(tile, (x + (tile_size - tile.width) // 2, y + (tile_size - tile.height) // 2))
+
+    out = io.BytesIO()
+    sheet.save(out, 'JPEG', quality=quality, optimize=True)
+    return out.getvalue()
@@ -0,0 +1,104 @@
+import io
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from PIL import Image
+from scan_explorer_service.utils.process import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+def transcode_page(data, color_type, quality=75):
+    """
+    Re-encode a page image for embedding in a PDF according to the color type of the page.
+
+    BW pages become single strip CCITT Group 4 TIFFs and Grayscale and Color pages become
+    JPEGs of the given quality, all of which img2pdf embeds without decoding them again.
+    The original image is returned when the result is not smaller or the color type is unknown.
+    """
+    with Image.open(io.BytesIO(data)) as im:
+        dpi = im.info.get('dpi')
+        options = {'dpi': dpi} if dpi else {}
+        out = io.BytesIO()
+        if color_type == 'BW':
+            im = im.convert('1')
+            # img2pdf only embeds Group 4 TIFFs as they are when they have a single strip
+            im.save(out, 'TIFF', compression='group4', tiffinfo={278: im.height}, **options)
+        elif color_type == 'Grayscale':
+            im.convert('L').save(out, 'JPEG', quality=quality, **options)
+        elif color_type == 'Color':
+            im.convert('RGB').save(out, 'JPEG', quality=quality, **options)
+        else:
+            return data
+    return out.getvalue() if out.tell() < len(data) else data
+
+
+class Transcoder:
+    """
+    Transcodes page images with transcode_page on a pool of `workers` processes.
+
+    imap keeps up to `window` images in flight so that every core is busy while pages are
+    still yielded in order. A page that fails to transcode is yielded unchanged.
+    """
+
+    def __init__(self, workers, window, quality):
+        self.window = window
+        self.quality = quality
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def imap(self, pages):
+        """Yield the transcoded image of every (color_type, data) pair of pages."""
+        pending = deque()
+        try:
+            for color_type, data in pages:
+                future = None
+                # a page whose image could not be fetched is passed on as it is
+                if data is not None:
+                    name = color_type.name if color_type is not None else None
+                    if isinstance(data, memoryview):
+                        # memoryviews cannot be sent to the transcoding processes
+                        data = data.tobytes()
+                    future = self._executor.submit(transcode_page, data, name, self.quality)
+                pending.append((future, data))
+                if len(pending) >= self.window:
+                    yield self._result(*pending.popleft())
+            while pending:
+                yield self._result(*pending.popleft())
+        finally:
+            for future, _ in pending:
+                if future is not None:
+                    future.cancel()
+
+    @staticmethod
+    def _result(future, data):
+        if future is None:
+            return data
+        try:
+            return future.result()
+        except Exception:
+            logger.warning("Failed to transcode a page image, embedding it as it is", exc_info=True)
+            return data
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def _create_transcoder():
+    config = current_app.config
+    workers = config.get('IMAGE_PDF_TRANSCODE_WORKERS') or os.cpu_count() or 1
+    return Transcoder(workers, workers * 2, config.get('IMAGE_PDF_TRANSCODE_QUALITY', 75))
+
+
+_transcoder = PerProcess(_create_transcoder, close=lambda transcoder, wait: transcoder.shutdown(wait=wait))
+
+
+def get_transcoder():
+    """Return the worker's transcoder, creating it on first use and again after a fork."""
+    return _transcoder.get()
+
+
+def reset_transcoder(wait=True):
+    """Stop the transcoding processes, waiting for queued pages when wait is set."""
+    _transcoder.reset(wait)
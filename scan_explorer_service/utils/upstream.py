@@ -0,0 +1,305 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from scan_explorer_service.utils.process import PerProcess
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when the image server cannot be reached or the circuit breaker is open."""
+
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that keeps connections to the image server alive and counts pool saturation.
+
+    A request is counted as saturated when every connection slot of the target host pool
+    is checked out at the moment the request is sent."""
+
+    def __init__(self, *args, **kwargs):
+        self.requests_sent = 0
+        self.saturated_requests = 0
+        self._stats_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        pool = self.poolmanager.connection_from_url(request.url)
+        saturated = pool.pool is not None and pool.pool.qsize() == 0
+        with self._stats_lock:
+            self.requests_sent += 1
+            if saturated:
+                self.saturated_requests += 1
+        return super().send(request, **kwargs)
+
+
+def _create_session(config):
+    """Build a requests session with a keep-alive connection pool sized from the config."""
+    adapter = PooledAdapter(
+        pool_connections=config.get('IMAGE_PROXY_POOL_CONNECTIONS', 4),
+        pool_maxsize=config.get('IMAGE_PROXY_POOL_MAXSIZE', 20),
+        pool_block=config.get('IMAGE_PROXY_POOL_BLOCK', False),
+        max_retries=0)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_session = PerProcess(_create_session, close=lambda session: session.close())
+
+
+def get_session():
+    """Return the per-worker upstream session, creating it on first use and again after a fork."""
+    return _session.get(current_app.config)
+
+
+def reset_session():
+    """Close the pooled session so the next call to get_session rebuilds it."""
+    _session.reset()
+
+
+def upstream_request(method, url, **kwargs):
+    """Send a request to the image server through the pooled keep-alive session."""
+    return get_session().request(method, url, **kwargs)
+
+
+def pool_stats():
+    """Report connection pool usage for the current worker.
+
+    Returns a dict with adapter level counters and, per upstream host, the pool size,
+    the number of connections currently checked out and the number of connections opened."""
+    session = _session.current()
+    if session is None:
+        return {'pid': os.getpid(), 'requests': 0, 'saturated_requests': 0, 'hosts': {}}
+
+    adapter = session.get_adapter('http://')
+    hosts = {}
+    pools = adapter.poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None or pool.pool is None:
+            continue
+        maxsize = pool.pool.maxsize
+        in_use = maxsize - pool.pool.qsize()
+        hosts[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+            'maxsize': maxsize,
+            'in_use': in_use,
+            'available': maxsize - in_use,
+            'saturated': in_use >= maxsize,
+            'connections_opened': pool.num_connections,
+            'requests': pool.num_requests,
+        }
+
+    return {
+        'pid': os.getpid(),
+        'requests': adapter.requests_sent,
+        'saturated_requests': adapter.saturated_requests,
+        'hosts': hosts,
+    }
+
+
+class CircuitBreaker:
+    """
+    Fails fast when the image server error rate crosses a threshold.
+
+    Outcomes of the last `window` seconds are tracked. Once at least `min_requests` were
+    seen and the share of failures reaches `error_rate`, the breaker opens and rejects
+    requests for `cooldown` seconds. It then half-opens and lets a single probe through,
+    whose outcome closes or reopens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, error_rate, min_requests, window, cooldown, clock=time.monotonic):
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+        self._probe_in_flight = False
+        self._outcomes = deque()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a request may be sent upstream."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.clock() - self.opened_at < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record(self, ok):
+        """Record the outcome of a request that allow() let through."""
+        with self._lock:
+            now = self.clock()
+            if ok:
+                self.successes += 1
+            else:
+                self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            self._outcomes.append((now, ok))
+            self._prune(now)
+            total = len(self._outcomes)
+            failed = sum(1 for _, success in self._outcomes if not success)
+            if self.state == self.CLOSED and total >= self.min_requests and failed / total >= self.error_rate:
+                self._open(now)
+
+    def retry_after(self):
+        """Seconds until the breaker lets a probe through."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, self.cooldown - (self.clock() - self.opened_at))
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self._outcomes.clear()
+
+    def _prune(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def stats(self):
+        with self._lock:
+            self._prune(self.clock())
+            total = len(self._outcomes)
+            failed = sum(1 for _, success in self._outcomes if not success)
+            return {
+                'state': self.state,
+                'window_requests': total,
+                'window_failures': failed,
+                'error_rate': failed / total if total else 0.0,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+                'successes': self.successes,
+                'failures': self.failures,
+            }
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of upstream traffic.
+
+    Every request deposits `ratio` tokens and a retry costs one token. Tokens also refill at
+    `min_per_second` so that a quiet worker can still retry. The bucket holds at most
+    `max_tokens`, which limits how many retries a burst of failures can trigger.
+    """
+
+    def __init__(self, ratio, min_per_second, max_tokens, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self.tokens = float(max_tokens)
+        self.retries = 0
+        self.denied = 0
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount=0.0):
+        now = self.clock()
+        self.tokens = min(self.max_tokens, self.tokens + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Spend a token for a retry. Returns False when the budget is exhausted."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.retries += 1
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            self._refill()
+            return {'tokens': round(self.tokens, 2), 'retries': self.retries, 'denied': self.denied}
+
+
+def _create_breaker(config):
+    return CircuitBreaker(
+        config.get('IMAGE_PROXY_BREAKER_ERROR_RATE', 0.5),
+        config.get('IMAGE_PROXY_BREAKER_MIN_REQUESTS', 20),
+        config.get('IMAGE_PROXY_BREAKER_WINDOW', 30),
+        config.get('IMAGE_PROXY_BREAKER_COOLDOWN', 15))
+
+
+def _create_retry_budget(config):
+    return RetryBudget(
+        config.get('IMAGE_PROXY_RETRY_BUDGET_RATIO', 0.1),
+        config.get('IMAGE_PROXY_RETRY_BUDGET_MIN_PER_SEC', 1),
+        config.get('IMAGE_PROXY_RETRY_BUDGET_MAX', 10))
+
+
+_breaker = PerProcess(_create_breaker)
+_retry_budget = PerProcess(_create_retry_budget)
+
+
+def get_breaker():
+    """Return the worker's circuit breaker for the image server."""
+    return _breaker.get(current_app.config)
+
+
+def get_retry_budget():
+    """Return the worker's retry budget for the image server."""
+    return _retry_budget.get(current_app.config)
+
+
+def reset_resilience():
+    """Drop the breaker and retry budget so they are rebuilt from the config."""
+    _breaker.reset()
+    _retry_budget.reset()
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: a random delay up to min(cap, base * 2**attempt)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def resilience_stats():
+    """Report breaker and retry budget counters for the current worker."""
+    breaker = _breaker.current()
+    budget = _retry_budget.current()
+    return {
+        'breaker': breaker.stats() if breaker is not None else None,
+        'retry_budget': budget.stats() if budget is not None else None,
+    }
@@ -1,11 +1,14 @@
 
-from flask import current_app, url_for
+from flask import current_app, url_for, has_request_context
 
 def url_for_proxy(endpoint: str, **values):
-    values['_external'] = False
-
     server, prefix = proxy_url()
-    path = url_for(endpoint, **values).lstrip('/')
+    if has_request_context():
+        values['_external'] = False
+        path = url_for(endpoint, **values).lstrip('/')
+    else:
+        # outside of a request, e.g. in the ASGI image proxy, the path is built from the URL map alone
+        path = current_app.url_map.bind('').build(endpoint, values).lstrip('/')
 
     return f'{server}/{prefix}/{path}'
 
@@ -1,3 +1,6 @@
 from .manifest import bp_manifest
 from .metadata import bp_metadata
-from .image_proxy import bp_proxy
\ No newline at end of file
+from .image_proxy import bp_proxy
+from .pdf import bp_pdf
+from .sprite import bp_sprite
+from .image_admin import bp_image_admin
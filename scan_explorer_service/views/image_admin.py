@@ -0,0 +1,45 @@
+from flask import Blueprint, Response, request, jsonify
+from flask_discoverer import advertise
+from scan_explorer_service.utils.s3_utils import s3_pool_stats
+from scan_explorer_service.utils.upstream import pool_stats, resilience_stats
+from scan_explorer_service.utils.image_cache import get_image_cache
+from scan_explorer_service.utils.prewarm import prewarm_status
+from scan_explorer_service.utils.prefetch import prefetch_stats
+from scan_explorer_service.utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render as render_metrics
+from scan_explorer_service.utils.cache import cache_get_prewarm_job, cache_get_prewarm_jobs
+from scan_explorer_service.views.image_proxy import coalescing_stats
+
+bp_image_admin = Blueprint('image_admin', __name__, url_prefix='/image')
+
+
+@advertise(scopes=['ads:scan-explorer'], rate_limit=[5000, 3600*24])
+@bp_image_admin.route('/prewarm', methods=['GET'])
+def image_proxy_prewarm():
+    """Status of the post-ingest warm-up jobs of all workers, with the queue of the worker that answered"""
+    id = request.args.get('id')
+    if id is None:
+        status = prewarm_status()
+        jobs = cache_get_prewarm_jobs()
+        if jobs is not None:
+            status['jobs'] = jobs
+        return jsonify(status)
+    status = cache_get_prewarm_job(id)
+    if status is None:
+        return jsonify(Message=f"No prewarm job for {id}"), 404
+    return jsonify(status)
+
+
+@advertise(scopes=['ads:scan-explorer'], rate_limit=[5000, 3600*24])
+@bp_image_admin.route('/stats', methods=['GET'])
+def image_proxy_stats():
+    """Report upstream and S3 connection pool, image cache, coalescing, prefetch and circuit breaker state for this worker"""
+    cache = get_image_cache()
+    return jsonify(pool=pool_stats(), s3_pool=s3_pool_stats(), cache=cache.stats() if cache is not None else None,
+                   coalescing=coalescing_stats(), prefetch=prefetch_stats(), **resilience_stats())
+
+
+@advertise(scopes=['ads:scan-explorer'], rate_limit=[5000, 3600*24])
+@bp_image_admin.route('/metrics', methods=['GET'])
+def image_proxy_metrics():
+    """Image proxy metrics in the Prometheus text format, of all workers of the host when PROMETHEUS_MULTIPROC_DIR is set"""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
@@ -1,230 +1,548 @@
-from typing import Union
-from flask import Blueprint, Response, current_app, request, stream_with_context, jsonify, send_file
+from flask import Blueprint, Response, current_app, request, stream_with_context, jsonify, send_file, redirect
 from flask_discoverer import advertise
-from urllib import parse as urlparse
-import img2pdf
 import math
-import requests
-from scan_explorer_service.models import Collection, Page, Article
-from scan_explorer_service.utils.db_utils import item_thumbnail
+import json
+from scan_explorer_service.utils.db_utils import item_thumbnail_path, item_thumbnail_paths, collection_image_paths, page_by_image_path
+from scan_explorer_service.utils.image_info import image_info
+from scan_explorer_service.extensions import manifest_factory
 from scan_explorer_service.utils.s3_utils import S3Provider
+from botocore.exceptions import ClientError
+from scan_explorer_service.utils.upstream import UpstreamUnavailable
+from scan_explorer_service.utils.image_utils import forwarded_headers, upstream_url, upstream_image, upstream_headers, fetch_derivative
+from scan_explorer_service.utils.image_cache import get_image_cache
+from scan_explorer_service.utils.http_utils import make_etag, is_not_modified, not_modified_response, set_validators, forwardable_headers
+from scan_explorer_service.utils.single_flight import SingleFlight
+from scan_explorer_service.utils.prefetch import get_prefetcher, record_prefetch_hit
+from prometheus_client import Counter, Histogram
+from scan_explorer_service.utils.metrics import BYTE_BUCKETS
+from scan_explorer_service.utils.cache import LocalCache, acquire_lock, release_lock, cache_get_thumbnail, cache_get_thumbnails, cache_set_thumbnails, \
+    cache_get_image_info, cache_set_image_info
+from werkzeug.http import http_date, parse_date, unquote_etag
 from scan_explorer_service.utils.utils import url_for_proxy
 import re
-import io
-import sys
+import itertools
+import os
 import time
 
-try:
-    from gevent.pool import Pool as GeventPool
-except ImportError:
-    GeventPool = None
-
 bp_proxy = Blueprint('proxy', __name__, url_prefix='/image')
 
+_single_flight = SingleFlight()
+
+IMAGE_REQUESTS = Counter(
+    'scan_image_requests', 'Image proxy responses by IIIF request kind and status', ['kind', 'status'])
+IMAGE_REQUEST_SECONDS = Histogram(
+    'scan_image_request_seconds', 'Time from request to the end of the response body', ['kind'])
+IMAGE_UPSTREAM_TTFB_SECONDS = Histogram(
+    'scan_image_upstream_ttfb_seconds', 'Time from the upstream request to the image server response headers', ['kind'])
+IMAGE_UPSTREAM_RETRIES = Counter(
+    'scan_image_upstream_retries', 'Retried image server requests', ['kind'])
+IMAGE_RESPONSE_BYTES = Histogram(
+    'scan_image_response_bytes', 'Size of image proxy response bodies', ['kind'], buckets=BYTE_BUCKETS)
+IMAGE_BYTES = Counter(
+    'scan_image_bytes', 'Bytes sent by the image proxy', ['kind'])
+IMAGE_CACHE = Counter(
+    'scan_image_cache', 'Disk cache lookups of the image proxy', ['kind', 'result'])
+_volume_image_paths = LocalCache(256, 600)
+
+# <identifier>/<region>/<size>/<rotation>/<quality>.<format>
+IIIF_IMAGE_REQUEST = re.compile(r'^(?P<identifier>[^/]+)/(?P<parameters>[^/]+/[^/]+/[^/]+/[^/]+\.\w+)$')
+# Requests for the whole source image, unscaled and unrotated, which S3 can serve as is
+IIIF_IDENTITY_REQUEST = re.compile(r'^(?P<identifier>[^/]+)/full/(?:full|max)/0/default\.(?P<format>\w+)$')
+PASSTHROUGH_CHUNK_SIZE = 64*1024
+
 
 @advertise(scopes=['api'], rate_limit=[5000, 3600*24])
 @bp_proxy.route('/iiif/2/<path:path>', methods=['GET'])
 def image_proxy(path):
     """Proxy in between the image server and the user"""
-    req_url = urlparse.urljoin(f'{current_app.config.get("IMAGE_API_BASE_URL")}/', path)
-    req_headers = {key: value for (key, value) in request.headers if key != 'Host' and key != 'Accept'}
+    timing = ImageTiming(image_request_kind(path))
+    return instrument_image_response(serve_image(path, timing), timing)
+
+
+def serve_image(path, timing):
+    """Serve an image from the disk cache or the image server, recording upstream timings in timing."""
+    if request.method == 'GET' and path.endswith('/info.json') and current_app.config.get('IMAGE_INFO_FROM_DB', True):
+        resp = local_image_info_response(path.strip('/')[:-len('/info.json')])
+        if resp is not None:
+            return resp
+
+    source = passthrough_source(path)
+    if source is not None:
+        resp = passthrough_image_response(*source)
+        if resp is not None:
+            return resp
+
+    req_headers = forwardable_headers(request.headers)
+    req_headers.update(forwarded_headers())
+
+    encoded_url = upstream_url(path)
+
+    # IIIF derivatives are immutable for a given path, so a path derived tag is a strong
+    # validator whenever the image server does not supply its own
+    path_etag = make_etag('image', path.strip('/'))
+
+    cache = get_image_cache() if request.method == 'GET' else None
+    if cache is not None and 'Range' not in request.headers:
+        schedule_prefetch(path)
+    if cache is not None:
+        cached = cache.get(path)
+        if cached is not None:
+            record_prefetch_hit(path)
+            try:
+                return cached_image_response(*cached)
+            except OSError:
+                current_app.logger.debug(f"Cached image for {path} was evicted while serving")
+
+    if is_not_modified(path_etag):
+        return not_modified_response(path_etag)
+
+    try:
+        if request.method == 'GET' and current_app.config.get('IMAGE_PROXY_COALESCE', True) and 'Range' not in request.headers:
+            # the shared response must be complete whatever the client already has cached
+            shared_headers = {name: value for name, value in req_headers.items()
+                              if name.lower() not in ('if-none-match', 'if-modified-since')}
+            return coalesced_image_response(lambda: upstream_image(encoded_url, shared_headers, timing=timing),
+                                            path, path_etag, cache)
+
+        return streamed_image_response(upstream_image(encoded_url, req_headers, timing=timing), path, path_etag, cache)
+    except UpstreamUnavailable as e:
+        current_app.logger.warning(f"Image request for {path} failed: {e}")
+        resp = jsonify(Message=str(e))
+        resp.status_code = e.status
+        if e.retry_after:
+            resp.headers['Retry-After'] = str(math.ceil(e.retry_after))
+        return resp
+
+
+class ImageTiming:
+    """Timings and byte count gathered while serving one image request."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.ttfb = None
+        self.retries = 0
+        self.bytes = 0
+
+
+class CountingIterable:
+    """Wraps a response body to count the bytes sent to the client."""
+
+    def __init__(self, iterable, timing):
+        self.iterable = iterable
+        self.timing = timing
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.timing.bytes += len(chunk)
+            yield chunk
 
-    req_headers['X-Forwarded-Host'] = current_app.config.get('PROXY_SERVER')
-    req_headers['X-Forwarded-Path'] = current_app.config.get('PROXY_PREFIX').rstrip('/') + '/image'
+    def close(self):
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+
+
+def image_request_kind(path):
+    """Classify an IIIF request as info, thumbnail, full (whole image region), tile (partial region) or other."""
+    if request.endpoint == 'proxy.image_proxy_thumbnail':
+        return 'thumbnail'
+    match = IIIF_IMAGE_REQUEST.match(path.strip('/'))
+    if match is None:
+        return 'info' if path.endswith('info.json') else 'other'
+    region = match.group('parameters').split('/', 1)[0]
+    if region == 'square':
+        return 'thumbnail'
+    if region == 'full':
+        return 'full'
+    return 'tile'
+
+
+def instrument_image_response(resp, timing):
+    """Add a Server-Timing header and record the request metrics once the response is closed."""
+    server_timing = [f'proxy;dur={(time.perf_counter() - timing.start) * 1000:.1f}']
+    if timing.ttfb is not None:
+        server_timing.append(f'upstream;desc="time to first byte";dur={timing.ttfb * 1000:.1f}')
+    if timing.retries:
+        server_timing.append(f'retries;desc="{timing.retries}"')
+    resp.headers['Server-Timing'] = ', '.join(server_timing)
+
+    def record():
+        labels = {'kind': timing.kind}
+        IMAGE_REQUESTS.labels(status=resp.status_code, **labels).inc()
+        IMAGE_REQUEST_SECONDS.labels(**labels).observe(time.perf_counter() - timing.start)
+        IMAGE_RESPONSE_BYTES.labels(**labels).observe(timing.bytes)
+        IMAGE_BYTES.labels(**labels).inc(timing.bytes)
+        if timing.ttfb is not None:
+            IMAGE_UPSTREAM_TTFB_SECONDS.labels(**labels).observe(timing.ttfb)
+        if timing.retries:
+            IMAGE_UPSTREAM_RETRIES.labels(**labels).inc(timing.retries)
+        cache_status = resp.headers.get('X-Cache')
+        if cache_status:
+            IMAGE_CACHE.labels(result=cache_status.lower(), **labels).inc()
+
+    if resp.content_length is not None:
+        timing.bytes = resp.content_length
+    elif resp.is_streamed and not resp.direct_passthrough:
+        resp.response = CountingIterable(resp.response, timing)
+    if resp.direct_passthrough:
+        # Werkzeug hands these bodies, e.g. disk cache files, to the server as they are so that
+        # it can use sendfile, and never calls their close callbacks
+        record()
+    else:
+        resp.call_on_close(record)
+    return resp
 
-    encoded_url = re.sub(r"[+&]", "%2B", req_url)
 
-    retries = current_app.config.get('IMAGE_PROXY_RETRIES', 1)
-    retry_delay = current_app.config.get('IMAGE_PROXY_RETRY_DELAY', 2)
+def local_image_info(identifier):
+    """info.json of an image built from its page in the database, or None when the dimensions are unknown."""
+    info = cache_get_image_info(identifier)
+    if info is None:
+        with current_app.session_scope() as session:
+            page = page_by_image_path(session, identifier)
+            if page is not None and page.width and page.height:
+                info = json.dumps(image_info(
+                    url_for_proxy('proxy.image_proxy', path=identifier), page.width, page.height,
+                    manifest_factory.default_image_api_context, manifest_factory.default_image_api_profile,
+                    current_app.config.get('IMAGE_INFO_TILE_SIZE', 512), current_app.config.get('IMAGE_INFO_MIN_SIZE', 64)))
+            else:
+                info = ''
+        cache_set_image_info(identifier, info)
+    return info or None
+
+
+def local_image_info_response(identifier):
+    """Serve info.json without contacting the image server. Returns None when it has to be proxied."""
+    info = local_image_info(identifier)
+    if info is None:
+        return None
+    etag = make_etag('info', info)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    resp = Response(info, mimetype='application/json')
+    resp.headers['Cache-Control'] = f'public, max-age={current_app.config.get("IMAGE_INFO_MAX_AGE", 86400)}'
+    return set_validators(resp, etag)
+
+
+def passthrough_source(path):
+    """(object name, content type) of the source image in S3 when path asks for it unmodified, else None."""
+    if not current_app.config.get('IMAGE_PASSTHROUGH'):
+        return None
+    match = IIIF_IDENTITY_REQUEST.match(path.strip('/'))
+    if match is None:
+        return None
+    identifier, image_format = match.group('identifier', 'format')
+    mimetype = current_app.config.get('IMAGE_PASSTHROUGH_FORMATS', {}).get(image_format)
+    if mimetype is None or not identifier.endswith('.' + image_format):
+        return None
+    return identifier.replace(current_app.config.get('IMAGE_API_SLASH_SUB', '%2F'), '/'), mimetype
+
+
+def open_source_image(object_name, mimetype, if_none_match=None, byte_range=None):
+    """GET a source image from S3 as (status, headers, body), or None when S3 cannot serve it."""
+    conditions = {}
+    if if_none_match:
+        conditions['IfNoneMatch'] = if_none_match
+    if byte_range:
+        conditions['Range'] = byte_range
+    try:
+        obj = S3Provider(current_app.config, 'AWS_BUCKET_NAME_IMAGE').open_object_s3(object_name, **conditions)
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code in ('304', 'NotModified'):
+            etag = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('etag')
+            return 304, [('ETag', etag)] if etag else [], None
+        if code == 'InvalidRange':
+            return 416, [], None
+        current_app.logger.warning(f"Failed to read {object_name} from S3, proxying it instead: {code}")
+        return None
+    except Exception as e:
+        current_app.logger.warning(f"Failed to read {object_name} from S3, proxying it instead: {e}")
+        return None
+
+    headers = [('Content-Type', mimetype), ('Accept-Ranges', 'bytes'), ('ETag', obj['ETag'])]
+    if obj.get('LastModified') is not None:
+        headers.append(('Last-Modified', http_date(obj['LastModified'])))
+    if obj.get('ContentLength') is not None:
+        headers.append(('Content-Length', str(obj['ContentLength'])))
+    if obj.get('ContentRange'):
+        headers.append(('Content-Range', obj['ContentRange']))
+        return 206, headers, obj['Body']
+    return 200, headers, obj['Body']
+
+
+def source_image_url(object_name):
+    """Presigned S3 URL of a source image."""
+    return S3Provider(current_app.config, 'AWS_BUCKET_NAME_IMAGE').presigned_url_s3(
+        object_name, current_app.config.get('IMAGE_PASSTHROUGH_URL_EXPIRES', 300))
+
+
+def passthrough_image_response(object_name, mimetype):
+    """Serve a source image straight from S3, or None when it must go through the image server."""
+    if current_app.config.get('IMAGE_PASSTHROUGH') == 'redirect':
+        resp = redirect(source_image_url(object_name), code=302)
+        resp.headers['Cache-Control'] = 'no-store'
+        return resp
+
+    byte_range = request.headers.get('Range') if request.range is not None and len(request.range.ranges) == 1 else None
+    opened = open_source_image(object_name, mimetype, request.headers.get('If-None-Match'), byte_range)
+    if opened is None:
+        return None
+    status, headers, body = opened
+    if body is None:
+        return Response(status=status, headers=headers)
+    resp = Response(body.iter_chunks(PASSTHROUGH_CHUNK_SIZE) if request.method == 'GET' else [],
+                    status=status, headers=headers)
+    resp.call_on_close(body.close)
+    return resp
 
-    r = requests.request(request.method, encoded_url, params=request.args, stream=True,
-                         headers=req_headers, allow_redirects=False, data=request.form)
 
-    for attempt in range(retries):
-        if r.status_code < 400:
-            break
-        current_app.logger.warning(
-            f"Upstream image request failed (status {r.status_code}), "
-            f"retrying in {retry_delay}s (attempt {attempt + 1}/{retries})")
-        time.sleep(retry_delay)
-        r.close()
-        r = requests.request(request.method, encoded_url, params=request.args, stream=True,
-                             headers=req_headers, allow_redirects=False, data=request.form)
+def streamed_image_response(r, path, path_etag, cache, chunks=None):
+    """Stream an upstream response to the client, writing it to the disk cache when enabled."""
+    headers = upstream_headers(r, path_etag)
 
-    excluded_headers = ['content-encoding','content-length', 'transfer-encoding', 'connection']
-    headers = [(name, value) for (name, value) in r.headers.items() if name.lower() not in excluded_headers]
+    writer = None
+    if cache is not None and r.status_code == 200 and not r.headers.get('Content-Encoding'):
+        writer = cache.writer(path, headers)
+
+    if chunks is None:
+        chunks = r.raw.stream(decode_content=False)
 
     @stream_with_context
     def generate():
         """Stream the upstream response body chunk by chunk to avoid buffering the full image in memory."""
-        for chunk in r.raw.stream(decode_content=False):
+        for chunk in chunks:
+            if writer is not None:
+                writer.write(chunk)
             yield chunk
+        if writer is not None:
+            writer.commit()
+
+    def close():
+        if writer is not None:
+            writer.abort()
+        r.close()
 
     resp = Response(generate(), status=r.status_code, headers=headers)
-    resp.call_on_close(r.close)
+    if cache is not None:
+        resp.headers['X-Cache'] = 'MISS'
+    resp.call_on_close(close)
     return resp
 
 
-@advertise(scopes=['api'], rate_limit=[5000, 3600*24])
-@bp_proxy.route('/thumbnail', methods=['GET'])
-def image_proxy_thumbnail():
-    """Helper to generate the correct url for a thumbnail given an ID and type"""
+def read_upstream_body(chunks, limit):
+    """Read an upstream body up to limit bytes as (chunks read, True if that is the whole body)."""
+    read, size = [], 0
+    for chunk in chunks:
+        read.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            return read, False
+    return read, True
+
+
+def shared_image_response(shared):
+    """Serve the response shared by a coalesced upstream request, or a 304 for this request."""
+    status, headers, body = shared
+    etag, last_modified = recorded_validators(headers)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    return Response(body, status=status, headers=headers)
+
+
+def coalesced_image_response(fetch, path, path_etag, cache):
+    """Serve an image so that identical concurrent requests share one upstream request."""
+    key = path.strip('/')
+    flight, leader = _single_flight.join(key)
+    if not leader:
+        shared = _single_flight.wait(flight, current_app.config.get('IMAGE_PROXY_COALESCE_WAIT', 10))
+        if shared is not None:
+            return shared_image_response(shared)
+        return streamed_image_response(fetch(), path, path_etag, cache)
+
+    lock = None
+    result = None
     try:
-        id = request.args.get('id').replace(" ", "+")
-        type = request.args.get('type')
-        with current_app.session_scope() as session:
-            thumbnail_path = item_thumbnail(session, id, type)
-            path = urlparse.urlparse(thumbnail_path).path
+        # leaders in other workers wait for this one and then find the derivative in the disk cache
+        if current_app.config.get('IMAGE_PROXY_COALESCE_REDIS', False):
+            lock = acquire_lock('image:' + key, timeout=60,
+                                blocking_timeout=current_app.config.get('IMAGE_PROXY_COALESCE_WAIT', 10))
+            cached = cache.get(path) if cache is not None else None
+            if cached is not None:
+                try:
+                    return cached_image_response(*cached)
+                except OSError:
+                    pass
+        r = fetch()
+        if r.status_code != 200:
+            return streamed_image_response(r, path, path_etag, cache)
+
+        try:
+            chunks = r.raw.stream(decode_content=False)
+            read, complete = read_upstream_body(
+                chunks, current_app.config.get('IMAGE_PROXY_COALESCE_MAX_BYTES', 5*1024*1024))
+        except Exception:
+            r.close()
+            raise
+        if not complete:
+            return streamed_image_response(r, path, path_etag, cache, itertools.chain(read, chunks))
 
-            remove = urlparse.urlparse(url_for_proxy('proxy.image_proxy', path='')).path
+        r.close()
+        headers = upstream_headers(r, path_etag)
+        result = (r.status_code, headers, b''.join(read))
+        if cache is not None and not r.headers.get('Content-Encoding'):
+            writer = cache.writer(path, headers)
+            writer.write(result[2])
+            writer.commit()
+    finally:
+        release_lock(lock)
+        _single_flight.finish(key, flight, result)
 
-            path = path.replace(remove, '')
+    resp = shared_image_response(result)
+    if cache is not None:
+        resp.headers['X-Cache'] = 'MISS'
+    return resp
 
-            return image_proxy(path)
-    except Exception as e:
-        current_app.logger.exception(f'{e}')
-        return jsonify(Message=str(e)), 400
 
-def get_item(session, id):
-    """Look up an Article or Collection by ID, raising if neither exists."""
-    item: Union[Article, Collection] = (
-                session.query(Article).filter(Article.id == id).one_or_none()
-                or session.query(Collection).filter(Collection.id == id).one_or_none())
-    if not item:
-        raise Exception("ID: " + str(id) + " not found")
-
-    return item
-
-
-def get_pages(item, session, page_start, page_end, page_limit):
-    """Query pages for an Article or Collection within the given page range.
-    For articles, page numbers are relative to the article's first page in the volume."""
-    if isinstance(item, Article):
-        first_page = item.pages.first()
-        if first_page is None:
-            raise Exception(f"No pages found for article {item.id}")
-        start_page = first_page.volume_running_page_num
-        query = session.query(Page).filter(Page.articles.any(Article.id == item.id),
-            Page.volume_running_page_num  >= page_start + start_page - 1,
-            Page.volume_running_page_num  <= page_end + start_page - 1).order_by(Page.volume_running_page_num).limit(page_limit)
-    elif isinstance(item, Collection):
-        query = session.query(Page).filter(Page.collection_id == item.id,
-            Page.volume_running_page_num >= page_start,
-            Page.volume_running_page_num <= page_end).order_by(Page.volume_running_page_num).limit(page_limit)
-    return query
-
-
-def fetch_images(session, item, page_start, page_end, page_limit, memory_limit):
-    """Yield page images from S3, stopping when memory_limit is exceeded.
-    Uses gevent pool for parallel fetching when available."""
-    
-    query = get_pages(item, session, page_start, page_end, page_limit)
-    pages = query.all()
-
-    page_objects = []
-    for page in pages[:page_limit]:
-        image_path, fmt = page.image_path_basic
-        object_name = '/'.join(image_path) + fmt
-        page_objects.append(object_name)
-
-    config = current_app.config
-    app_logger = current_app.logger
-    s3 = S3Provider(config, 'AWS_BUCKET_NAME_IMAGE')
-
-    def _fetch(obj_name):
-        return s3.read_object_s3(obj_name)
-
-    pool = None
-    if GeventPool is not None:
-        pool = GeventPool(size=20)
-        # maxsize=4 limits prefetch buffering to avoid holding too many images in memory at once
-        results = pool.imap(_fetch, page_objects, maxsize=4)
-    else:
-        results = (_fetch(obj) for obj in page_objects)
+def recorded_validators(headers):
+    """(etag, last modified) of recorded (name, value) response headers, None when missing."""
+    lookup = dict((name.lower(), value) for name, value in headers)
+    etag = unquote_etag(lookup['etag'])[0] if 'etag' in lookup else None
+    last_modified = parse_date(lookup['last-modified']) if 'last-modified' in lookup else None
+    return etag, last_modified
 
-    try:
-        memory_sum = 0
-        for im_data in results:
-            if not im_data:
-                continue
-            memory_sum += sys.getsizeof(im_data)
-            if memory_sum > memory_limit:
-                app_logger.error(f"Memory limit reached: {memory_sum} > {memory_limit}")
-                break
-            yield im_data
-    finally:
-        if pool is not None:
-            pool.join(timeout=5)
-            pool.kill(block=False)
 
+def cached_image_response(body_path, headers):
+    """Serve a derivative from the disk cache with the headers recorded from the upstream response."""
+    lookup = dict((name.lower(), value) for name, value in headers)
+    etag, last_modified = recorded_validators(headers)
+    if is_not_modified(etag, last_modified):
+        resp = not_modified_response(etag, last_modified)
+        resp.headers['X-Cache'] = 'HIT'
+        return resp
 
-def fetch_object(object_name, bucket_name):
-    """Download a single object from S3, raising ValueError if the content is empty."""
-    file_content = S3Provider(current_app.config, bucket_name).read_object_s3(object_name)
-    if not file_content:
-        current_app.logger.error(f"Failed to fetch content for {object_name}. File might be empty.")
-        raise ValueError(f"File content is empty for {object_name}")
-    return file_content
+    size = os.path.getsize(body_path)
+    resp = send_file(body_path, mimetype=lookup.get('content-type', 'application/octet-stream'), add_etags=False)
+    for name in ('Cache-Control', 'Expires', 'Last-Modified'):
+        resp.headers.pop(name, None)
+    for name, value in headers:
+        if name.lower() != 'content-type':
+            resp.headers.add(name, value)
+    resp.headers['X-Cache'] = 'HIT'
+    return resp.make_conditional(request, accept_ranges=True, complete_length=size)
 
 
-def fetch_article(item, memory_limit):
-    """Try to fetch a pre-rendered PDF for an article from the ads-classic-pdf S3 bucket."""
-    object_name = f'{item.id}.pdf'.lower()
+@advertise(scopes=['api'], rate_limit=[5000, 3600*24])
+@bp_proxy.route('/thumbnail', methods=['GET'])
+def image_proxy_thumbnail():
+    """Helper to generate the correct url for a thumbnail given an ID and type"""
     try:
-        full_path = f'pdfs/{object_name}'
-        file_content = fetch_object(full_path, 'AWS_BUCKET_NAME_PDF')
-
-        if len(file_content) > memory_limit:
-            current_app.logger.error(f"Memory limit reached: {len(file_content)} > {memory_limit}")
-
-        file_stream = io.BytesIO(file_content)
-        file_stream.seek(0)
-        return send_file(
-            file_stream,
-            as_attachment=True,
-            attachment_filename=object_name,
-            mimetype='application/pdf'
-        )
+        id = request.args.get('id').replace(" ", "+")
+        type = request.args.get('type')
+        return image_proxy(thumbnail_path(id, type))
     except Exception as e:
-        current_app.logger.exception(f"Failed to get PDF for {object_name}: {str(e)}")
+        current_app.logger.exception(f'{e}')
+        return jsonify(Message=str(e)), 400
 
 
-def generate_pdf(item, session, page_start, page_end, page_limit, memory_limit):
-    """Return a pre-rendered PDF for articles if available, otherwise generate one from page images."""
-    if isinstance(item, Article):
-        response = fetch_article(item, memory_limit)
-        if response:
-            return response
-        else:
-            current_app.logger.debug(f"Response fetch article was empty")
-            page_end = page_limit
-    current_app.logger.debug(f"Article is not an article or fetch article failed.")
-    return Response(img2pdf.convert([im for im in fetch_images(session, item, page_start, page_end, page_limit, memory_limit)]), mimetype='application/pdf')
+def thumbnail_path(id, type):
+    """Resolve the IIIF thumbnail path of an item from the thumbnail index, then the database."""
+    if type not in ('page', 'article', 'collection'):
+        raise Exception("Invalid type")
+    path = cache_get_thumbnail(type, id)
+    if path is None:
+        with current_app.session_scope() as session:
+            path = item_thumbnail_path(session, id, type)
+        cache_set_thumbnails({(type, id): path})
+    return path
 
 
 @advertise(scopes=['api'], rate_limit=[5000, 3600*24])
-@bp_proxy.route('/pdf', methods=['GET'])
-def pdf_save():
-    """Generate a PDF from pages"""
+@bp_proxy.route('/thumbnails', methods=['POST'])
+def image_proxy_thumbnails():
+    """Resolve the thumbnail URLs of a JSON list of {"id", "type"} items at once"""
     try:
-        id = request.args.get('id')
-        page_start = request.args.get('page_start', 1, int)
-        page_end = request.args.get('page_end', math.inf, int)
-        memory_limit = current_app.config.get("IMAGE_PDF_MEMORY_LIMIT")
-        page_limit = current_app.config.get("IMAGE_PDF_PAGE_LIMIT")
-
-        if page_end != math.inf and (page_end - page_start + 1) > page_limit:
-            return jsonify(Message=f"Requested {page_end - page_start + 1} pages exceeds limit of {page_limit}"), 400
-
-        if not id:
-            return jsonify(Message="Missing required parameter: id"), 400
-
+        items = [(item['type'], str(item['id']).replace(" ", "+")) for item in request.get_json()]
+    except Exception:
+        return jsonify(Message='Expected a JSON list of {"id": ..., "type": ...} objects'), 400
+    limit = current_app.config.get('IMAGE_THUMBNAIL_BATCH_LIMIT', 100)
+    if len(items) > limit:
+        return jsonify(Message=f"Requested {len(items)} thumbnails exceeds limit of {limit}"), 400
+    if any(type not in ('page', 'article', 'collection') for type, _ in items):
+        return jsonify(Message="Invalid type"), 400
+
+    paths = thumbnail_paths(items)
+    return jsonify(thumbnails=[{
+        'id': id,
+        'type': type,
+        'url': url_for_proxy('proxy.image_proxy', path=paths[(type, id)]) if (type, id) in paths else None,
+    } for type, id in items])
+
+
+def thumbnail_paths(items):
+    """Resolve the thumbnail paths of many (type, id) items as {(type, id): path}."""
+    paths = cache_get_thumbnails(items)
+    missing = set(items) - set(paths)
+    if missing:
         with current_app.session_scope() as session:
-
-            item = get_item(session, id)
-            current_app.logger.debug(f"Item retrieved successfully: {item.id}")
-
-            response = generate_pdf(item, session, page_start, page_end, page_limit, memory_limit)
-            return response
-    except Exception as e:
-        return jsonify(Message=str(e)), 400
+            found = item_thumbnail_paths(session, missing)
+        cache_set_thumbnails(found)
+        paths.update(found)
+    return paths
+
+
+
+def schedule_prefetch(path):
+    """Queue the prefetch of the same derivative of the following pages when IMAGE_PREFETCH_DEPTH is set."""
+    if current_app.config.get('IMAGE_PREFETCH_DEPTH', 0) > 0 and prefetchable(path):
+        get_prefetcher(neighbour_paths, fetch_derivative).schedule(path)
+
+
+def prefetchable(path):
+    """Whether path is a derivative of a whole page small enough to prefetch."""
+    match = IIIF_IMAGE_REQUEST.match(path.strip('/'))
+    if match is None:
+        return False
+    region, size = match.group('parameters').split('/')[:2]
+    if region not in ('full', 'square'):
+        return False
+    if size in ('full', 'max'):
+        return True
+    dimensions = size.lstrip('!').split(',')
+    if len(dimensions) != 2 or not all(d.isdigit() for d in dimensions if d) or not any(dimensions):
+        return False
+    max_size = current_app.config.get('IMAGE_PREFETCH_MAX_SIZE', 2000)
+    return all(int(d) <= max_size for d in dimensions if d)
+
+
+def volume_image_paths(image_path):
+    """IIIF identifiers of the pages in the volume of a page, in volume order, cached in process."""
+    key = image_path.rsplit(current_app.config.get('IMAGE_API_SLASH_SUB', '%2F'), 1)[0]
+    paths = _volume_image_paths.get(key)
+    if paths is None or image_path not in paths:
+        with current_app.session_scope() as session:
+            paths = collection_image_paths(session, image_path)
+        if paths:
+            _volume_image_paths.set(key, paths)
+    return paths
+
+
+def neighbour_paths(path):
+    """Paths of the same derivative for the following pages that are not in the disk cache yet."""
+    match = IIIF_IMAGE_REQUEST.match(path.strip('/'))
+    if match is None:
+        return []
+    identifier = match.group('identifier')
+    paths = volume_image_paths(identifier)
+    if identifier not in paths:
+        return []
+    index = paths.index(identifier)
+    depth = current_app.config.get('IMAGE_PREFETCH_DEPTH', 0)
+    cache = get_image_cache()
+    neighbours = [f"{neighbour}/{match.group('parameters')}" for neighbour in paths[index + 1:index + 1 + depth]]
+    return [neighbour for neighbour in neighbours if cache is None or not cache.contains(neighbour)]
+
+
+
+def coalescing_stats():
+    """Requests coalesced by this worker."""
+    return _single_flight.stats()
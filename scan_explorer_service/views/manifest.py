@@ -2,15 +2,18 @@
 from flask import Blueprint, current_app, jsonify, request, Response
 from flask_restful import abort
 from scan_explorer_service.extensions import manifest_factory
-from scan_explorer_service.models import Article, Page, Collection
+from scan_explorer_service.models import Article, Page, Collection, page_article_association_table
 from flask_discoverer import advertise
 from scan_explorer_service.open_search import EsFields, text_search_highlight
 from scan_explorer_service.utils.utils import proxy_url, url_for_proxy
 from scan_explorer_service.utils.cache import (
     cache_get_manifest, cache_set_manifest,
+    cache_get_manifest_validators, cache_set_manifest_validators,
     cache_get_search, cache_set_search,
     to_json_and_cache,
 )
+from scan_explorer_service.utils.http_utils import make_etag, is_not_modified, not_modified_response, set_validators
+from sqlalchemy import func
 from sqlalchemy.orm import selectinload
 from typing import Union
 import hashlib
@@ -32,6 +35,38 @@ def before_request():
     manifest_factory.set_base_image_uri(image_proxy)
 
 
+def manifest_validators(session, id: str):
+    """Compute the (etag, last_modified) validators of an article or collection manifest.
+
+    The manifest changes only when its collection is rewritten, which recreates every row
+    with a new `updated` timestamp, so the newest timestamp involved is a strong validator.
+    Returns None when the id matches neither an article nor a collection."""
+    article = session.query(Article.updated, Article.collection_id).filter(Article.id == id).one_or_none()
+    if article:
+        pages_updated = session.query(func.max(Page.updated))\
+            .join(page_article_association_table, page_article_association_table.c.page_id == Page.id)\
+            .filter(page_article_association_table.c.article_id == id)\
+            .scalar()
+        collection_updated = session.query(Collection.updated).filter(Collection.id == article.collection_id).scalar()
+        timestamps = [article.updated, pages_updated, collection_updated]
+    else:
+        collection_updated = session.query(Collection.updated).filter(Collection.id == id).scalar()
+        if collection_updated is None:
+            return None
+        pages_updated = session.query(func.max(Page.updated)).filter(Page.collection_id == id).scalar()
+        timestamps = [collection_updated, pages_updated]
+
+    last_modified = max(t for t in timestamps if t is not None)
+    server, prefix = proxy_url()
+    return make_etag('manifest', id, last_modified.isoformat(), server, prefix), last_modified
+
+
+def canvas_validators(page: Page):
+    """Compute the (etag, last_modified) validators of a page canvas."""
+    server, prefix = proxy_url()
+    return make_etag('canvas', page.id, page.updated.isoformat(), server, prefix), page.updated
+
+
 @advertise(scopes=['api'], rate_limit=[5000, 3600*24])
 @bp_manifest.route('/<string:id>/manifest.json', methods=['GET'])
 def get_manifest(id: str):
@@ -39,16 +74,25 @@ def get_manifest(id: str):
 
     cached = cache_get_manifest(id)
     if cached is not None:
-        return Response(cached, content_type='application/json')
+        validators = cache_get_manifest_validators(id) or (None, None)
+        if validators[0] is not None and is_not_modified(*validators):
+            return not_modified_response(*validators)
+        return set_validators(Response(cached, content_type='application/json'), *validators)
 
     with current_app.session_scope() as session:
+        validators = manifest_validators(session, id)
+        if validators is None:
+            return jsonify(exception='Article not found'), 404
+        if is_not_modified(*validators):
+            return not_modified_response(*validators)
+
         item = session.query(Article).filter(Article.id == id).one_or_none()
 
         if item:
             manifest = manifest_factory.create_manifest(item)
             search_url = url_for_proxy('manifest.search', id=id)
             manifest_factory.add_search_service(manifest, search_url)
-            return to_json_and_cache(manifest, cache_set_manifest, id)
+            return manifest_response(manifest, id, validators)
 
         collection = session.query(Collection).filter(Collection.id == id).one_or_none()
 
@@ -72,11 +116,18 @@ def get_manifest(id: str):
                 collection, pages, articles, article_pages)
             search_url = url_for_proxy('manifest.search', id=id)
             manifest_factory.add_search_service(manifest, search_url)
-            return to_json_and_cache(manifest, cache_set_manifest, id)
+            return manifest_response(manifest, id, validators)
 
         return jsonify(exception='Article not found'), 404
 
 
+def manifest_response(manifest, id, validators):
+    """Cache a freshly built manifest with its validators and return it as a response."""
+    result = to_json_and_cache(manifest, cache_set_manifest, id)
+    cache_set_manifest_validators(id, *validators)
+    return set_validators(jsonify(result), *validators)
+
+
 @advertise(scopes=['api'], rate_limit=[5000, 3600*24])
 @bp_manifest.route('/canvas/<string:page_id>.json', methods=['GET'])
 def get_canvas(page_id: str):
@@ -84,8 +135,11 @@ def get_canvas(page_id: str):
     with current_app.session_scope() as session:
         page = session.query(Page).filter(Page.id == page_id).first()
         if page:
+            validators = canvas_validators(page)
+            if is_not_modified(*validators):
+                return not_modified_response(*validators)
             canvas = manifest_factory.get_or_create_canvas(page)
-            return canvas.toJSON(top=True)
+            return set_validators(jsonify(canvas.toJSON(top=True)), *validators)
         else:
             return jsonify(exception='Page not found'), 404
 
@@ -1,13 +1,17 @@
 from datetime import datetime, timezone
 from typing import Union
 from flask import Blueprint, current_app, jsonify, request
-from scan_explorer_service.utils.db_utils import article_get_or_create, article_overwrite, collection_overwrite, page_get_or_create, page_overwrite
+from scan_explorer_service.utils.db_utils import article_get_or_create, article_overwrite, collection_overwrite, page_get_or_create, page_overwrite, collection_thumbnail_paths, \
+    collection_page_image_paths
 from scan_explorer_service.models import Article, Collection, Page, page_article_association_table
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from flask_discoverer import advertise
 from scan_explorer_service.utils.search_utils import *
 from scan_explorer_service.views.view_utils import ApiErrors
-from scan_explorer_service.utils.cache import cache_delete_manifest, cache_get_search, cache_set_search
+from scan_explorer_service.utils.prewarm import prewarm_collection
+from scan_explorer_service.utils.pdf_cache import invalidate_pdf_cache
+from scan_explorer_service.utils.cache import cache_delete_manifest, cache_get_search, cache_set_search, cache_set_thumbnails, cache_delete_thumbnails, \
+    cache_delete_image_info, cache_delete_article_pdfs
 from scan_explorer_service.open_search import EsFields, page_os_search, aggregate_search, page_ocr_os_search
 import opensearchpy
 import requests
@@ -64,6 +68,8 @@ def put_article():
             try:
                 article = Article(**json)
                 article_overwrite(session, article)
+                cache_delete_thumbnails([('article', article.id)])
+                cache_delete_article_pdfs([article.id])
                 return jsonify({'id': article.bibcode}), 200
             except Exception:
                 session.rollback()
@@ -131,13 +137,14 @@ def put_collection():
                     session.execute(
                         pg_insert(page_article_association_table).values(page_article_data).on_conflict_do_nothing()
                     )
+                collection_id = collection.id
                 session.commit()
-                cache_delete_manifest(collection.id)
-
-                return jsonify({'id': collection.id}), 200
             except Exception:
                 session.rollback()
                 return jsonify(message='Failed to create collection'), 500
+
+            refresh_collection_caches(session, collection_id, list(articles_data))
+            return jsonify({'id': collection_id}), 200
     else:
         return jsonify(message='Invalid collection json'), 400
 
@@ -160,14 +167,46 @@ def put_page():
                 session.add(page)
                 session.commit()
                 session.refresh(page)
-                return jsonify({'id': page.id}), 200
+                page_id = page.id
             except Exception:
                 session.rollback()
                 return jsonify(message='Failed to create page'), 500
+
+            refresh_page_caches(session, page)
+            return jsonify({'id': page_id}), 200
     else:
         return jsonify(message='Invalid page json'), 400
 
 
+def refresh_collection_caches(session, collection_id, bibcodes):
+    """Invalidate the cached data of a stored collection and warm it again. Failures are only
+    logged since the collection is stored by then."""
+    try:
+        cache_delete_manifest(collection_id)
+        cache_delete_image_info(collection_page_image_paths(session, collection_id))
+        invalidate_pdf_cache(collection_id)
+        cache_delete_article_pdfs(bibcodes)
+        thumbnails = collection_thumbnail_paths(session, collection_id)
+        cache_set_thumbnails(thumbnails)
+        prewarm_collection(session, collection_id, thumbnails)
+    except Exception:
+        session.rollback()
+        current_app.logger.exception(f"Failed to refresh the caches of collection {collection_id}")
+
+
+def refresh_page_caches(session, page):
+    """Invalidate the cached data of a stored page. Failures are only logged since the page is stored by then."""
+    page_id = page.id
+    try:
+        cache_delete_thumbnails([('page', page.id), ('collection', page.collection_id)] +
+                                [('article', article.id) for article in page.articles])
+        cache_delete_image_info([page.image_path])
+        invalidate_pdf_cache(page.collection_id)
+    except Exception:
+        session.rollback()
+        current_app.logger.exception(f"Failed to refresh the caches of page {page_id}")
+
+
 def _make_search_cache_key(prefix, args):
     """Build an MD5 cache key from the search type prefix and all query params (including multi-valued)."""
     raw = prefix + str(sorted(args.items(multi=True)))
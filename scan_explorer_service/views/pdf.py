@@ -0,0 +1,316 @@
+from flask import Blueprint, Response, current_app, request, stream_with_context, jsonify
+from flask_discoverer import advertise
+import math
+import hashlib
+import tempfile
+from scan_explorer_service.models import Article, Collection
+from scan_explorer_service.utils.db_utils import get_item, get_pages
+from scan_explorer_service.utils.page_images import MASTER_DPI, fetch_images, lite_images
+from scan_explorer_service.utils.article_pdf import fetch_article, index_article_pdfs
+from scan_explorer_service.utils.pdf_stream import StreamingPdfWriter
+from scan_explorer_service.utils.pdf_cache import get_pdf_store, get_pdf_job_store, pdf_cache_key
+from scan_explorer_service.utils.pdf_jobs import PdfJob, get_pdf_job_runner, is_stale
+from scan_explorer_service.utils.transcode import get_transcoder
+from scan_explorer_service.utils.cache import cache_get_pdf_job, cache_set_pdf_job
+from scan_explorer_service.utils.utils import url_for_proxy
+
+bp_pdf = Blueprint('pdf', __name__, url_prefix='/image')
+
+
+def generate_pdf(item, session, page_start, page_end, page_limit, memory_limit, dpi=None):
+    """Return a pre-rendered PDF for articles if available, otherwise generate one from page images."""
+    if isinstance(item, Article) and not dpi:
+        response = fetch_article(item, memory_limit)
+        if response:
+            return response
+        else:
+            current_app.logger.debug(f"Response fetch article was empty")
+            page_end = page_limit
+    current_app.logger.debug(f"Article is not an article or fetch article failed.")
+    store = get_pdf_store()
+    if store is None:
+        return streamed_pdf_response(page_images(session, item, page_start, page_end, page_limit, memory_limit, dpi),
+                                     dpi=dpi)
+
+    collection = item if isinstance(item, Collection) else item.collection
+    key = pdf_cache_key(collection, item.id, page_start, min(page_end, page_start + page_limit - 1), dpi)
+    stored = store.open(key)
+    if stored is not None:
+        return stored_pdf_response(*stored)
+    return streamed_pdf_response(page_images(session, item, page_start, page_end, page_limit, memory_limit, dpi),
+                                 store, key, dpi)
+
+
+def page_images(session, item, page_start, page_end, page_limit, memory_limit, dpi=None):
+    """Page images to put in a PDF, downscaled to dpi or transcoded when configured."""
+    if dpi:
+        return lite_images(session, item, page_start, page_end, page_limit, dpi)
+    if not current_app.config.get('IMAGE_PDF_TRANSCODE'):
+        return fetch_images(session, item, page_start, page_end, page_limit, memory_limit)
+    return get_transcoder().imap(
+        fetch_images(session, item, page_start, page_end, page_limit, memory_limit, with_color_type=True))
+
+
+def stored_pdf_response(chunks, size, close):
+    """Stream a previously generated PDF from the PDF store."""
+    resp = Response(chunks, mimetype='application/pdf')
+    if size is not None:
+        resp.headers['Content-Length'] = size
+    resp.headers['X-Cache'] = 'HIT'
+    resp.call_on_close(close)
+    return resp
+
+
+def streamed_pdf_response(images, store=None, key=None, dpi=None):
+    """Stream a PDF with a page per image, writing every page as soon as its image arrives."""
+    writer = StreamingPdfWriter(dpi)
+    spool = tempfile.TemporaryFile() if store is not None else None
+    state = {'complete': False, 'skipped': 0}
+    # the response only starts with a converted page, so that a PDF without any still gets an error
+    images = iter(images)
+    first = None
+    for im in images:
+        first = pdf_page(writer, im)
+        if first is not None:
+            break
+        state['skipped'] += 1
+    if first is None:
+        raise ValueError("No page images could be converted to PDF")
+
+    @stream_with_context
+    def generate():
+        for data in chunks():
+            if spool is not None:
+                spool.write(data)
+            yield data
+        state['complete'] = True
+
+    def chunks():
+        yield first
+        for im in images:
+            data = pdf_page(writer, im)
+            if data is None:
+                state['skipped'] += 1
+            else:
+                yield data
+        if state['skipped']:
+            current_app.logger.warning(f"Generated PDF is missing {state['skipped']} pages")
+        yield writer.close(missing_pages=state['skipped'])
+
+    resp = Response(generate(), mimetype='application/pdf')
+    if store is not None:
+        app = current_app._get_current_object()
+
+        def save():
+            with app.app_context(), spool:
+                if state['complete'] and not state['skipped']:
+                    spool.seek(0)
+                    try:
+                        store.put(key, spool)
+                    except Exception as e:
+                        app.logger.warning(f"Failed to store generated PDF {key}: {e}")
+
+        resp.headers['X-Cache'] = 'MISS'
+        resp.call_on_close(save)
+    return resp
+
+
+def pdf_page(writer, im):
+    """Add a page image to a PDF, returning None when there is no image or it cannot be converted."""
+    if im is None:
+        return None
+    try:
+        return writer.add_image(im)
+    except Exception as e:
+        current_app.logger.error(f"Failed to convert a page image to PDF: {e}")
+        return None
+
+
+@advertise(scopes=['api'], rate_limit=[5000, 3600*24])
+@bp_pdf.route('/pdf', methods=['GET'])
+def pdf_save():
+    """Generate a PDF from pages"""
+    try:
+        id = request.args.get('id')
+        page_start = request.args.get('page_start', 1, int)
+        page_end = request.args.get('page_end', math.inf, int)
+        memory_limit = current_app.config.get("IMAGE_PDF_MEMORY_LIMIT")
+        page_limit = current_app.config.get("IMAGE_PDF_PAGE_LIMIT")
+        quality = request.args.get('quality', 'full')
+        dpi = request.args.get('dpi', None, int)
+
+        if quality not in ('full', 'lite'):
+            return jsonify(Message=f"Invalid quality {quality}, expected full or lite"), 400
+        if quality == 'lite' and dpi is None:
+            dpi = current_app.config.get('IMAGE_PDF_LITE_DPI', 150)
+        if dpi is not None and not 0 < dpi <= MASTER_DPI:
+            return jsonify(Message=f"Invalid dpi {dpi}, expected at most {MASTER_DPI}"), 400
+        if dpi == MASTER_DPI:
+            dpi = None
+
+        if page_end < page_start:
+            return jsonify(Message=f"page_end {page_end} is before page_start {page_start}"), 400
+        if page_end != math.inf and (page_end - page_start + 1) > page_limit:
+            return jsonify(Message=f"Requested {page_end - page_start + 1} pages exceeds limit of {page_limit}"), 400
+
+        if not id:
+            return jsonify(Message="Missing required parameter: id"), 400
+
+        with current_app.session_scope() as session:
+
+            item = get_item(session, id)
+            current_app.logger.debug(f"Item retrieved successfully: {item.id}")
+
+            response = generate_pdf(item, session, page_start, page_end, page_limit, memory_limit, dpi)
+            return response
+    except Exception as e:
+        return jsonify(Message=str(e)), 400
+
+
+@advertise(scopes=['ads:scan-explorer'], rate_limit=[100, 3600*24])
+@bp_pdf.route('/pdf/index', methods=['POST'])
+def pdf_index():
+    """Record which articles of a collection have a pre-rendered PDF from a listing of the PDF bucket"""
+    id = request.args.get('id')
+    if not id:
+        return jsonify(Message="Missing required parameter: id, run `flask index-article-pdfs` to index every collection"), 400
+    try:
+        with current_app.session_scope() as session:
+            articles, found = index_article_pdfs(session, id)
+    except Exception as e:
+        return jsonify(Message=str(e)), 400
+    return jsonify({'articles': articles, 'found': found})
+
+
+@advertise(scopes=['api'], rate_limit=[500, 3600*24])
+@bp_pdf.route('/pdf/jobs', methods=['POST'])
+def pdf_job_submit():
+    """Queue the generation of a PDF in the background, e.g. for a whole volume, and return the job to poll"""
+    try:
+        id = request.args.get('id')
+        page_start = request.args.get('page_start', 1, int)
+        page_end = request.args.get('page_end', math.inf, int)
+        page_limit = current_app.config.get('IMAGE_PDF_JOB_PAGE_LIMIT', 2000)
+
+        if not id:
+            return jsonify(Message="Missing required parameter: id"), 400
+        if page_end < page_start:
+            return jsonify(Message=f"page_end {page_end} is before page_start {page_start}"), 400
+        if page_end != math.inf and (page_end - page_start + 1) > page_limit:
+            return jsonify(Message=f"Requested {page_end - page_start + 1} pages exceeds limit of {page_limit}"), 400
+        store = get_pdf_job_store()
+        if store is None:
+            return jsonify(Message="PDF jobs are disabled, they need a shared IMAGE_PDF_CACHE"), 503
+
+        with current_app.session_scope() as session:
+            item = get_item(session, id.replace(" ", "+"))
+            page_end = min(page_end, page_start + page_limit - 1)
+            collection = item if isinstance(item, Collection) else item.collection
+            key = pdf_cache_key(collection, item.id, page_start, page_end)
+            total = get_pages(item, session, page_start, page_end, page_limit).count()
+            item_id = item.id
+            collection_id = collection.id
+        if total == 0:
+            raise Exception(f"No pages found for {item_id} in range {page_start}-{page_end}")
+    except Exception as e:
+        return jsonify(Message=str(e)), 400
+
+    # Identical requests share a job until the collection is rewritten, which changes the key,
+    # or the PDF of the finished job was removed
+    job_id = hashlib.sha1(key.encode()).hexdigest()
+    status = pdf_job_status_of(job_id)
+    if status is not None and status['state'] != PdfJob.FAILED:
+        if status['state'] != PdfJob.DONE or store.exists(status['result_key']):
+            return pdf_job_response(status)
+
+    job = PdfJob(job_id, item_id, collection_id, page_start, page_end, key, total)
+    if store.exists(key):
+        job.state = PdfJob.DONE
+        job.pages_done = total
+        job.result_key = key
+        job.finished_at = job.queued_at
+        publish_pdf_job(job)
+    elif not get_pdf_job_runner(run_pdf_job, publish_pdf_job).submit(job):
+        resp = jsonify(Message="Too many PDF jobs queued, retry later")
+        resp.status_code = 503
+        resp.headers['Retry-After'] = '60'
+        return resp
+    return pdf_job_response(job.as_dict())
+
+
+@advertise(scopes=['api'], rate_limit=[50000, 3600*24])
+@bp_pdf.route('/pdf/jobs/<string:job_id>', methods=['GET'])
+def pdf_job_status(job_id):
+    """Progress of a PDF job"""
+    status = pdf_job_status_of(job_id)
+    if status is None:
+        return jsonify(Message=f"No PDF job {job_id}"), 404
+    return pdf_job_response(status)
+
+
+@advertise(scopes=['api'], rate_limit=[5000, 3600*24])
+@bp_pdf.route('/pdf/jobs/<string:job_id>/pdf', methods=['GET'])
+def pdf_job_download(job_id):
+    """Download the PDF of a finished job"""
+    status = pdf_job_status_of(job_id)
+    if status is None:
+        return jsonify(Message=f"No PDF job {job_id}"), 404
+    if status['state'] != PdfJob.DONE:
+        return jsonify(Message=f"PDF job {job_id} is {status['state']}"), 409
+    store = get_pdf_job_store()
+    stored = store.open(status['result_key']) if store is not None else None
+    if stored is None:
+        return jsonify(Message=f"The PDF of job {job_id} is no longer available, submit the job again"), 404
+    return stored_pdf_response(*stored)
+
+
+def pdf_job_response(status):
+    """Public view of a job's status, with the URLs to poll it and download its PDF."""
+    data = {name: value for name, value in status.items() if name not in ('key', 'result_key')}
+    data['status_url'] = url_for_proxy('pdf.pdf_job_status', job_id=status['id'])
+    if status['state'] == PdfJob.DONE:
+        data['download_url'] = url_for_proxy('pdf.pdf_job_download', job_id=status['id'])
+    resp = jsonify(data)
+    resp.status_code = 200 if status['state'] in (PdfJob.DONE, PdfJob.FAILED) else 202
+    resp.headers['Location'] = data['status_url']
+    return resp
+
+
+def pdf_job_status_of(job_id):
+    """Status of a PDF job, reported as failed when the worker running it stopped without finishing it."""
+    status = cache_get_pdf_job(job_id)
+    if status is not None and is_stale(status, current_app.config.get('IMAGE_PDF_JOB_STALE_AFTER', 120)):
+        status.update(state=PdfJob.FAILED, error="The worker running the job stopped, submit the job again")
+    return status
+
+
+def publish_pdf_job(job):
+    cache_set_pdf_job(job.id, job.as_dict())
+
+
+def run_pdf_job(job, progress):
+    """Generate the PDF of a job into the job store and return its key."""
+    writer = StreamingPdfWriter()
+    with current_app.session_scope() as session, tempfile.TemporaryFile() as spool:
+        item = get_item(session, job.item_id)
+        for im in page_images(session, item, job.page_start, job.page_end, job.total,
+                              current_app.config.get('IMAGE_PDF_MEMORY_LIMIT')):
+            data = pdf_page(writer, im)
+            if data is None:
+                job.pages_skipped += 1
+            else:
+                spool.write(data)
+            job.pages_done += 1
+            progress()
+        if not writer.page_ids:
+            raise ValueError("No page images could be converted to PDF")
+        spool.write(writer.close(missing_pages=job.pages_skipped))
+        spool.seek(0)
+
+        # Incomplete documents are kept apart so that /pdf never serves them
+        key = job.key if not job.pages_skipped else f'{job.key[:-len(".pdf")]}-{job.id}.pdf'
+        store = get_pdf_job_store()
+        if store is None:
+            raise ValueError("PDF jobs need a shared IMAGE_PDF_CACHE")
+        store.put(key, spool)
+    return key
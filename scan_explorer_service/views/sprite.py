@@ -0,0 +1,136 @@
+from flask import Blueprint, Response, current_app, request, jsonify
+from flask_discoverer import advertise
+from scan_explorer_service.utils.db_utils import get_item, get_pages
+from scan_explorer_service.utils.image_utils import fetch_derivatives
+from scan_explorer_service.utils.image_cache import get_image_cache
+from scan_explorer_service.utils.http_utils import make_etag, is_not_modified, not_modified_response, set_validators
+from scan_explorer_service.utils.single_flight import SingleFlight
+from scan_explorer_service.utils.sprite import build_sprite, sprite_layout
+from scan_explorer_service.utils.cache import cache_get_sprite, cache_set_sprite
+from scan_explorer_service.utils.utils import url_for_proxy
+from scan_explorer_service.views.image_proxy import cached_image_response
+
+bp_sprite = Blueprint('sprite', __name__, url_prefix='/image')
+
+_single_flight = SingleFlight()
+
+
+def sprite_pages(session):
+    """Resolve the item and page range of a sprite request as (item, pages, page_start, page_end, etag)."""
+    id = request.args.get('id')
+    if not id:
+        raise Exception("Missing required parameter: id")
+    id = id.replace(" ", "+")
+    page_limit = current_app.config.get('IMAGE_SPRITE_PAGE_LIMIT', 100)
+    page_start = request.args.get('page_start', 1, int)
+    page_end = request.args.get('page_end', page_start + page_limit - 1, int)
+    if page_end - page_start + 1 > page_limit:
+        raise Exception(f"Requested {page_end - page_start + 1} pages exceeds limit of {page_limit}")
+
+    item = get_item(session, id)
+    pages = get_pages(item, session, page_start, page_end, page_limit).all()
+    if not pages:
+        raise Exception(f"No pages found for {item.id} in range {page_start}-{page_end}")
+
+    updated = max(page.updated for page in pages)
+    etag = make_etag('sprite', item.id, page_start, page_end,
+                     current_app.config.get('IMAGE_SPRITE_TILE_SIZE', 120),
+                     current_app.config.get('IMAGE_SPRITE_COLUMNS', 10),
+                     current_app.config.get('IMAGE_SPRITE_QUALITY', 80),
+                     updated.isoformat(), *[page.id for page in pages])
+    return item, pages, page_start, page_end, etag
+
+
+@advertise(scopes=['api'], rate_limit=[5000, 3600*24])
+@bp_sprite.route('/sprite', methods=['GET'])
+def sprite_map():
+    """Offset map of the thumbnail sprite for a range of pages of an article or collection"""
+    try:
+        with current_app.session_scope() as session:
+            item, pages, page_start, page_end, etag = sprite_pages(session)
+            if is_not_modified(etag):
+                return not_modified_response(etag)
+
+            tile_size = current_app.config.get('IMAGE_SPRITE_TILE_SIZE', 120)
+            columns = current_app.config.get('IMAGE_SPRITE_COLUMNS', 10)
+            width, height, offsets = sprite_layout(len(pages), tile_size, columns)
+            data = {
+                'id': item.id,
+                'page_start': page_start,
+                'page_end': page_end,
+                'sprite': url_for_proxy('sprite.sprite_image', id=item.id, page_start=page_start, page_end=page_end),
+                'width': width,
+                'height': height,
+                'tile_width': tile_size,
+                'tile_height': tile_size,
+                'pages': [{
+                    'id': page.id,
+                    'label': page.label,
+                    'volume_running_page_num': page.volume_running_page_num,
+                    'x': x,
+                    'y': y
+                } for page, (x, y) in zip(pages, offsets)]
+            }
+        return set_validators(jsonify(data), etag)
+    except Exception as e:
+        current_app.logger.exception(f'{e}')
+        return jsonify(Message=str(e)), 400
+
+
+@advertise(scopes=['api'], rate_limit=[5000, 3600*24])
+@bp_sprite.route('/sprite.jpg', methods=['GET'])
+def sprite_image():
+    """Thumbnails of a range of pages of an article or collection composited into a single image"""
+    try:
+        with current_app.session_scope() as session:
+            _, pages, _, _, etag = sprite_pages(session)
+            paths = [page.thumbnail_path for page in pages]
+    except Exception as e:
+        current_app.logger.exception(f'{e}')
+        return jsonify(Message=str(e)), 400
+
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+
+    key = f'sprite/{etag}'
+    cache = get_image_cache()
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        try:
+            return cached_image_response(*cached)
+        except OSError:
+            current_app.logger.debug(f"Cached sprite {key} was evicted while serving")
+
+    headers = [('Content-Type', 'image/jpeg'), ('ETag', f'"{etag}"'),
+               ('Cache-Control', f'public, max-age={current_app.config.get("IMAGE_SPRITE_MAX_AGE", 86400)}')]
+
+    # Concurrent requests for the same sprite in a worker share a single build. Built sprites
+    # are also kept in Redis, so that they are not built again by other workers or when the
+    # disk cache is disabled
+    flight, leader = _single_flight.join(key)
+    body = None
+    built = False
+    if not leader:
+        body = _single_flight.wait(flight, current_app.config.get('IMAGE_PROXY_COALESCE_WAIT', 10))
+    if body is None:
+        try:
+            body = cache_get_sprite(etag)
+            if body is None:
+                body = build_sprite(fetch_derivatives(paths, current_app.config.get('IMAGE_SPRITE_WORKERS', 8)),
+                                    current_app.config.get('IMAGE_SPRITE_TILE_SIZE', 120),
+                                    current_app.config.get('IMAGE_SPRITE_COLUMNS', 10),
+                                    current_app.config.get('IMAGE_SPRITE_QUALITY', 80))
+                built = True
+        finally:
+            if leader:
+                _single_flight.finish(key, flight, body)
+        if built:
+            cache_set_sprite(etag, body)
+        if cache is not None and leader:
+            writer = cache.writer(key, headers)
+            writer.write(body)
+            writer.commit()
+
+    resp = Response(body, headers=headers)
+    resp.headers['X-Cache'] = 'MISS' if built else 'HIT'
+    return resp